@@ -4,4 +4,6 @@ from .models import *
 # Register your models here.
 
 admin.site.register(User)
-admin.site.register(CDS_Group)
\ No newline at end of file
+admin.site.register(CDS_Group)
+admin.site.register(Notification)
+admin.site.register(OutgoingEmail)
@@ -0,0 +1,90 @@
+"""
+Claims-based JWT authentication.
+
+Tokens from ClaimsRefreshToken.for_user carry the username, the permission
+flags read by administrator.permissions and the user's auth version, a
+counter User.save bumps whenever one of REVOKING_FIELDS changes. Requests
+authenticate against the claims without loading the user: the only lookup
+is the account's current auth version, cached for
+JWT_CLAIMS["VERSION_TIMEOUT"] seconds and dropped by administrator.signals
+when the user changes. A token whose version no longer matches, because a
+claim, the password or the active flag changed or the account was
+deleted, is rejected and the user has to log in again. The counter never
+goes back, so reverting a change does not revive older tokens. Tokens
+issued before claims were embedded still authenticate with a database
+lookup.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# User fields embedded in tokens
+CLAIM_FIELDS = ('username', 'is_superuser', 'is_cds_leader', 'can_post', 'can_comment', 'can_chat')
+VERSION_CLAIM = 'auth_version'
+
+# Changing any of these bumps User.auth_version and so revokes the user's tokens
+REVOKING_FIELDS = (*CLAIM_FIELDS, 'password', 'is_active')
+
+# Cached version of accounts that are inactive or gone, no token matches it
+INACTIVE = -1
+
+
+def auth_version_key(user_id):
+    return f'auth_version:{user_id}'
+
+
+def invalidate_auth_version(user_id):
+    cache.delete(auth_version_key(user_id))
+
+
+def current_auth_version(user_id):
+    key = auth_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        User = apps.get_model('administrator', 'User')
+        version = User.objects.filter(id=user_id, is_active=True).values_list('auth_version', flat=True).first()
+        if version is None:
+            version = INACTIVE
+        cache.set(key, version, settings.JWT_CLAIMS["VERSION_TIMEOUT"])
+    return version
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh token carrying the user's flags, copied into its access tokens."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for field in CLAIM_FIELDS:
+            token[field] = getattr(user, field)
+        token[VERSION_CLAIM] = user.auth_version
+        return token
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    request.user is a User built from the claims, other fields are deferred
+    and each costs a query on first access. Views that need the full row,
+    e.g. to check the password, should reload it.
+    """
+
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        if validated_token[VERSION_CLAIM] != current_auth_version(user_id):
+            raise AuthenticationFailed("Your access has changed, please log in again", code="token_outdated")
+
+        values = {'id': user_id, 'is_active': True, **{field: validated_token[field] for field in CLAIM_FIELDS}}
+        fields = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in values]
+        return self.user_model.from_db('default', fields, [values[name] for name in fields])
@@ -0,0 +1,109 @@
+"""
+Avatar registry and thumbnail pipeline.
+
+The default avatars in MEDIA_ROOT/profile_picture are listed once per
+process. Every picture gets fixed-size JPEG and WebP thumbnails: uploads
+when they are saved, defaults the first time they are handed out. Payloads
+use the JPEG thumbnail through avatar_url(), which resolves storage URLs
+once per file and the request's host once per request.
+"""
+import os
+import random
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+AVATAR_DIR = 'profile_picture'
+THUMBNAIL_DIR = f'{AVATAR_DIR}/thumbnails'
+THUMBNAIL_SIZE = 128
+THUMBNAIL_FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 80},
+}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+
+@lru_cache(maxsize=1)
+def default_avatars():
+    """Names of the default avatars, read from disk once per process."""
+    path = os.path.join(settings.MEDIA_ROOT, AVATAR_DIR)
+    return tuple(sorted(
+        f'{AVATAR_DIR}/{entry.name}' for entry in os.scandir(path)
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+    ))
+
+
+def random_default_avatar():
+    return random.choice(default_avatars())
+
+
+def thumbnail_name(name, fmt='jpeg'):
+    """
+    Thumbnail path of the picture stored as `name`. The whole storage name,
+    directories and extension included, is kept so two pictures never share
+    a thumbnail: "profile_picture/me.png" gives
+    "profile_picture/thumbnails/profile_picture/me.png_128.jpg".
+    """
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return f'{THUMBNAIL_DIR}/{name}_{THUMBNAIL_SIZE}.{extension}'
+
+
+def generate_thumbnails(name):
+    """Write the JPEG and WebP thumbnails of `name` and return the JPEG one."""
+    with default_storage.open(name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = ImageOps.fit(image.convert('RGB'), (THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+
+    for fmt, options in THUMBNAIL_FORMATS.items():
+        buffer = BytesIO()
+        image.save(buffer, **options)
+        target = thumbnail_name(name, fmt)
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    return thumbnail_name(name)
+
+
+@lru_cache(maxsize=None)
+def default_thumbnail(name):
+    """Thumbnail of a default avatar, generated the first time it is needed."""
+    target = thumbnail_name(name)
+    if not default_storage.exists(target):
+        generate_thumbnails(name)
+    return target
+
+
+@lru_cache(maxsize=4096)
+def media_url(name):
+    return default_storage.url(name)
+
+
+def absolute_media_url(base_url, name):
+    url = media_url(name)
+    return url if url.startswith(('http://', 'https://')) else f'{base_url}{url}'
+
+
+def request_base_url(request):
+    """scheme://host of the request, computed once per request."""
+    base_url = getattr(request, '_avatar_base_url', None)
+    if base_url is None:
+        base_url = request.build_absolute_uri('/').rstrip('/')
+        request._avatar_base_url = base_url
+    return base_url
+
+
+def avatar_name(user):
+    """Storage name of the user's avatar thumbnail, or of the original picture without one."""
+    return user.avatar_thumbnail or (user.profile_picture.name if user.profile_picture else None)
+
+
+def avatar_url(request, user):
+    """Absolute URL of the user's avatar thumbnail, or of the original picture without one."""
+    name = avatar_name(user)
+    if not name:
+        return None
+    return absolute_media_url(request_base_url(request), name)
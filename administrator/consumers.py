@@ -1,13 +1,20 @@
-import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from kastina_forum.protocol import CompactProtocolMixin
 
+from .notifications import mark_delivered, notification_event, undelivered, user_notification_group
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(CompactProtocolMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        # Create a group for all users (for broadcasting)
-        self.group_name = "notifications_group"
+        self.user = self.scope.get('user', None)
+        if self.user is None or self.user.is_anonymous:
+            await self.close()
+            return
+
+        # Each user has its own group, notifications are only sent to their recipients
+        self.group_name = user_notification_group(self.user.id)
 
         # Join the group
         await self.channel_layer.group_add(
@@ -17,35 +24,41 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        # Whatever arrived while the user was offline
+        backlog = await self.get_undelivered()
+        if backlog:
+            await self.notification_message(backlog)
+
     async def disconnect(self, close_code):
+        if not hasattr(self, 'group_name'):
+            return
+
         # Leave the group when the WebSocket is closed
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
 
-    # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-
-        # Broadcast the message to the group
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'notification_message',
-                'message': message
-            }
-        )
+    async def receive(self, text_data=None, bytes_data=None):
+        # Notifications are created by the server, clients have nothing to send
+        pass
 
     # Receive notification from the group
     async def notification_message(self, event):
-        message = event['message']
-
-        # Send the message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message
-        }))
+        # Send the broadcast frame to WebSocket, events from other senders may carry a bare message
+        if 'payload' in event:
+            await self.send_frames(event)
+        else:
+            await self.send_payload({'message': event['message']})
 
+        if event.get('ids'):
+            await self.mark_delivered(event['ids'])
 
+    @database_sync_to_async
+    def get_undelivered(self):
+        notifications = undelivered(self.user.id)
+        return notification_event(notifications) if notifications else None
 
+    @database_sync_to_async
+    def mark_delivered(self, ids):
+        mark_delivered(self.user.id, ids)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from administrator import avatars
+from administrator.models import User
+
+
+class Command(BaseCommand):
+    help = "Generate avatar thumbnails for users that have none (pass --all to regenerate every one)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true")
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(profile_picture="").exclude(profile_picture__isnull=True)
+        if not options["all"]:
+            users = users.filter(avatar_thumbnail="")
+
+        # Many users share a default picture, generate each file once
+        names = users.order_by().values_list("profile_picture", flat=True).distinct()
+        generated = 0
+        for name in names.iterator():
+            try:
+                thumbnail = avatars.generate_thumbnails(name)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Skipping {name}: {e}")
+                continue
+            User.objects.filter(profile_picture=name).update(avatar_thumbnail=thumbnail)
+            generated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Generated thumbnails for {generated} pictures"))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from administrator.services import EmailOutboxWorker
+
+
+class Command(BaseCommand):
+    help = "Send due emails from the outbox. Pass --loop to keep polling every N seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        worker = EmailOutboxWorker(options["batch_size"])
+        try:
+            while True:
+                sent, failed = worker.run_once()
+                while sent or failed:
+                    self.stdout.write(f"Sent {sent} emails, {failed} failed")
+                    if not options["loop"]:
+                        break
+                    # Keep draining while there is a backlog
+                    sent, failed = worker.run_once()
+                if not options["loop"]:
+                    break
+                time.sleep(options["loop"])
+        finally:
+            worker.close()
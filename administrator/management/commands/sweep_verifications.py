@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from administrator.verification import delete_in_batches, expired_verifications, stale_accounts
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete verification codes that expired unused and accounts never verified within "
+        "VERIFICATION['STALE_ACCOUNT_DAYS']. Pass --loop to repeat every N seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or settings.VERIFICATION["SWEEP_BATCH_SIZE"]
+        while True:
+            # Accounts first, their verification rows go with them
+            accounts = delete_in_batches(stale_accounts(), batch_size)
+            codes = delete_in_batches(expired_verifications(), batch_size)
+            if accounts or codes:
+                self.stdout.write(f"Deleted {accounts} stale accounts and {codes} expired verification codes")
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -1,41 +1,73 @@
-import jwt
+import logging
 from urllib.parse import parse_qs
-from channels.middleware import BaseMiddleware
+
 from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+# Fields kept in the cached user snapshot, enough for permission checks in consumers
+SNAPSHOT_FIELDS = (
+    'id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser', 'cds_group_id',
+    'is_cds_leader', 'can_post', 'can_comment', 'can_chat', 'profile_picture', 'avatar_thumbnail',
+)
+
+
+def user_snapshot_key(user_id):
+    return f'ws_user:{user_id}'
+
+
+def invalidate_user_snapshot(user_id):
+    cache.delete(user_snapshot_key(user_id))
 
-from django.apps import apps
 
 class JWTAuthMiddleware(BaseMiddleware):
-    
+    """
+    Authenticates sockets from the `token` query parameter. Users are read
+    through a snapshot cached per user id for WS_USER_CACHE["TIMEOUT"]
+    seconds and dropped by administrator.signals when the user changes, so a
+    reconnect storm does not hit the database once per handshake.
+    """
+
     async def __call__(self, scope, receive, send):
         query_string = parse_qs(scope["query_string"].decode())
         token = query_string.get("token", [None])[0]
 
-        if not token:
-            from django.contrib.auth.models import AnonymousUser
-            scope["user"] = AnonymousUser()
-            return await super().__call__(scope, receive, send)
-        else:
-            from django.contrib.auth.models import AnonymousUser
+        scope["user"] = AnonymousUser()
+        if token:
             try:
-                from rest_framework_simplejwt.tokens import AccessToken
-                decoded_token = AccessToken(token)
-                decoded_token.verify()  # Explicit verification
-                user = await get_user(decoded_token["user_id"])
-                scope["user"] = user or AnonymousUser()
-            except TokenError as e:
+                decoded_token = AccessToken(token)  # Verifies signature and expiry
+                user = await get_user(decoded_token[settings.SIMPLE_JWT["USER_ID_CLAIM"]])
+                if user is not None and user.is_active:
+                    scope["user"] = user
+            except (TokenError, KeyError) as e:
                 # Catches ALL JWT errors (expired, invalid, etc)
-                print(f"Token error: {str(e)}")  # Log for debugging
-                scope["user"] = AnonymousUser()
+                logger.info("Rejected WebSocket token: %s", e)
 
         return await super().__call__(scope, receive, send)
 
 
+async def get_user(user_id):
+    User = apps.get_model('administrator', 'User')
+    snapshot = await cache.aget(user_snapshot_key(user_id))
+    if snapshot is None:
+        snapshot = await load_snapshot(user_id)
+        if snapshot is None:
+            return None
+        await cache.aset(user_snapshot_key(user_id), snapshot, settings.WS_USER_CACHE["TIMEOUT"])
+
+    # Saved instance built from the snapshot without a query, other fields are deferred
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in snapshot]
+    return User.from_db('default', fields, [snapshot[name] for name in fields])
+
+
 @database_sync_to_async
-def get_user(user_id):
+def load_snapshot(user_id):
     User = apps.get_model('administrator', 'User')
-    try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        return None
+    return User.objects.filter(id=user_id).values(*SNAPSHOT_FIELDS).first()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administrator', '0007_user_can_chat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
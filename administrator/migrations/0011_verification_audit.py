@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:01
+
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def backfill_email_verified_at(apps, schema_editor):
+    UserVerification = apps.get_model('administrator', 'UserVerification')
+    # Active users and used codes went through verification, the code date is the closest we have
+    UserVerification.objects.filter(Q(user__is_active=True) | Q(is_verified=True)).update(
+        email_verified_at=F('created_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administrator', '0010_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userverification',
+            name='email_verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userverification',
+            name='purpose',
+            field=models.CharField(choices=[('verify', 'Email verification'), ('reset', 'Password reset')], default='verify', max_length=10),
+        ),
+        migrations.RunPython(backfill_email_verified_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userverification',
+            index=models.Index(fields=['created_at'], name='administrat_created_3ef59c_idx'),
+        ),
+    ]
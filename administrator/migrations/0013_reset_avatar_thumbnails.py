@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:20
+
+from django.db import migrations
+
+
+def reset_thumbnails(apps, schema_editor):
+    User = apps.get_model('administrator', 'User')
+    # Thumbnails named after the picture's stem alone could belong to another
+    # picture. Payloads fall back to the original picture until
+    # generate_avatar_thumbnails writes them under the new names.
+    User.objects.exclude(avatar_thumbnail='').update(avatar_thumbnail='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administrator', '0012_user_auth_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_thumbnails, migrations.RunPython.noop),
+    ]
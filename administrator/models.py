@@ -1,9 +1,11 @@
 from datetime import timedelta
-import random
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
+from administrator import avatars
+from administrator.authentication import REVOKING_FIELDS
 from administrator.manager import UserManager
 
 # Create your models here.
@@ -34,23 +36,63 @@ class User(AbstractUser):
     can_comment = models.BooleanField(default=True)
     can_chat = models.BooleanField(default=True)
     profile_picture = models.ImageField(upload_to='profile_picture/', null=True, blank=True)
-    
+    avatar_thumbnail = models.CharField(max_length=255, blank=True)
+    # Bumped on save to revoke issued tokens, see administrator.authentication
+    auth_version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user.remember_revoking_values()
+        return user
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # Deferred fields read later are remembered as loaded
+        self.remember_revoking_values(fields)
+
+    def remember_revoking_values(self, fields=None):
+        """Keep the stored values of REVOKING_FIELDS, save compares against them."""
+        loaded = self.__dict__.setdefault('_revoking_values', {})
+        for field in REVOKING_FIELDS if fields is None else set(fields) & set(REVOKING_FIELDS):
+            if field in self.__dict__:
+                loaded[field] = self.__dict__[field]
+
+    def revoking_fields_changed(self, update_fields):
+        # Fields deferred and never read cannot have changed
+        loaded = self.__dict__.get('_revoking_values', {})
+        fields = REVOKING_FIELDS if update_fields is None else set(update_fields) & set(REVOKING_FIELDS)
+        return any(
+            field in self.__dict__ and (field not in loaded or loaded[field] != self.__dict__[field])
+            for field in fields
+        )
+
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        bump = not self._state.adding and self.revoking_fields_changed(update_fields)
+        if bump:
+            # Incremented in the database, a stale copy must not write back an old version
+            self.auth_version = models.F('auth_version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'auth_version'}
+
         if not self.profile_picture:
-            import os
-            import random
-            from django.conf import settings
-            
-            # List all files in the 'profile_picture' folder
-            profile_pictures_path = os.path.join(settings.MEDIA_ROOT, 'profile_picture')
-            profile_pictures = os.listdir(profile_pictures_path)
-
-            # Pick a random profile picture
-            random_picture = random.choice(profile_pictures)
-
-            # Set the profile picture path
-            self.profile_picture = f"profile_picture/{random_picture}"
+            # Pick a random default picture, the list is loaded once per process
+            self.profile_picture = avatars.random_default_avatar()
+            self.avatar_thumbnail = avatars.default_thumbnail(self.profile_picture.name)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'profile_picture', 'avatar_thumbnail'}
+
+        uploading = not self.profile_picture._committed
         super().save(*args, **kwargs)
+        self.remember_revoking_values(update_fields)
+        if bump:
+            self.refresh_from_db(fields=['auth_version'])
+
+        if uploading:
+            # The upload is stored by now, build its thumbnails
+            self.avatar_thumbnail = avatars.generate_thumbnails(self.profile_picture.name)
+            super().save(update_fields=['avatar_thumbnail'])
 
     objects=UserManager( )
     USERNAME_FIELD ='email'
@@ -68,19 +110,31 @@ class User(AbstractUser):
     
 
 class UserVerification(models.Model):
+    """
+    Audit record of the last code sent to a user. Active codes are held by
+    administrator.verification in the cache, they are never looked up here.
+    """
+    PURPOSE_CHOICES = [
+        ('verify', 'Email verification'),
+        ('reset', 'Password reset'),
+    ]
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     token = models.CharField(max_length=6)
+    purpose = models.CharField(max_length=10, choices=PURPOSE_CHOICES, default='verify')
     created_at = models.DateTimeField(auto_now_add=True)
     is_verified = models.BooleanField(default=False)
+    # First successful email verification, kept across password resets
+    email_verified_at = models.DateTimeField(null=True, blank=True)
 
-    def generate_token(self):
-        """Generate a 6-digit token"""
-        self.token = str(random.randint(100000, 999999))
-        self.created_at = timezone.now()
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
 
     def is_token_expired(self):
-        """Check if token is expired (valid for 10 minutes)"""
-        return timezone.now() > self.created_at + timedelta(minutes=10)
+        """Check if token is expired (valid for VERIFICATION["TOKEN_TTL"] seconds)"""
+        return timezone.now() > self.created_at + timedelta(seconds=settings.VERIFICATION["TOKEN_TTL"])
 
     def __str__(self):
         return f"Verification for {self.user.email}"
@@ -88,3 +142,67 @@ class UserVerification(models.Model):
     
     
 
+
+class Notification(models.Model):
+    """
+    Outbox of per-user notifications. Rows are pushed to online users by
+    administrator.notifications and stay undelivered for offline ones until
+    their next connect or pull.
+    """
+    KIND_CHOICES = [
+        ('comment', 'Comment'),
+        ('like', 'Like'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    post = models.ForeignKey('forum.Post', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['recipient', 'delivered_at', 'id']),
+            models.Index(fields=['recipient', 'created_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} notification for {self.recipient_id}"
+
+
+class OutgoingEmail(models.Model):
+    """
+    Email outbox. Views queue rows through administrator.services.queue_email
+    and the send_queued_emails worker delivers them over a reused SMTP
+    connection, retrying failures with exponential backoff.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When the row is next due; while sending it is the worker's lease
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
@@ -0,0 +1,143 @@
+"""
+Targeted notifications.
+
+notify() writes a Notification row and, once the surrounding transaction
+commits, sends it to the recipient's own channel group, so an event costs
+work proportional to its recipients. The notifications of a transaction go
+out together, one event per recipient. Sockets mark what they forwarded as
+delivered; rows of offline users wait for the next connect or for the pull
+endpoint, whose clients acknowledge what they received.
+"""
+import logging
+import weakref
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from kastina_forum.protocol import encode_frames
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+# Undelivered notifications sent to a socket when it connects
+CONNECT_BACKLOG = 50
+
+
+# connection -> batches registered in its open transaction, see pending_dispatch
+_batches = weakref.WeakKeyDictionary()
+
+
+def user_notification_group(user_id):
+    return f'notifications_user_{user_id}'
+
+
+class PendingDispatch:
+    """Notifications dispatched together by one on_commit hook."""
+
+    def __init__(self, savepoints):
+        self.savepoints = savepoints
+        self.notifications = []
+        self.dispatched = False
+
+    def __call__(self):
+        self.dispatched = True
+        dispatch(self.notifications)
+
+
+def pending_dispatch(connection):
+    """
+    The batch for a notification created now. A batch whose hook was
+    registered under savepoints that are all still open commits whenever
+    the new row does, so it can take it. Batches are held weakly: Django
+    drops the hook of a rolled back savepoint or transaction, and with it
+    the last reference to the batch, so a batch that will not run is never
+    handed out.
+    """
+    batches = _batches.setdefault(connection, weakref.WeakSet())
+    savepoints = frozenset(connection.savepoint_ids)
+    for batch in batches:
+        if not batch.dispatched and batch.savepoints <= savepoints:
+            return batch
+    batch = PendingDispatch(savepoints)
+    batches.add(batch)
+    transaction.on_commit(batch)
+    return batch
+
+
+def notify(recipient_id, kind, message, actor=None, post_id=None, once=False):
+    """
+    Record a notification for `recipient_id`, dispatched after commit. Self-actions
+    are skipped, and with `once` so are repeats of the same actor, post and kind,
+    e.g. liking a post again after unliking it.
+    """
+    if recipient_id is None or (actor is not None and actor.id == recipient_id):
+        return None
+    if once and Notification.objects.filter(
+        recipient_id=recipient_id, actor=actor, post_id=post_id, kind=kind
+    ).exists():
+        return None
+
+    notification = Notification.objects.create(
+        recipient_id=recipient_id, actor=actor, kind=kind, post_id=post_id, message=message
+    )
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        pending_dispatch(connection).notifications.append(notification)
+    else:
+        dispatch([notification])
+    return notification
+
+
+def dispatch(notifications):
+    per_recipient = {}
+    for notification in notifications:
+        per_recipient.setdefault(notification.recipient_id, []).append(notification)
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for recipient_id, notifications in per_recipient.items():
+        try:
+            async_to_sync(channel_layer.group_send)(
+                user_notification_group(recipient_id), notification_event(notifications)
+            )
+        except Exception as e:
+            # Still undelivered in the outbox, the recipient gets it on reconnect
+            logger.warning("Could not dispatch notifications to user %s: %s", recipient_id, e)
+
+
+def serialize(notification):
+    return {
+        'id': notification.id,
+        'kind': notification.kind,
+        'message': notification.message,
+        'post': notification.post_id,
+        'actor': notification.actor_id,
+        'created_at': serializers.DateTimeField().to_representation(notification.created_at),
+    }
+
+
+def notification_event(notifications):
+    return {
+        'type': 'notification_message',
+        'ids': [notification.id for notification in notifications],
+        **encode_frames({'notifications': [serialize(notification) for notification in notifications]}),
+    }
+
+
+def undelivered(user_id, limit=CONNECT_BACKLOG):
+    """Oldest undelivered notifications of a user."""
+    return list(
+        Notification.objects.filter(recipient_id=user_id, delivered_at__isnull=True)
+        .order_by('id')[:limit]
+    )
+
+
+def mark_delivered(user_id, ids):
+    return Notification.objects.filter(
+        recipient_id=user_id, id__in=ids, delivered_at__isnull=True
+    ).update(delivered_at=timezone.now())
@@ -47,7 +47,7 @@ class CanPostPermission(BasePermission):
     
     
 
-class CanPostPermission(BasePermission):
+class CanChatPermission(BasePermission):
 
     def has_permission(self, request, view):
         user = request.user
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from rest_framework.exceptions import ParseError
 
-from administrator.models import CDS_Group, User
+from administrator.models import CDS_Group, Notification, User
 
 class RegUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,6 +15,7 @@ class RegUserSerializer(serializers.ModelSerializer):
 
 
 class UserVerificationSerializer(serializers.Serializer):
+    email = serializers.EmailField(required=True)
     token = serializers.IntegerField(required = True)
     
         
@@ -38,6 +39,7 @@ class ForgetPasswordSerializer(serializers.Serializer):
     
     
 class ForgetPasswordVerificationTokenSerializer(serializers.Serializer):
+    email = serializers.EmailField(required=True)
     token = serializers.IntegerField(required=True)
     password = serializers.CharField(required=True)
     
@@ -92,4 +94,17 @@ class CDS_GroupReadSerializer(serializers.ModelSerializer):
     users = UserReadSerializer(many=True, read_only=True)
     class Meta:
         model = CDS_Group
-        fields = ["id",'name', 'description','users']
\ No newline at end of file
+        fields = ["id",'name', 'description','users']
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    actor = serializers.PrimaryKeyRelatedField(read_only=True)
+    post = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'message', 'post', 'actor', 'created_at', 'delivered_at']
+
+
+class NotificationAcknowledgeSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=100)
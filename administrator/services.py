@@ -1,4 +1,118 @@
+import logging
 import random
 from django.utils import timezone
 from datetime import timedelta
 
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, recipients, from_email=None):
+    """Put a message in the outbox and return right away, the worker sends it."""
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.EMAIL_HOST_USER or '',
+        recipients=list(recipients),
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter after `attempts` failed tries."""
+    config = settings.EMAIL_OUTBOX
+    delay = min(config["RETRY_BASE"] * 2 ** (attempts - 1), config["RETRY_MAX"])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class EmailOutboxWorker:
+    """
+    Sends due outbox rows in batches. The SMTP connection stays open across
+    batches and is only reopened after an error or an idle round.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.EMAIL_OUTBOX["BATCH_SIZE"]
+        self.connection = None
+
+    def claim_batch(self):
+        """
+        Lease due rows to this worker; rows of a worker that died become due
+        again when the lease runs out. Each claim counts as an attempt, so a
+        message that keeps crashing the worker still runs out of them.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                OutgoingEmail.objects.select_for_update(skip_locked=True)
+                .filter(status__in=['queued', 'sending'], next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'id')[:self.batch_size]
+            )
+            expired = [row for row in rows if row.attempts >= settings.EMAIL_OUTBOX["MAX_ATTEMPTS"]]
+            rows = [row for row in rows if row.attempts < settings.EMAIL_OUTBOX["MAX_ATTEMPTS"]]
+            for row in expired:
+                logger.error("Giving up on email %s to %s, its last attempt never finished", row.id, row.recipients)
+            OutgoingEmail.objects.filter(id__in=[row.id for row in expired]).update(
+                status='failed', last_error='Lease expired'
+            )
+            OutgoingEmail.objects.filter(id__in=[row.id for row in rows]).update(
+                status='sending',
+                attempts=F('attempts') + 1,
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX["LEASE"]),
+            )
+        for row in rows:
+            row.attempts += 1
+        return rows
+
+    def run_once(self):
+        """Send one batch, returns (sent, failed)."""
+        rows = self.claim_batch()
+        if not rows:
+            self.close()
+            return 0, 0
+
+        sent = failed = 0
+        for row in rows:
+            try:
+                if self.connection is None:
+                    self.connection = get_connection(fail_silently=False)
+                    self.connection.open()
+                EmailMessage(row.subject, row.body, row.from_email, row.recipients, connection=self.connection).send()
+            except Exception as e:
+                # The connection may be unusable after an error, start over with the next row
+                self.close()
+                self.record_failure(row, e)
+                failed += 1
+            else:
+                OutgoingEmail.objects.filter(pk=row.pk).update(
+                    status='sent', sent_at=timezone.now(), last_error=''
+                )
+                sent += 1
+        return sent, failed
+
+    def record_failure(self, row, error):
+        # The claim already counted this attempt
+        attempts = row.attempts
+        if attempts >= settings.EMAIL_OUTBOX["MAX_ATTEMPTS"]:
+            logger.error("Giving up on email %s to %s after %s attempts: %s", row.id, row.recipients, attempts, error)
+            OutgoingEmail.objects.filter(pk=row.pk).update(status='failed', last_error=str(error))
+        else:
+            logger.warning("Email %s to %s failed, retrying: %s", row.id, row.recipients, error)
+            OutgoingEmail.objects.filter(pk=row.pk).update(
+                status='queued',
+                last_error=str(error),
+                next_attempt_at=timezone.now() + retry_delay(attempts),
+            )
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
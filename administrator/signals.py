@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from kastina_forum.response_cache import invalidate_tags_on_commit
+
+from .authentication import invalidate_auth_version
+from .middlewares import invalidate_user_snapshot
+from .models import CDS_Group, User
+
+
+@receiver(post_save, sender=CDS_Group)
+@receiver(post_delete, sender=CDS_Group)
+def cds_group_changed(sender, instance, **kwargs):
+    invalidate_tags_on_commit('cds_group', f'cds_group:{instance.id}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def cds_group_member_changed(sender, instance, update_fields=None, **kwargs):
+    # CDS group details embed their members. Logins only touch last_login.
+    # A user moving groups leaves the old group's entry to expire with the cache timeout.
+    if instance.cds_group_id is None or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_tags_on_commit(f'cds_group:{instance.cds_group_id}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_snapshot_changed(sender, instance, update_fields=None, **kwargs):
+    # Flags such as is_active or can_chat must reach the next socket handshake
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def auth_version_changed(sender, instance, update_fields=None, **kwargs):
+    # The cached version is outdated if User.save bumped it
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_auth_version(user_id))
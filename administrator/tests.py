@@ -1,3 +1,527 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.conf import settings
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.encoding import force_bytes
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from forum.models import Like, Post, TrendingScore
+from kastina_forum import protocol, rate_limit
+from kastina_forum.protocol import COMPACT_SUBPROTOCOL, decode_frame, encode_frames
+from kastina_forum.rate_limit import MemoryRateLimiter, RedisRateLimiter
+from kastina_forum.testing import IN_MEMORY_LAYERS, create_user
+
+from . import avatars, verification
+from .authentication import ClaimsRefreshToken
+from .consumers import NotificationConsumer
+from .middlewares import JWTAuthMiddleware
+from .models import Notification, OutgoingEmail, User, UserVerification
+from .notifications import notify, user_notification_group
+from .services import EmailOutboxWorker, queue_email
+
+
+class AvatarTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        os.makedirs(os.path.join(media_root, avatars.AVATAR_DIR))
+        Image.new('RGB', (300, 200), 'red').save(os.path.join(media_root, avatars.AVATAR_DIR, 'default.png'))
+
+        media = override_settings(MEDIA_ROOT=media_root, MEDIA_URL='/media/')
+        media.enable()
+        self.addCleanup(media.disable)
+        for cached in (avatars.default_avatars, avatars.default_thumbnail, avatars.media_url):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def assertThumbnails(self, name):
+        for fmt in avatars.THUMBNAIL_FORMATS:
+            with default_storage.open(avatars.thumbnail_name(name, fmt)) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, (avatars.THUMBNAIL_SIZE, avatars.THUMBNAIL_SIZE))
+
+    def test_defaults_are_listed_once(self):
+        with mock.patch('administrator.avatars.os.scandir', wraps=os.scandir) as scandir:
+            first, second = create_user('first'), create_user('second')
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(first.profile_picture.name, 'profile_picture/default.png')
+        self.assertEqual(second.avatar_thumbnail, avatars.thumbnail_name('profile_picture/default.png'))
+        self.assertThumbnails('profile_picture/default.png')
+
+    def test_uploads_get_their_own_thumbnails(self):
+        user = create_user('uploader')
+        upload = io.BytesIO()
+        Image.new('RGB', (64, 640), 'blue').save(upload, 'PNG')
+        user.profile_picture = SimpleUploadedFile('me.png', upload.getvalue(), content_type='image/png')
+        user.save()
+
+        self.assertEqual(user.avatar_thumbnail, avatars.thumbnail_name(user.profile_picture.name))
+        self.assertEqual(User.objects.get(pk=user.pk).avatar_thumbnail, user.avatar_thumbnail)
+        self.assertThumbnails(user.profile_picture.name)
+
+    def test_avatar_url_is_absolute(self):
+        user = create_user('viewer')
+        request = RequestFactory().get('/')
+        self.assertEqual(
+            avatars.avatar_url(request, user), f'http://testserver/media/{avatars.thumbnail_name(user.profile_picture.name)}'
+        )
+        user.avatar_thumbnail = ''
+        self.assertEqual(avatars.avatar_url(request, user), 'http://testserver/media/profile_picture/default.png')
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class CompactProtocolTests(TransactionTestCase):
+
+    async def connect(self, user, subprotocols=None):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/', subprotocols=subprotocols)
+        communicator.scope['user'] = user
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_msgpack_socket_gets_compact_frames(self):
+        user = await database_sync_to_async(create_user)('listener')
+        communicator, subprotocol = await self.connect(user, [COMPACT_SUBPROTOCOL])
+        self.assertEqual(subprotocol, COMPACT_SUBPROTOCOL)
+
+        event = {'type': 'notification_message', **encode_frames({'message': 'hello', 'kind': 'like'})}
+        # Only the form the socket speaks is encoded
+        with mock.patch.object(protocol, 'encode_json', side_effect=AssertionError):
+            await get_channel_layer().group_send(user_notification_group(user.id), event)
+            frame = await communicator.receive_from()
+        self.assertEqual(msgpack.unpackb(frame), {'m': 'hello', 'k': 'like'})
+        self.assertEqual(decode_frame(bytes_data=frame), {'message': 'hello', 'kind': 'like'})
+        await communicator.disconnect()
+
+    async def test_json_is_the_default(self):
+        user = await database_sync_to_async(create_user)('listener')
+        communicator, subprotocol = await self.connect(user)
+        self.assertIsNone(subprotocol)
+
+        await get_channel_layer().group_send(
+            user_notification_group(user.id), {'type': 'notification_message', **encode_frames({'message': 'hello'})}
+        )
+        self.assertEqual(json.loads(await communicator.receive_from()), {'message': 'hello'})
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class UserSnapshotTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('socket')
+
+    def resolve(self, user):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope['user'])
+
+        token = str(AccessToken.for_user(user))
+        async_to_sync(JWTAuthMiddleware(app))({'type': 'websocket', 'query_string': f'token={token}'.encode()}, None, None)
+        return seen[0]
+
+    def test_handshakes_reuse_the_snapshot(self):
+        self.assertEqual(self.resolve(self.user).pk, self.user.pk)
+        with self.assertNumQueries(0):
+            user = self.resolve(self.user)
+        self.assertEqual((user.pk, user.username, user.can_chat), (self.user.pk, 'socket', True))
+
+    def test_changed_flags_drop_the_snapshot(self):
+        self.resolve(self.user)
+        self.user.can_chat = False
+        self.user.save()
+        self.assertFalse(self.resolve(self.user).can_chat)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertTrue(self.resolve(self.user).is_anonymous)
+
+    def test_bad_tokens_are_logged(self):
+        middleware = JWTAuthMiddleware(mock.AsyncMock())
+        with self.assertLogs('administrator.middlewares', 'INFO'):
+            async_to_sync(middleware)({'type': 'websocket', 'query_string': b'token=junk'}, None, None)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class NotificationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner')
+        self.fan = create_user('fan')
+        self.post = Post.objects.create(user=self.owner, content='hello')
+
+    def test_rolled_back_notifications_are_not_dispatched(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(user_notification_group(self.owner.id), channel)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    notify(self.owner.id, 'comment', 'rolled back', actor=self.fan, post_id=self.post.id)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            kept = notify(self.owner.id, 'comment', 'kept', actor=self.fan, post_id=self.post.id)
+
+        self.assertEqual(len(callbacks), 1)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['ids'], [kept.id])
+
+    def test_one_event_per_recipient_and_transaction(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(user_notification_group(self.owner.id), channel)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                first = notify(self.owner.id, 'comment', 'first', actor=self.fan, post_id=self.post.id)
+                with transaction.atomic():
+                    second = notify(self.owner.id, 'comment', 'second', actor=self.fan, post_id=self.post.id)
+                third = notify(self.owner.id, 'comment', 'third', actor=self.fan, post_id=self.post.id)
+
+        self.assertEqual(len(callbacks), 1)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['ids'], [first.id, second.id, third.id])
+
+    def test_self_actions_are_skipped(self):
+        self.assertIsNone(notify(self.owner.id, 'like', 'liked', actor=self.owner, post_id=self.post.id))
+
+    def test_liking_again_notifies_and_trends_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.toggle(self.post.id, self.fan)
+        score = TrendingScore.objects.get(post=self.post).score
+        for _ in range(4):
+            with self.captureOnCommitCallbacks(execute=True):
+                Like.toggle(self.post.id, self.fan)
+
+        self.assertEqual(Notification.objects.filter(recipient=self.owner, kind='like').count(), 1)
+        self.assertEqual(TrendingScore.objects.get(post=self.post).score, score)
+
+    def test_rolled_back_like_does_not_count_as_seen(self):
+        score = TrendingScore.objects.get(post=self.post).score
+        try:
+            with transaction.atomic():
+                Like.toggle(self.post.id, self.fan)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.toggle(self.post.id, self.fan)
+        self.assertGreater(TrendingScore.objects.get(post=self.post).score, score)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class NotificationPullTests(TestCase):
+    url = '/admins/api/notifications/'
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.other = create_user('other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.notifications = [
+            Notification.objects.create(recipient=self.user, kind='comment', message=str(i)) for i in range(3)
+        ]
+
+    def undelivered(self):
+        return [item['id'] for item in self.client.get(self.url, {'undelivered': ''}).json()['results']]
+
+    def test_reading_does_not_acknowledge(self):
+        ids = sorted((notification.id for notification in self.notifications), reverse=True)
+        self.assertEqual(self.undelivered(), ids)
+        self.assertEqual(self.undelivered(), ids)
+
+    def test_acknowledged_notifications_are_delivered(self):
+        mine, theirs = self.notifications[0], Notification.objects.create(recipient=self.other, kind='like', message='x')
+        response = self.client.post(f'{self.url}acknowledge/', {'ids': [mine.id, theirs.id]}, format='json')
+        self.assertEqual(response.json(), {'acknowledged': 1})
+        self.assertNotIn(mine.id, self.undelivered())
+        self.assertIsNone(Notification.objects.get(pk=theirs.pk).delivered_at)
+
+        self.assertEqual(self.client.post(f'{self.url}acknowledge/', {'ids': []}, format='json').status_code, 400)
+
+
+class EmailOutboxTests(TestCase):
+
+    def setUp(self):
+        self.email = queue_email('Hello', 'Body', ['member@example.com'])
+
+    def run_worker(self):
+        worker = EmailOutboxWorker()
+        try:
+            return worker.run_once()
+        finally:
+            worker.close()
+
+    def make_due(self):
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_queued_mail_is_sent(self):
+        call_command('send_queued_emails', stdout=io.StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['member@example.com']])
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('sent', 1))
+
+    def test_failure_backs_off_before_the_retry(self):
+        with mock.patch.object(EmailMessage, 'send', side_effect=OSError("connection refused")):
+            with self.assertLogs('administrator.services', 'WARNING'):
+                self.assertEqual(self.run_worker(), (0, 1))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('queued', 1))
+        self.assertGreater(self.email.next_attempt_at, timezone.now())
+
+        # Not due yet
+        self.assertEqual(self.run_worker(), (0, 0))
+        self.make_due()
+        self.assertEqual(self.run_worker(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('sent', 2))
+
+    def test_expired_lease_is_reclaimed_and_counted(self):
+        # A worker claims the row and dies before sending it
+        EmailOutboxWorker().claim_batch()
+        self.assertEqual(self.run_worker(), (0, 0))
+
+        self.make_due()
+        self.assertEqual(self.run_worker(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('sent', 2))
+
+    def test_mail_that_keeps_crashing_the_worker_gives_up(self):
+        for _ in range(settings.EMAIL_OUTBOX['MAX_ATTEMPTS']):
+            EmailOutboxWorker().claim_batch()
+            self.make_due()
+        with self.assertLogs('administrator.services', 'ERROR'):
+            self.assertEqual(self.run_worker(), (0, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, 'failed')
+        self.assertEqual(mail.outbox, [])
+
+
+class VerificationTokenTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('member', is_active=False)
+
+    def test_codes_are_single_use(self):
+        token = verification.issue_token(self.user, 'verify')
+        self.assertEqual(verification.consume_token(token, 'verify'), self.user.id)
+        self.assertIsNone(verification.consume_token(token, 'verify'))
+        self.assertTrue(UserVerification.objects.get(user=self.user).is_verified)
+
+    def test_concurrent_consumers_get_one_success(self):
+        token = verification.issue_token(self.user, 'verify')
+        # Both requests read the code before either deletes it
+        with mock.patch.object(verification.cache, 'get', return_value=self.user.id):
+            results = [verification.consume_token(token, 'verify') for _ in range(2)]
+        self.assertEqual(results, [self.user.id, None])
+
+    def test_reissue_revokes_the_previous_code(self):
+        with mock.patch.object(verification, 'generate_token', side_effect=['111111', '222222']):
+            first = verification.issue_token(self.user, 'verify')
+            second = verification.issue_token(self.user, 'verify')
+        self.assertIsNone(verification.consume_token(first, 'verify'))
+        self.assertEqual(verification.consume_token(second, 'verify'), self.user.id)
+
+    def test_codes_are_bound_to_purpose_and_owner(self):
+        token = verification.issue_token(self.user, 'reset')
+        self.assertIsNone(verification.consume_token(token, 'verify'))
+        self.assertIsNone(verification.consume_token(token, 'reset', user_id=self.user.id + 1))
+        self.assertEqual(verification.consume_token(token, 'reset', user_id=self.user.id), self.user.id)
+
+    def test_sweep_only_removes_unverified_registrations(self):
+        long_ago = timezone.now() - timedelta(days=settings.VERIFICATION['STALE_ACCOUNT_DAYS'] + 1)
+        verification.issue_token(self.user, 'verify')
+        disabled = create_user('disabled', is_active=False)
+        resetting = create_user('resetting', is_active=False)
+        verification.issue_token(resetting, 'reset')
+        User.objects.update(date_joined=long_ago)
+
+        UserVerification.objects.update(created_at=long_ago)
+
+        # The expired registration code is kept until the account goes
+        self.assertEqual(list(verification.expired_verifications()), [UserVerification.objects.get(user=resetting)])
+        self.assertEqual(list(verification.stale_accounts()), [self.user])
+        self.assertNotIn(disabled, verification.stale_accounts())
+
+    def test_login_records_last_login(self):
+        user = create_user('active')
+        response = APIClient().post(
+            '/admins/api/user/login/', {'username': 'active', 'password': 'password123'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(User.objects.get(pk=user.pk).last_login)
+
+
+class RateLimiterTests(TestCase):
+
+    def hits(self, limiter, at, count):
+        with mock.patch.object(rate_limit.time, 'time', return_value=at):
+            return [limiter.hit('key', 3, 60) for _ in range(count)]
+
+    def check_sliding_window(self, limiter):
+        # Window [600, 660): three hits fit, the fourth waits for the window to end
+        results = self.hits(limiter, 600.0, 4)
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertEqual(results[-1][1], 60)
+
+        # Halfway into the next window the previous one still counts for half of its three hits
+        results = self.hits(limiter, 690.0, 2)
+        self.assertEqual([allowed for allowed, _ in results], [True, False])
+        self.assertGreater(results[-1][1], 0)
+
+        # Two windows later nothing counts any more
+        results = self.hits(limiter, 780.0, 3)
+        self.assertTrue(all(allowed for allowed, _ in results))
+
+    def test_memory_sliding_window(self):
+        self.check_sliding_window(MemoryRateLimiter())
+
+    def test_redis_sliding_window(self):
+        self.check_sliding_window(RedisRateLimiter(fakeredis.FakeRedis()))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ThrottleTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rate_limit, '_limiter', MemoryRateLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = create_user('member')
+
+    def login(self, username, address='10.0.0.1'):
+        return APIClient(REMOTE_ADDR=address).post(
+            '/admins/api/user/login/', {'username': username, 'password': 'wrong-password'}, format='json'
+        )
+
+    def test_account_budget_holds_across_addresses(self):
+        # login_account allows five attempts a minute, from any address
+        statuses = [self.login('Member', f'10.0.0.{i}').status_code for i in range(6)]
+        self.assertEqual(statuses, [400] * 5 + [429])
+        self.assertIn('Retry-After', self.login('member', '10.0.1.1'))
+
+    def test_non_object_body_is_not_an_error(self):
+        response = APIClient().post('/admins/api/user/login/', [1, 2], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_wrong_codes_revoke_the_active_one(self):
+        token = verification.issue_token(self.user, 'reset')
+        wrong = '100000' if token != '100000' else '100001'
+        statuses = [
+            APIClient(REMOTE_ADDR=f'10.0.0.{i}').post(
+                '/admins/api/user/forget/password/verify/',
+                {'email': self.user.email, 'token': code, 'password': 'new-password'},
+                format='json',
+            ).status_code
+            for i, code in enumerate([wrong] * settings.VERIFICATION['MAX_ATTEMPTS'] + [token])
+        ]
+        self.assertEqual(statuses, [400] * (settings.VERIFICATION['MAX_ATTEMPTS'] + 1))
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('password123'))
+
+    def test_email_link_has_an_account_budget(self):
+        url = f'/admins/api/user/verify/email/{urlsafe_base64_encode(force_bytes(self.user.id))}/123456/'
+        statuses = [APIClient(REMOTE_ADDR=f'10.0.0.{i}').get(url).status_code for i in range(11)]
+        # verify_account allows ten attempts an hour
+        self.assertEqual(statuses, [400] * 10 + [429])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class AuthVersionTests(TestCase):
+    url = '/admins/api/notifications/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('member')
+
+    def client_for(self, user):
+        refresh = ClaimsRefreshToken.for_user(user)
+        return APIClient(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def change(self, **fields):
+        user = User.objects.get(pk=self.user.pk)
+        for field, value in fields.items():
+            setattr(user, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+    def test_claims_authenticate_without_loading_the_user(self):
+        client = self.client_for(self.user)
+        client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertFalse([query for query in queries if 'FROM "administrator_user"' in query['sql']])
+
+    def test_flag_change_revokes_even_when_reverted(self):
+        client = self.client_for(self.user)
+        self.change(can_post=False)
+        self.change(can_post=True)
+        self.assertEqual(client.get(self.url).status_code, 401)
+        self.assertEqual(self.client_for(User.objects.get(pk=self.user.pk)).get(self.url).status_code, 200)
+
+    def test_password_change_revokes(self):
+        client = self.client_for(self.user)
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('another-password')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(update_fields=['password'])
+        self.assertEqual(client.get(self.url).status_code, 401)
+
+    def test_deactivation_revokes(self):
+        client = self.client_for(self.user)
+        self.change(is_active=False)
+        self.assertEqual(client.get(self.url).status_code, 401)
+        self.change(is_active=True)
+        self.assertEqual(client.get(self.url).status_code, 401)
+
+    def test_stale_copies_still_revoke(self):
+        stale = User.objects.get(pk=self.user.pk)
+        self.change(can_chat=False)
+        client = self.client_for(User.objects.get(pk=self.user.pk))
+        stale.can_post = False
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.save()
+        self.assertEqual(client.get(self.url).status_code, 401)
+
+    def test_saves_do_not_read_the_stored_row(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Ada'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        reads = [query for query in queries if query['sql'].startswith('SELECT') and '"administrator_user"' in query['sql']]
+        self.assertFalse(reads)
+
+    def test_unrelated_saves_keep_tokens(self):
+        client = self.client_for(self.user)
+        self.change(first_name='Ada')
+        User.objects.get(pk=self.user.pk).save(update_fields=['last_login'])
+        self.assertEqual(client.get(self.url).status_code, 200)
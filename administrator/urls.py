@@ -31,4 +31,8 @@ urlpatterns = [
         )
     ),
     
+    path("cache/stats/", CacheStatsView.as_view()),
+    path("notifications/", NotificationListView.as_view()),
+    path("notifications/acknowledge/", NotificationAcknowledgeView.as_view()),
+    
 ]
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Active verification codes.
+
+A code lives in the default cache for VERIFICATION["TOKEN_TTL"] seconds
+under two keys per purpose: code -> user id, so a submitted code is
+resolved with one cache read, and user id -> code, so issuing a new code
+revokes the previous one. Codes are reserved with cache.add, two users
+never hold the same code for the same purpose, and deleting the key on use
+makes a code single use. Wrong codes submitted for an account are counted,
+after VERIFICATION["MAX_ATTEMPTS"] its active code is revoked and a new one
+has to be requested. UserVerification rows are only an audit record,
+sweep_verifications removes the ones that expired unused.
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import User, UserVerification
+
+# Draws before giving up on finding a free code, collisions only matter with ~10^5 live codes
+MAX_DRAWS = 20
+
+
+def token_key(purpose, token):
+    return f'verification:{purpose}:token:{token}'
+
+
+def user_key(purpose, user_id):
+    return f'verification:{purpose}:user:{user_id}'
+
+
+def failures_key(purpose, user_id):
+    return f'verification:{purpose}:failures:{user_id}'
+
+
+def generate_token():
+    """Generate a 6-digit token"""
+    return str(100000 + secrets.randbelow(900000))
+
+
+def issue_token(user, purpose):
+    """Reserve a fresh code for `user`, replacing any active one, and record it."""
+    ttl = settings.VERIFICATION["TOKEN_TTL"]
+    revoke_token(user.id, purpose)
+    cache.delete(failures_key(purpose, user.id))
+
+    for _ in range(MAX_DRAWS):
+        token = generate_token()
+        if cache.add(token_key(purpose, token), user.id, ttl):
+            break
+    else:
+        raise RuntimeError(f"Could not reserve a unique {purpose} code")
+    cache.set(user_key(purpose, user.id), token, ttl)
+
+    UserVerification.objects.update_or_create(
+        user=user,
+        defaults={'token': token, 'purpose': purpose, 'created_at': timezone.now(), 'is_verified': False},
+    )
+    return token
+
+
+def revoke_token(user_id, purpose):
+    token = cache.get(user_key(purpose, user_id))
+    if token is not None:
+        cache.delete_many([token_key(purpose, token), user_key(purpose, user_id)])
+
+
+def record_failure(user_id, purpose):
+    """Count a wrong code for `user_id`, revoking the active one after VERIFICATION["MAX_ATTEMPTS"]."""
+    key = failures_key(purpose, user_id)
+    cache.add(key, 0, settings.VERIFICATION["TOKEN_TTL"])
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        # Expired between the add and the increment
+        failures = 1
+    if failures >= settings.VERIFICATION["MAX_ATTEMPTS"]:
+        revoke_token(user_id, purpose)
+
+
+def consume_token(token, purpose, user_id=None):
+    """
+    Return the id of the user holding `token` and invalidate the code, or
+    None when it is unknown, expired, already used or, with `user_id`,
+    held by someone else. With `user_id` a wrong code counts against the
+    account, see record_failure.
+    """
+    key = token_key(purpose, token)
+    owner = cache.get(key)
+    if owner is None or (user_id is not None and owner != user_id):
+        if user_id is not None:
+            record_failure(user_id, purpose)
+        return None
+    # Only one of two concurrent requests gets to delete the key
+    if not cache.delete(key):
+        return None
+    cache.delete(user_key(purpose, owner))
+
+    now = timezone.now()
+    UserVerification.objects.filter(user_id=owner).update(is_verified=True)
+    if purpose == 'verify':
+        UserVerification.objects.filter(user_id=owner, email_verified_at__isnull=True).update(email_verified_at=now)
+    return owner
+
+
+def expired_verifications():
+    """
+    Codes of users who never verified their email that expired unused. The
+    registration codes of inactive accounts stay, stale_accounts needs them.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.VERIFICATION["TOKEN_TTL"])
+    return UserVerification.objects.filter(
+        created_at__lt=cutoff, is_verified=False, email_verified_at__isnull=True
+    ).exclude(purpose='verify', user__is_active=False)
+
+
+def stale_accounts():
+    """
+    Registrations that were never verified within
+    VERIFICATION["STALE_ACCOUNT_DAYS"]: inactive accounts that never logged
+    in and still hold the unused code sent on registration. Accounts created
+    or deactivated any other way have no such code and are left alone.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.VERIFICATION["STALE_ACCOUNT_DAYS"])
+    pending = UserVerification.objects.filter(
+        user=OuterRef('pk'), purpose='verify', is_verified=False, email_verified_at__isnull=True
+    )
+    return User.objects.filter(
+        Exists(pending),
+        is_active=False, is_staff=False, is_superuser=False, last_login__isnull=True, date_joined__lt=cutoff,
+    )
+
+
+def delete_in_batches(queryset, batch_size):
+    """Delete the rows of `queryset` a batch at a time, returns how many were deleted."""
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # Filtering the batch through `queryset` again skips rows that changed since they were read
+        _, per_model = queryset.filter(pk__in=ids).delete()
+        deleted += per_model.get(queryset.model._meta.label, 0)
+        if len(ids) < batch_size:
+            return deleted
@@ -1,6 +1,6 @@
 from django.contrib.auth.hashers import make_password
-from django.core.mail import send_mail
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from datetime import datetime
@@ -14,12 +14,20 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
+from rest_framework_simplejwt.tokens import AccessToken
 
-from administrator.permissions import IsCDSLeaderPermission
+from administrator.authentication import ClaimsRefreshToken
+from administrator.permissions import IsCDSLeaderPermission, IsSuperAdminPermission
 from administrator.swagger import TaggedAutoSchema
-from .models import CDS_Group, User, UserVerification
-from .serializers import CDS_GroupReadSerializer, CDS_GroupWriteSerializer, ChangePasswordSerializer, ForgetPasswordSerializer, ForgetPasswordVerificationTokenSerializer, RegUserSerializer, ResendVerificationTokenSerializer, UserLoginSerializer, UserVerificationSerializer
+from kastina_forum import response_cache
+from kastina_forum.pagination import KeysetPagination
+from kastina_forum.rate_limit import AccountRateThrottle, IPRateThrottle
+from kastina_forum.response_cache import CachedResponseMixin
+from . import verification
+from .models import CDS_Group, Notification, User
+from .notifications import mark_delivered
+from .services import queue_email
+from .serializers import CDS_GroupReadSerializer, CDS_GroupWriteSerializer, ChangePasswordSerializer, ForgetPasswordSerializer, ForgetPasswordVerificationTokenSerializer, NotificationAcknowledgeSerializer, NotificationSerializer, RegUserSerializer, ResendVerificationTokenSerializer, UserLoginSerializer, UserVerificationSerializer
 
 
 
@@ -29,33 +37,30 @@ from .serializers import CDS_GroupReadSerializer, CDS_GroupWriteSerializer, Chan
 class RegisterUser(generics.GenericAPIView):
     serializer_class = RegUserSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'email'
+    throttle_account_field = 'email'
     def post(self, request, *args, **kwargs):
         serializer = RegUserSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         if serializer.is_valid():
             # Create user
             user = serializer.save(password=make_password(request.data['password']))
-            verification = UserVerification(user=user)
-            verification.generate_token()
-            verification.save()
-            
             user.is_active = False
             user.save()
             
-            token = verification.token
+            token = verification.issue_token(user, 'verify')
             uidb64 = urlsafe_base64_encode(force_bytes(user.id))
             verification_link = request.build_absolute_uri(
                 reverse('verify-email', kwargs={'uidb64': uidb64, 'token': token})
             )
 
-            # Send the verification email with the token
-            send_mail(
+            # Queue the verification email with the token, the outbox worker sends it
+            queue_email(
                 "Your Verification Code",
-                f"Use this code: {verification.token} (expires in 10 minutes)\n"
+                f"Use this code: {token} (expires in 10 minutes)\n"
                 f"Or click the link to verify your email: {verification_link} ",
-                settings.EMAIL_HOST_USER,
                 [user.email],
-                fail_silently=False,
             )
 
             return Response({"message": "Account created. A verification email has been sent.",
@@ -70,26 +75,25 @@ User = get_user_model()
 
 
 class VerifyEmailView(APIView):
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'verify'
+    throttle_account_field = 'uidb64'
     def get(self, request, uidb64, token):
         try:
-            uid = urlsafe_base64_decode(uidb64).decode()
+            uid = int(urlsafe_base64_decode(uidb64).decode())
             user = get_object_or_404(User, id=uid)
-            verification = get_object_or_404(UserVerification, user=user, token=token)
-            
-            if verification.is_token_expired():
-                    return Response({'error': 'Link has expired'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if the user has already been verified
-            if verification.is_verified:
+            if user.is_active:
                 return Response({'error': 'Link is already verified'}, status=status.HTTP_400_BAD_REQUEST)
+
+            if verification.consume_token(token, 'verify', user_id=user.id) is None:
+                return Response({'error': 'Link has expired'}, status=status.HTTP_400_BAD_REQUEST)
             
             # Activate user
             user.is_active = True
             user.save()
 
-            verification.is_verified = True
-            verification.save()
-
             return Response({"message": "Your email has been verified successfully! please go back to login"}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": "Invalid or expired link."}, status=status.HTTP_400_BAD_REQUEST)
@@ -99,33 +103,30 @@ class VerifyEmailView(APIView):
 class UserVerificationView(generics.GenericAPIView):
     serializer_class = UserVerificationSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'verify'
+    throttle_account_field = 'email'
     def post(self, request, *args, **kwargs):
         
         serializer = UserVerificationSerializer(data=request.data)
 
         if serializer.is_valid():
+            email = serializer.validated_data['email']
             token = serializer.validated_data['token']
 
             try:
-                user_verification = UserVerification.objects.get(token=token)
+                # Unknown, expired and already used codes are all gone from the store,
+                # wrong ones count against the account's attempts
+                user_id = User.objects.values_list('id', flat=True).get(email=email)
+                if verification.consume_token(str(token), 'verify', user_id=user_id) is None:
+                    return Response({'error': 'Invalid or expired token'}, status=status.HTTP_400_BAD_REQUEST)
 
-                # Check if the token has expired
-                if user_verification.is_token_expired():
-                    return Response({'error': 'Token has expired'}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Check if the user has already been verified
-                if user_verification.is_verified:
-                    return Response({'error': 'User is already verified'}, status=status.HTTP_400_BAD_REQUEST)
-
-                user = user_verification.user
+                user = User.objects.get(id=user_id)
                 
                 user.is_active = True
                 user.save()
-
-                user_verification.is_verified = True
-                user_verification.save()
                 
-                refresh = RefreshToken.for_user(user)
+                refresh = ClaimsRefreshToken.for_user(user)
                 access_token = str(refresh.access_token)
                 expiration_time = datetime.fromtimestamp(AccessToken(access_token)["exp"])
                 profile_pic_url = request.build_absolute_uri(user.profile_picture.url) if user.profile_picture else None
@@ -142,7 +143,7 @@ class UserVerificationView(generics.GenericAPIView):
                     status=status.HTTP_200_OK,
                 )
 
-            except UserVerification.DoesNotExist:
+            except User.DoesNotExist:
                 return Response({'error': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({"error":serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -152,6 +153,9 @@ class UserVerificationView(generics.GenericAPIView):
 class ResendVerificationTokenView(generics.GenericAPIView):
     serializer_class = ResendVerificationTokenSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'email'
+    throttle_account_field = 'email'
     def post(self, request, *args, **kwargs):
         serializer = ResendVerificationTokenSerializer(data=request.data)
 
@@ -163,37 +167,27 @@ class ResendVerificationTokenView(generics.GenericAPIView):
             try:
                 # Get the user by email
                 user = User.objects.get(email=email)
-                user_verification, created = UserVerification.objects.get_or_create(user=user)
 
                 # If the user is already verified, inform the user
                 if user.is_active:
                     return Response({"error": "User is already verified"}, status=status.HTTP_400_BAD_REQUEST)
 
-                # If the token is expired or not verified, generate a new token
-                if user_verification.is_token_expired() or user_verification.is_verified == False:
-                    user_verification.generate_token()  # Regenerate token
-                    user_verification.is_verified = False  # Reset verification status
-                    user_verification.save()
-                    
-                    token = user_verification.token
-                    uidb64 = urlsafe_base64_encode(force_bytes(user.id))
-                    verification_link = request.build_absolute_uri(
-                        reverse('verify-email', kwargs={'uidb64': uidb64, 'token': token})
-                    )
-
-                    # Send the token via email
-                    send_mail(
-                        "Your Verification Code",
-                        f"Use this code: {user_verification.token} (expires in 10 minutes)\n"
-                        f"Or click the link to verify your email: {verification_link} ",
-                        settings.EMAIL_HOST_USER,
-                        [user.email],
-                        fail_silently=False,
-                    )
-                    
-                    return Response({"message": "A new verification token has been sent to your email."}, status=status.HTTP_200_OK)
+                # Generate a new token, the previous one stops working
+                token = verification.issue_token(user, 'verify')
+                uidb64 = urlsafe_base64_encode(force_bytes(user.id))
+                verification_link = request.build_absolute_uri(
+                    reverse('verify-email', kwargs={'uidb64': uidb64, 'token': token})
+                )
+
+                # Queue the token email, the outbox worker sends it
+                queue_email(
+                    "Your Verification Code",
+                    f"Use this code: {token} (expires in 10 minutes)\n"
+                    f"Or click the link to verify your email: {verification_link} ",
+                    [user.email],
+                )
                 
-                return Response({"message": "Token is still valid. Please check your email for the verification."}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"message": "A new verification token has been sent to your email."}, status=status.HTTP_200_OK)
             
             except User.DoesNotExist:
                 return Response({"error": "User with this email does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -205,6 +199,12 @@ class ResendVerificationTokenView(generics.GenericAPIView):
 class LoginView(generics.GenericAPIView):
     serializer_class = UserLoginSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'login'
+    throttle_account_field = 'username'
+    # A stale token sent along must not block getting a new one
+    authentication_classes = []
+
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -222,7 +222,9 @@ class LoginView(generics.GenericAPIView):
         if not user.is_active:
             return Response({"error": "Account is inactive"}, status=status.HTTP_400_BAD_REQUEST)
 
-        refresh = RefreshToken.for_user(user)
+        # sweep_verifications never removes an account that has logged in
+        update_last_login(None, user)
+        refresh = ClaimsRefreshToken.for_user(user)
         access_token = str(refresh.access_token)
         expiration_time = datetime.fromtimestamp(AccessToken(access_token)["exp"])
         profile_pic_url = request.build_absolute_uri(user.profile_picture.url) if user.profile_picture else None
@@ -244,6 +246,9 @@ class LoginView(generics.GenericAPIView):
 class ForgetPasswordView(generics.GenericAPIView):
     serializer_class = ForgetPasswordSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'email'
+    throttle_account_field = 'email'
     def post(self, request, *args, **kwargs):
         serializer = ForgetPasswordSerializer(data=request.data)
 
@@ -254,26 +259,18 @@ class ForgetPasswordView(generics.GenericAPIView):
 
             try:
                 user = User.objects.get(email=email)
-                user_verification, created = UserVerification.objects.get_or_create(user=user)
-
-                # If the token is expired or not verified, generate a new token
-                if user_verification.is_token_expired() or user_verification.is_verified == False:
-                    user_verification.generate_token()
-                    user_verification.is_verified = False 
-                    user_verification.save()
-
-                    # Send the token via email
-                    send_mail(
-                        'Your Verification Token',
-                        f'Your verification token is {user_verification.token}, It expires in 10 minutes.',
-                        settings.EMAIL_HOST_USER,
-                        [user.email],
-                        fail_silently=False,
-                    )
-                    
-                    return Response({"message": "A verification token has been sent to your email."}, status=status.HTTP_200_OK)
+
+                # Generate a new token, the previous one stops working
+                token = verification.issue_token(user, 'reset')
+
+                # Queue the token email, the outbox worker sends it
+                queue_email(
+                    'Your Verification Token',
+                    f'Your verification token is {token}, It expires in 10 minutes.',
+                    [user.email],
+                )
                 
-                return Response({"message": "Token is still valid. Please check your email for the verification."}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"message": "A verification token has been sent to your email."}, status=status.HTTP_200_OK)
             
             except User.DoesNotExist:
                 return Response({"error": "User with this email does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -284,11 +281,15 @@ class ForgetPasswordView(generics.GenericAPIView):
 class ForgetPasswordVerificationView(generics.GenericAPIView):
     serializer_class = ForgetPasswordVerificationTokenSerializer
     swagger_schema = TaggedAutoSchema
+    throttle_classes = [IPRateThrottle, AccountRateThrottle]
+    throttle_scope = 'verify'
+    throttle_account_field = 'email'
     def post(self, request, *args, **kwargs):
         
         serializer = ForgetPasswordVerificationTokenSerializer(data=request.data)
 
         if serializer.is_valid():
+            email = serializer.validated_data['email']
             token = serializer.validated_data['token']
             password = serializer.validated_data['password']
             
@@ -296,24 +297,17 @@ class ForgetPasswordVerificationView(generics.GenericAPIView):
                 return Response({'error': 'Token must be 6 numbers'}, status=status.HTTP_400_BAD_REQUEST)    
 
             try:
-                user_verification = UserVerification.objects.get(token=token)
-
-                # Check if the token has expired
-                if user_verification.is_token_expired():
-                    return Response({'error': 'Token has expired'}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Check if the user has already been verified
-                if user_verification.is_verified:
-                    return Response({'error': 'Token has been already verified'}, status=status.HTTP_400_BAD_REQUEST)
+                # Unknown, expired and already used codes are all gone from the store,
+                # wrong ones count against the account's attempts
+                user_id = User.objects.values_list('id', flat=True).get(email=email)
+                if verification.consume_token(str(token), 'reset', user_id=user_id) is None:
+                    return Response({'error': 'Invalid or expired token'}, status=status.HTTP_400_BAD_REQUEST)
 
-                user = user_verification.user
+                user = User.objects.get(id=user_id)
                 user.password = make_password(password)
                 user.save()
-            
-                user_verification.is_verified = True
-                user_verification.save()
                 
-                refresh = RefreshToken.for_user(user)
+                refresh = ClaimsRefreshToken.for_user(user)
                 access_token = str(refresh.access_token)
                 expiration_time = datetime.fromtimestamp(AccessToken(access_token)["exp"])
                 profile_pic_url = request.build_absolute_uri(user.profile_picture.url) if user.profile_picture else None
@@ -330,7 +324,7 @@ class ForgetPasswordVerificationView(generics.GenericAPIView):
                     status=status.HTTP_200_OK,
                 )
 
-            except UserVerification.DoesNotExist:
+            except User.DoesNotExist:
                 return Response({'error': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({"error":serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -354,7 +348,8 @@ class ChangePasswordView(generics.GenericAPIView):
             if password1 != password2:
                 return Response({'error': 'New password and confirm password do not match.'}, status=status.HTTP_400_BAD_REQUEST)
             
-            user = request.user
+            # request.user only holds the token claims, the password is checked against the row
+            user = User.objects.get(id=request.user.id)
             if not user.check_password(password):
                 return Response({"error": "Old Password is incorrect"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -367,8 +362,9 @@ class ChangePasswordView(generics.GenericAPIView):
         return Response({"error":serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CDS_GroupListCreateView(generics.ListCreateAPIView):
+class CDS_GroupListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
+    cache_tags = ('cds_group',)
     queryset = CDS_Group.objects.all()
     serializer_class = CDS_GroupWriteSerializer
 
@@ -390,9 +386,50 @@ class CDS_GroupUpdateView(generics.UpdateAPIView):
     
     
     
-class CDS_GroupDetailView(generics.RetrieveAPIView):
+class CDS_GroupDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
+    cache_tags = ('cds_group:{id}',)
     serializer_class = CDS_GroupReadSerializer
     queryset = CDS_Group.objects.all()
     lookup_field = "id"
-    lookup_url_kwarg = "id"
\ No newline at end of file
+    lookup_url_kwarg = "id"
+    
+    
+    
+class CacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperAdminPermission]
+
+    def get(self, request):
+        return Response(response_cache.stats(), status=status.HTTP_200_OK)
+
+
+class NotificationListView(generics.ListAPIView):
+    """
+    Pull endpoint for the notification outbox, newest first. `?undelivered`
+    limits it to what the sockets have not delivered yet. Reading marks
+    nothing, clients acknowledge what they showed through
+    NotificationAcknowledgeView.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = Notification.objects.filter(recipient=self.request.user)
+        if 'undelivered' in self.request.query_params:
+            queryset = queryset.filter(delivered_at__isnull=True)
+        return queryset
+
+
+class NotificationAcknowledgeView(generics.GenericAPIView):
+    """Marks the caller's notifications listed in `ids` delivered."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = NotificationAcknowledgeSerializer
+    swagger_schema = TaggedAutoSchema
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        acknowledged = mark_delivered(request.user.id, serializer.validated_data['ids'])
+        return Response({"acknowledged": acknowledged}, status=status.HTTP_200_OK)
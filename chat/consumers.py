@@ -1,13 +1,61 @@
-import json
+import asyncio
+import time
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 
-class GroupChatConsumer(AsyncWebsocketConsumer):
+from administrator.avatars import absolute_media_url, avatar_name
+from kastina_forum.protocol import CompactProtocolMixin, decode_frame, encode_frames
+from kastina_forum.rate_limit import get_rate_limiter, parse_rate
+
+from .history import get_history, history_entry, render_entries
+from .presence import get_presence
+from .typing import get_typing_coalescer
+from .writer import get_message_writer
+
+
+def user_context_group(user_id):
+    """Channel layer group of every chat socket of a user, used for context invalidations."""
+    return f'chat_user_{user_id}'
+
+
+def group_cache_key(group_name):
+    return f'chat_group:{group_name}'
+
+
+def invalidate_group_cache(group_name):
+    cache.delete(group_cache_key(group_name))
+
+
+def load_group(group_name):
+    ChatGroup = apps.get_model('chat', 'ChatGroup')
+    return ChatGroup.objects.filter(name=group_name).first()
+
+
+async def get_group(group_name):
+    """
+    The group row, cached by name for CHAT_GROUP_CACHE["TIMEOUT"] seconds and
+    dropped by chat.signals when the group or its memberships change, so
+    handshakes and join/leave frames do not query it.
+    """
+    group = await cache.aget(group_cache_key(group_name))
+    if group is None:
+        group = await database_sync_to_async(load_group)(group_name)
+        if group is not None:
+            await cache.aset(group_cache_key(group_name), group, settings.CHAT_GROUP_CACHE["TIMEOUT"])
+    return group
+
+
+class GroupChatConsumer(CompactProtocolMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Get the group name from the URL
         self.group_name = self.scope['url_route']['kwargs']['groupName']
+        self.group = None
+        self.last_typing = None
         
         self.user = self.scope.get('user', None)
 
@@ -15,159 +63,186 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             await self.close() 
             return
 
-        # Check if the user is a member of the group, or create a new membership if they aren't
-        is_member = await self.user_is_member(self.user, self.group_name)
-        if not is_member:
-            # Add user to the group if they are not already a member
-            group = await self.get_group(self.group_name)
-            await self.add_user_to_group(self.user, group)
+        # Resolve the group row and the user's display fields once for the life of the socket.
+        # The user is the snapshot cached by JWTAuthMiddleware, the group comes from the cache too.
+        if not await self.load_context(self.user):
+            await self.close()
+            return
 
-        # Add the user to the group channel
+        # Add the user to the group channel, and to its own channel for context invalidations
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            user_context_group(self.user.id),
+            self.channel_name
+        )
+
+        # Mark the user online and keep them so while the socket is open.
+        # Membership is only written by the explicit join endpoint.
+        online = await self.run_sync(get_presence().connect, self.group_name, self.user.id)
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
 
         # Notify the group that a new user has joined
-        await self.notify_group('join')
+        await self.notify_group('join', online)
 
         # Accept the WebSocket connection
         await self.accept()
 
+        # Recent messages from the history buffer, newest first, so the client needs no extra read
+        entries = await self.run_sync(get_history().latest, self.group_name, settings.CHAT_HISTORY["SIZE"])
+        await self.send_payload({'history': render_entries(entries, self.base_url())})
+
     async def disconnect(self, close_code):
-        # Notify the group that the user has left
-        await self.notify_group('leave')
+        if self.group is None:
+            return
 
-        # Remove the user from the group
-        group = await self.get_group(self.group_name)
-        await self.remove_user_from_group(self.user, group)
+        self.heartbeat_task.cancel()
+        online = await self.run_sync(get_presence().disconnect, self.group_name, self.user.id)
+
+        # Notify the group that the user has left
+        await self.notify_group('leave', online)
 
         # Remove the user from the group channel
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
+        await self.channel_layer.group_discard(
+            user_context_group(self.user.id),
+            self.channel_name
+        )
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = decode_frame(text_data, bytes_data)
         message  = text_data_json.get("message")
         is_typing = text_data_json.get('is_typing', False)
-        
-        profile_picture = await self.get_profile_picture(self.user)
 
         # Send the message to the group if it's not just typing status
         if message:
-            await self.save_message(message)
+            # Per-user budget shared by all the user's sockets, over-budget messages are dropped
+            limit, period = parse_rate(settings.RATE_LIMIT["CHAT_MESSAGES"])
+            allowed, retry_after = await self.run_sync(get_rate_limiter().hit, f'chat:{self.user.id}', limit, period)
+            if not allowed:
+                await self.send_payload({
+                    'error': 'You are sending messages too fast',
+                    'retry_after': round(retry_after, 1),
+                })
+                return
+
+            if self.last_typing is not None:
+                # The message ends the typing indicator
+                self.last_typing = None
+                await get_typing_coalescer().stopped(self.group_name, self.username)
+
+            # Queued for a batched insert, id and timestamp are final already
+            msg = get_message_writer().enqueue(self.user.id, self.group.id, message)
+            entry = history_entry(msg, self.username, self.avatar)
+            await self.run_sync(get_history().push, self.group_name, entry)
+
+            # Encoded by the recipients, once per process and wire format
             await self.channel_layer.group_send(
                 self.group_name,
                 {
                     'type': 'chat_message',
-                    'message': message,
-                    'user': self.user.username,
-                    'profile_picture': profile_picture,
-                    'is_typing': False
+                    **encode_frames({
+                        'id': msg.id,
+                        'message': message,
+                        'user': self.username,
+                        'profile_picture': self.profile_picture,
+                        'is_typing': False,
+                        'timestamp': entry['timestamp'],
+                    }),
                 }
             )
         elif is_typing:
-            # Notify the group that a user is typing
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'user_typing',
-                    'user': self.user.username,
-                    'is_typing': True
-                }
-            )
+            # Debounced per socket, the coalescer sends one frame per group and interval
+            now = time.monotonic()
+            if self.last_typing is None or now - self.last_typing >= settings.CHAT_TYPING["DEBOUNCE"]:
+                self.last_typing = now
+                await get_typing_coalescer().typing(self.channel_layer, self.group_name, self.username)
 
     async def chat_message(self, event):
-        
-        from django.utils import timezone
         # Send the message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': event.get("message", ""),
-            'user': event['user'],
-            'profile_picture': event['profile_picture'],
-            'is_typing': event['is_typing'],
-            "timestamp": f"{timezone.now()}"
-        }))
+        await self.send_frames(event)
 
     async def user_typing(self, event):
-        # Show who is typing in the group
-        await self.send(text_data=json.dumps({
-            'user': event.get("user", ""),
-            'is_typing': True,
-        }))
+        # A frame this old means the socket is backed up, the next one supersedes it anyway
+        if time.time() - event['sent_at'] > settings.CHAT_TYPING["STALE_AFTER"]:
+            return
+
+        # Show who is typing in the group, `user` is kept for older clients
+        users = [user for user in event['users'] if user != self.username]
+        if users:
+            await self.send_payload({
+                'users': users,
+                'user': users[0],
+                'is_typing': True,
+            })
 
-    async def notify_group(self, action):
+    async def notify_group(self, action, online_members):
         # Notify the group when a user joins or leaves
-        group_members = await self.get_group_members(self.group_name)
-        total_members = len(group_members)
+        total_members = await self.get_members_count()
 
         if action == 'join':
-            message = f'{self.user.username} has joined the group.'
+            message = f'{self.username} has joined the group.'
         else:
-            message = f'{self.user.username} has left the group.'
+            message = f'{self.username} has left the group.'
 
         await self.channel_layer.group_send(
             self.group_name,
             {
                 'type': 'user_join_leave',
-                'message': message,
-                'total_members': total_members
+                **encode_frames({
+                    'message': message,
+                    'total_members': total_members,
+                    'online_members': online_members,
+                }),
             }
         )
         
         
     async def user_join_leave(self, event):
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'total_members': event['total_members']
-        }))
-
-    @database_sync_to_async
-    def user_is_member(self, user, group_name):
-        ChatGroup = apps.get_model('chat', 'ChatGroup')
-        ChatGroupMembership = apps.get_model('chat', 'ChatGroupMembership')
-        try:
-            group = ChatGroup.objects.get(name=group_name)
-            return ChatGroupMembership.objects.filter(user__id=user.id, group=group).exists()
-        except ChatGroup.DoesNotExist:
+        await self.send_frames(event)
+
+    async def heartbeat(self):
+        interval = settings.CHAT_PRESENCE["HEARTBEAT_INTERVAL"]
+        while True:
+            await asyncio.sleep(interval)
+            await self.run_sync(get_presence().heartbeat, self.group_name, self.user.id)
+
+    async def run_sync(self, method, *args):
+        # Presence, history and rate limits talk to Redis synchronously, keep them off the event loop
+        return await sync_to_async(method, thread_sensitive=False)(*args)
+
+    async def chat_context_invalidate(self, event):
+        # The user's profile or the group row changed, reload them from the database
+        user = await self.fetch_user(self.user.id)
+        if user is None or not await self.load_context(user):
+            await self.close()
+
+    async def load_context(self, user):
+        group = await get_group(self.group_name)
+        if group is None:
             return False
 
-    @database_sync_to_async
-    def add_user_to_group(self, user, group):
-        ChatGroupMembership = apps.get_model('chat', 'ChatGroupMembership')
-        group_membership = ChatGroupMembership(user=user, group=group)
-        group_membership.save()
+        self.group, self.user, self.username = group, user, user.username
+        self.avatar = avatar_name(user)
+        self.profile_picture = absolute_media_url(self.base_url(), self.avatar) if self.avatar else None
+        return True
 
-    @database_sync_to_async
-    def remove_user_from_group(self, user, group):
-        ChatGroupMembership = apps.get_model('chat', 'ChatGroupMembership')
-        group_membership = ChatGroupMembership.objects.get(user=user, group=group)
-        group_membership.delete()
-
-    @database_sync_to_async
-    def get_group(self, group_name):
-        ChatGroup = apps.get_model('chat', 'ChatGroup')
-        return ChatGroup.objects.get(name=group_name)
+    def base_url(self):
+        headers = dict(self.scope.get('headers', []))
+        host = headers.get(b'host', b'127.0.0.1:8000').decode('latin1')
+        scheme = 'https' if self.scope.get('scheme') == 'wss' else 'http'
+        return f'{scheme}://{host}'
 
     @database_sync_to_async
-    def save_message(self, message):
-        ChatGroup = apps.get_model('chat', 'ChatGroup')
-        Message = apps.get_model('chat', 'Message')
-        group = ChatGroup.objects.get(name=self.group_name)
-        msg = Message(user=self.user, group=group, content=message)
-        msg.save()
+    def fetch_user(self, user_id):
+        User = apps.get_model('administrator', 'User')
+        return User.objects.filter(id=user_id, is_active=True).first()
 
-    @database_sync_to_async
-    def get_group_members(self, group_name):
-        ChatGroup = apps.get_model('chat', 'ChatGroup')
-        ChatGroupMembership = apps.get_model('chat', 'ChatGroupMembership')
-        group = ChatGroup.objects.get(name=group_name)
-        members = ChatGroupMembership.objects.filter(group=group)
-        return [member.user.username for member in members]
-    
-    @database_sync_to_async
-    def get_profile_picture(self, user):
-    
-        return f"http://127.0.0.1:8000{user.profile_picture.url}"
+    async def get_members_count(self):
+        group = await get_group(self.group_name)
+        return group.members_count if group is not None else 0
@@ -0,0 +1,142 @@
+"""
+Recent message history per chat group.
+
+The last CHAT_HISTORY["SIZE"] messages of each group are kept newest first
+in a capped Redis list (a deque without Redis), pushed when a message is
+broadcast. Sockets get them on connect and MessageReadView serves its
+first cursor page from them when the buffer is shared, i.e. with the
+Redis backend. Entries are snapshots in the shape of
+MessageReadSerializer, except that they store the author's id and the
+avatar's storage name and the URL is built for each request. chat.signals
+rewrites them when a message is deleted or its author's profile changes.
+"""
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from rest_framework import serializers
+
+from administrator.avatars import absolute_media_url
+from kastina_forum.redis_client import get_redis
+
+
+class MemoryHistory:
+    """Per-process history, only complete with a single worker."""
+
+    def __init__(self, size):
+        self.size = size
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def push(self, group, entry):
+        with self.lock:
+            self.groups.setdefault(group, deque(maxlen=self.size)).appendleft(entry)
+
+    def latest(self, group, count):
+        with self.lock:
+            return list(self.groups.get(group, ()))[:count]
+
+    def rewrite(self, group, change):
+        """Replace each entry by change(entry), entries it returns None for are dropped."""
+        with self.lock:
+            entries = self.groups.get(group)
+            if entries is not None:
+                self.groups[group] = deque(
+                    (entry for entry in map(change, entries) if entry is not None), maxlen=self.size
+                )
+
+    def clear(self, group):
+        with self.lock:
+            self.groups.pop(group, None)
+
+
+class RedisHistory:
+
+    def __init__(self, client, size):
+        self.client = client
+        self.size = size
+
+    def key(self, group):
+        return f'chat:history:{group}'
+
+    def push(self, group, entry):
+        pipe = self.client.pipeline()
+        pipe.lpush(self.key(group), json.dumps(entry, separators=(',', ':')))
+        pipe.ltrim(self.key(group), 0, self.size - 1)
+        pipe.execute()
+
+    def latest(self, group, count):
+        return [json.loads(entry) for entry in self.client.lrange(self.key(group), 0, count - 1)]
+
+    def rewrite(self, group, change):
+        """Replace each entry by change(entry), entries it returns None for are dropped."""
+        key = self.key(group)
+
+        def apply(pipe):
+            # Retried by redis-py if a message is pushed meanwhile
+            entries = [change(json.loads(entry)) for entry in pipe.lrange(key, 0, -1)]
+            entries = [json.dumps(entry, separators=(',', ':')) for entry in entries if entry is not None]
+            pipe.multi()
+            pipe.delete(key)
+            if entries:
+                pipe.rpush(key, *entries)
+
+        self.client.transaction(apply, key)
+
+    def clear(self, group):
+        self.client.delete(self.key(group))
+
+
+def history_entry(message, username, avatar):
+    """Entry of a Message whose id and timestamp are already set, see chat.writer."""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'timestamp': serializers.DateTimeField().to_representation(message.timestamp),
+        'user': username,
+        'user_id': message.user_id,
+        'avatar': avatar,
+    }
+
+
+def remove_messages(group, ids):
+    ids = set(ids)
+    get_history().rewrite(group, lambda entry: None if entry['id'] in ids else entry)
+
+
+def update_author(group, user_id, username, avatar):
+    def change(entry):
+        if entry.get('user_id') == user_id:
+            return {**entry, 'user': username, 'avatar': avatar}
+        return entry
+
+    get_history().rewrite(group, change)
+
+
+def render_entries(entries, base_url):
+    """Entries as MessageReadSerializer renders messages, avatars resolved against `base_url`."""
+    return [
+        {
+            'id': entry['id'],
+            'content': entry['content'],
+            'timestamp': entry['timestamp'],
+            'user': entry['user'],
+            'user_profile_picture': absolute_media_url(base_url, entry['avatar']) if entry['avatar'] else None,
+        }
+        for entry in entries
+    ]
+
+
+_history = None
+
+
+def get_history():
+    global _history
+    if _history is None:
+        config = settings.CHAT_HISTORY
+        if config["BACKEND"] == "redis":
+            _history = RedisHistory(get_redis(), config["SIZE"])
+        else:
+            _history = MemoryHistory(config["SIZE"])
+    return _history
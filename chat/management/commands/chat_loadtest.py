@@ -0,0 +1,204 @@
+import asyncio
+import json
+import math
+import time
+
+from channels.routing import URLRouter
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.urls import path
+
+from administrator.consumers import NotificationConsumer
+from administrator.models import User
+from administrator.notifications import user_notification_group
+from chat.consumers import GroupChatConsumer
+from chat.models import ChatGroup
+from chat.writer import get_message_writer
+from kastina_forum.protocol import COMPACT_SUBPROTOCOL, decode_frame, encode_compact, encode_frames
+
+MARKER = 'loadtest'
+
+application = URLRouter([
+    path("ws/notifications/", NotificationConsumer.as_asgi()),
+    path("ws/chat/<str:groupName>/", GroupChatConsumer.as_asgi()),
+])
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+def summarize(sent, expected, latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "sent": sent,
+        "expected_deliveries": expected,
+        "delivered": len(latencies),
+        "delivery_ratio": round(len(latencies) / expected, 4) if expected else None,
+        "sent_per_second": round(sent / elapsed, 2),
+        "delivered_per_second": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies, 50)),
+                ("p95", percentile(latencies, 95)),
+                ("p99", percentile(latencies, 99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chat and notification consumers over the in-memory channel layer "
+        "against a throwaway test database. Prints the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Simulated users, one chat socket each")
+        parser.add_argument("--groups", type=int, default=5, help="Chat groups the users are spread over")
+        parser.add_argument("--rate", type=float, default=1.0, help="Messages per second sent by each user")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of sending")
+        parser.add_argument("--notification-rate", type=float, default=0.0,
+                            help="Notifications per second, each to one user; when set every user also opens a notification socket")
+        parser.add_argument("--protocol", choices=["json", "msgpack"], default="json")
+        parser.add_argument("--drain", type=float, default=2.0, help="Seconds to wait for late deliveries")
+
+    def handle(self, *args, **options):
+        verbosity = options["verbosity"]
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+        try:
+            # Isolated from Redis: in-memory channel layer and chat state
+            with override_settings(
+                DEBUG=False,
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": 1000}}},
+                CHAT_PRESENCE={**settings.CHAT_PRESENCE, "BACKEND": "memory"},
+                CHAT_TYPING={**settings.CHAT_TYPING, "BACKEND": "memory"},
+                CHAT_HISTORY={**settings.CHAT_HISTORY, "BACKEND": "memory"},
+                # A single process, any worker id is unique
+                CHAT_MESSAGE_WRITER={**settings.CHAT_MESSAGE_WRITER, "WORKER_ID": settings.CHAT_MESSAGE_WRITER["WORKER_ID"] or 0},
+                # The budget is still checked on every message but sized to the offered load
+                RATE_LIMIT={"BACKEND": "memory", "CHAT_MESSAGES": f"{math.ceil(options['rate'] * 120)}/min"},
+            ):
+                users, groups = self.create_fixtures(options["users"], options["groups"])
+                result = asyncio.run(self.run(users, groups, options))
+                get_message_writer().drain()
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+
+        self.stdout.write(json.dumps(result, indent=2 if verbosity > 1 else None))
+
+    def create_fixtures(self, user_count, group_count):
+        User.objects.bulk_create([
+            User(username=f"{MARKER}{i}", email=f"{MARKER}{i}@example.com", state_code=f"LT/{i}", is_active=True)
+            for i in range(user_count)
+        ])
+        for i in range(group_count):
+            ChatGroup(name=f"{MARKER}{i}", description="Load test group").save()
+        return list(User.objects.order_by("id")), [f"{MARKER}{i}" for i in range(group_count)]
+
+    async def connect(self, url, user, protocol):
+        subprotocols = [COMPACT_SUBPROTOCOL] if protocol == "msgpack" else None
+        communicator = WebsocketCommunicator(application, url, subprotocols=subprotocols)
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError(f"Could not connect to {url}")
+        return communicator
+
+    async def run(self, users, groups, options):
+        protocol = options["protocol"]
+        chat_sockets = [
+            (groups[i % len(groups)], await self.connect(f"/ws/chat/{groups[i % len(groups)]}/", user, protocol))
+            for i, user in enumerate(users)
+        ]
+        notification_sockets = []
+        if options["notification_rate"] > 0:
+            notification_sockets = [await self.connect("/ws/notifications/", user, protocol) for user in users]
+
+        # Let join frames and history settle before measuring
+        await asyncio.sleep(0.5)
+        chat_latencies, notification_latencies = [], []
+        readers = [asyncio.create_task(self.read(socket, chat_latencies)) for _, socket in chat_sockets]
+        readers += [asyncio.create_task(self.read(socket, notification_latencies)) for socket in notification_sockets]
+
+        group_sizes = {group: sum(1 for g, _ in chat_sockets if g == group) for group in groups}
+        deadline = time.perf_counter() + options["duration"]
+        started = time.perf_counter()
+        senders = [
+            asyncio.create_task(self.send_messages(socket, options["rate"], deadline, protocol))
+            for _, socket in chat_sockets
+        ]
+        if notification_sockets:
+            senders.append(asyncio.create_task(self.send_notifications(users, options["notification_rate"], deadline)))
+        sent = await asyncio.gather(*senders)
+        elapsed = time.perf_counter() - started
+
+        await asyncio.sleep(options["drain"])
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        for _, socket in chat_sockets:
+            await socket.disconnect()
+        for socket in notification_sockets:
+            await socket.disconnect()
+
+        chat_sent = sent[:len(chat_sockets)]
+        result = {
+            "config": {key: options[key] for key in ("users", "groups", "rate", "duration", "notification_rate", "protocol")},
+            "elapsed_seconds": round(elapsed, 3),
+            "chat": summarize(
+                sum(chat_sent),
+                sum(count * group_sizes[group] for count, (group, _) in zip(chat_sent, chat_sockets)),
+                chat_latencies,
+                elapsed,
+            ),
+        }
+        if notification_sockets:
+            result["notifications"] = summarize(sent[-1], sent[-1], notification_latencies, elapsed)
+        return result
+
+    async def send_messages(self, socket, rate, deadline, protocol):
+        interval, sent = 1 / rate, 0
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            payload = {"message": f"{MARKER} {time.perf_counter()}"}
+            if protocol == "msgpack":
+                await socket.send_to(bytes_data=encode_compact(payload))
+            else:
+                await socket.send_to(text_data=json.dumps(payload))
+            sent += 1
+            next_at += interval
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        return sent
+
+    async def send_notifications(self, users, rate, deadline):
+        # Round robin over the users' own groups, like administrator.notifications dispatches
+        channel_layer = get_channel_layer()
+        interval, sent = 1 / rate, 0
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            await channel_layer.group_send(user_notification_group(users[sent % len(users)].id), {
+                "type": "notification_message",
+                **encode_frames({"message": f"{MARKER} {time.perf_counter()}"}),
+            })
+            sent += 1
+            next_at += interval
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        return sent
+
+    async def read(self, socket, latencies):
+        while True:
+            frame = await socket.receive_from(timeout=3600)
+            payload = decode_frame(**({"bytes_data": frame} if isinstance(frame, bytes) else {"text_data": frame}))
+            message = payload.get("message")
+            if isinstance(message, str) and message.startswith(f"{MARKER} "):
+                latencies.append(time.perf_counter() - float(message.split(" ", 1)[1]))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from chat.membership import rebuild_members_count
+from chat.models import ChatGroup, ChatGroupMembership
+
+
+class Command(BaseCommand):
+    help = "Rebuild ChatGroup.members_count from the ChatGroupMembership table."
+
+    def handle(self, *args, **options):
+        updated = rebuild_members_count(ChatGroup, ChatGroupMembership)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt member counts for {updated} groups"))
@@ -0,0 +1,34 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def join_group(user, group):
+    """Make `user` a member of `group`, returns False if they already were."""
+    from .models import ChatGroupMembership
+
+    try:
+        with transaction.atomic():
+            ChatGroupMembership.objects.create(user=user, group=group)
+    except IntegrityError:
+        return False
+    return True
+
+
+def leave_group(user, group):
+    """Drop the membership, returns False if there was none."""
+    from .models import ChatGroupMembership
+
+    deleted, _ = ChatGroupMembership.objects.filter(user=user, group=group).delete()
+    return bool(deleted)
+
+
+def rebuild_members_count(ChatGroup, ChatGroupMembership):
+    """
+    Recompute ChatGroup.members_count from the membership table, repairs
+    counters that drifted. Returns how many groups were updated.
+    """
+    members = ChatGroupMembership.objects.filter(group=OuterRef('pk')).order_by().values('group')
+    return ChatGroup.objects.update(
+        members_count=Coalesce(Subquery(members.annotate(c=Count('id')).values('c')), Value(0))
+    )
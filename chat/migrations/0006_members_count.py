@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def dedupe_and_count_members(apps, schema_editor):
+    ChatGroup = apps.get_model('chat', 'ChatGroup')
+    ChatGroupMembership = apps.get_model('chat', 'ChatGroupMembership')
+
+    duplicates = ChatGroupMembership.objects.values('group', 'user').annotate(keep=Min('id'), n=Count('id')).filter(n__gt=1)
+    for row in duplicates:
+        ChatGroupMembership.objects.filter(group=row['group'], user=row['user']).exclude(id=row['keep']).delete()
+
+    members = ChatGroupMembership.objects.filter(group=OuterRef('pk')).order_by().values('group')
+    ChatGroup.objects.update(
+        members_count=Coalesce(Subquery(members.annotate(c=Count('id')).values('c')), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_alter_message_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatgroup',
+            name='members_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(dedupe_and_count_members, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatgroupmembership',
+            constraint=models.UniqueConstraint(fields=('group', 'user'), name='unique_membership_per_user'),
+        ),
+    ]
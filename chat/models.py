@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from administrator.models import User
 import re
 # Create your models here.
@@ -7,6 +8,8 @@ class ChatGroup(models.Model):
     name = models.CharField(max_length=100)
     display_name = models.CharField(max_length=100, null=True)
     description = models.TextField()
+    # Maintained by chat.signals on membership changes
+    members_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         ordering = ['-id']
@@ -30,7 +33,7 @@ class ChatGroup(models.Model):
         return self.name
     
     def get_members_count(self):
-        return self.chatgroupmembership_set.count()
+        return self.members_count
 
 class ChatGroupMembership(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -41,6 +44,9 @@ class ChatGroupMembership(models.Model):
         indexes = [
             models.Index(fields=['group', 'user']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'user'], name='unique_membership_per_user'),
+        ]
         
         
     def __str__(self):
@@ -50,12 +56,14 @@ class Message(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     group = models.ForeignKey(ChatGroup, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by chat.writer before the row is written so broadcasts can carry it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['timestamp', 'group']),
+            models.Index(fields=['group', 'timestamp', 'id']),
         ]
 
     def __str__(self):
@@ -0,0 +1,121 @@
+"""
+Online presence per chat group.
+
+Each group keeps a sorted set of user ids scored by their last heartbeat and
+a hash counting each user's open sockets, so a user with several tabs stays
+online until the last one closes. Consumers heartbeat every
+CHAT_PRESENCE["HEARTBEAT_INTERVAL"] seconds; users whose process died stop
+heartbeating and drop out after TTL seconds. Durable membership is separate,
+see chat.membership.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from kastina_forum.redis_client import get_redis
+
+
+class MemoryPresence:
+    """Per-process presence, only accurate with a single worker."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def connect(self, group, user_id):
+        with self.lock:
+            members = self.groups.setdefault(group, {})
+            _, connections = members.get(user_id, (0, 0))
+            members[user_id] = (time.time(), connections + 1)
+            return self._online(members)
+
+    def heartbeat(self, group, user_id):
+        with self.lock:
+            members = self.groups.setdefault(group, {})
+            _, connections = members.get(user_id, (0, 1))
+            members[user_id] = (time.time(), connections)
+
+    def disconnect(self, group, user_id):
+        with self.lock:
+            members = self.groups.get(group, {})
+            last_seen, connections = members.get(user_id, (0, 1))
+            if connections > 1:
+                members[user_id] = (last_seen, connections - 1)
+            else:
+                members.pop(user_id, None)
+            return self._online(members)
+
+    def online_count(self, group):
+        with self.lock:
+            return self._online(self.groups.get(group, {}))
+
+    def _online(self, members):
+        cutoff = time.time() - self.ttl
+        for user_id in [user_id for user_id, (last_seen, _) in members.items() if last_seen < cutoff]:
+            del members[user_id]
+        return len(members)
+
+
+class RedisPresence:
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def online_key(self, group):
+        return f'chat:presence:{group}'
+
+    def connections_key(self, group):
+        return f'chat:presence:{group}:connections'
+
+    def connect(self, group, user_id):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(self.online_key(group), {user_id: now})
+        pipe.hincrby(self.connections_key(group), user_id, 1)
+        self._expire(pipe, group, now)
+        return pipe.execute()[-1]
+
+    def heartbeat(self, group, user_id):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(self.online_key(group), {user_id: now})
+        pipe.expire(self.connections_key(group), self.ttl)
+        pipe.expire(self.online_key(group), self.ttl)
+        pipe.execute()
+
+    def disconnect(self, group, user_id):
+        if self.client.hincrby(self.connections_key(group), user_id, -1) <= 0:
+            pipe = self.client.pipeline()
+            pipe.hdel(self.connections_key(group), user_id)
+            pipe.zrem(self.online_key(group), user_id)
+            pipe.execute()
+        return self.online_count(group)
+
+    def online_count(self, group):
+        pipe = self.client.pipeline()
+        self._expire(pipe, group, time.time())
+        return pipe.execute()[-1]
+
+    def _expire(self, pipe, group, now):
+        # Drop users whose sockets stopped heartbeating, then count the rest
+        pipe.zremrangebyscore(self.online_key(group), '-inf', now - self.ttl)
+        pipe.expire(self.connections_key(group), self.ttl)
+        pipe.expire(self.online_key(group), self.ttl)
+        pipe.zcard(self.online_key(group))
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        config = settings.CHAT_PRESENCE
+        if config["BACKEND"] == "redis":
+            _presence = RedisPresence(get_redis(), config["TTL"])
+        else:
+            _presence = MemoryPresence(config["TTL"])
+    return _presence
@@ -2,6 +2,8 @@ from django.conf import settings
 from rest_framework import serializers
 from rest_framework.exceptions import ParseError
 
+from administrator.avatars import avatar_url
+
 from .models import ChatGroup, Message
 
 
@@ -13,7 +15,7 @@ class ChatGroupListSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'display_name', 'description', 'total_member']
 
     def get_total_member(self, obj):
-        return obj.get_members_count()
+        return obj.members_count
     
    
 
@@ -29,6 +31,5 @@ class MessageReadSerializer(serializers.ModelSerializer):
     
     def get_user_profile_picture(self, obj):
         """Returns the profile picture URL for the user"""
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.user.profile_picture.url)
+        return avatar_url(self.context.get('request'), obj.user)
     
\ No newline at end of file
@@ -0,0 +1,100 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from administrator.avatars import avatar_name
+from administrator.models import User
+
+from .consumers import invalidate_group_cache, user_context_group
+from .history import get_history, remove_messages, update_author
+from .models import ChatGroup, ChatGroupMembership, Message
+
+logger = logging.getLogger(__name__)
+
+# User fields copied into chat history entries
+AUTHOR_FIELDS = {'username', 'profile_picture', 'avatar_thumbnail'}
+
+
+def invalidate_chat_context(group):
+    """Tell open chat sockets in `group` to reload their cached context once the change is committed."""
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(group, {'type': 'chat_context_invalidate'})
+        except Exception as e:
+            logger.warning("Could not send chat context invalidation to %s: %s", group, e)
+
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_chat_context(user_context_group(instance.id))
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    user_id, username, avatar = instance.id, instance.username, avatar_name(instance)
+    groups = list(ChatGroup.objects.filter(message__user_id=user_id).values_list('name', flat=True).distinct())
+
+    def update():
+        for group_name in groups:
+            update_author(group_name, user_id, username, avatar)
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    # The group is gone already when it is deleted with its messages, chat_group_deleted clears it
+    group_name = ChatGroup.objects.filter(pk=instance.group_id).values_list('name', flat=True).first()
+    if group_name is not None:
+        message_id = instance.id
+        transaction.on_commit(lambda: remove_messages(group_name, [message_id]))
+
+
+@receiver(post_save, sender=ChatGroup)
+@receiver(post_delete, sender=ChatGroup)
+def chat_group_changed(sender, instance, **kwargs):
+    # Drop the cached row before the sockets reload it
+    group_name = instance.name
+    transaction.on_commit(lambda: invalidate_group_cache(group_name))
+    invalidate_chat_context(group_name)
+
+
+@receiver(post_delete, sender=ChatGroup)
+def chat_group_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_history().clear(instance.name))
+
+
+def members_count_changed(group_id):
+    # The cached group row carries members_count
+    group_name = ChatGroup.objects.filter(pk=group_id).values_list('name', flat=True).first()
+    if group_name is not None:
+        transaction.on_commit(lambda: invalidate_group_cache(group_name))
+
+
+@receiver(post_save, sender=ChatGroupMembership)
+def membership_created(sender, instance, created, **kwargs):
+    if created:
+        ChatGroup.objects.filter(pk=instance.group_id).update(members_count=F('members_count') + 1)
+        members_count_changed(instance.group_id)
+
+
+@receiver(post_delete, sender=ChatGroupMembership)
+def membership_deleted(sender, instance, **kwargs):
+    ChatGroup.objects.filter(pk=instance.group_id, members_count__gt=0).update(members_count=F('members_count') - 1)
+    members_count_changed(instance.group_id)
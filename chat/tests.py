@@ -1,3 +1,380 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+
+from kastina_forum.testing import IN_MEMORY_LAYERS, create_user
+
+from . import history
+from .consumers import GroupChatConsumer
+from .history import MemoryHistory, RedisHistory, history_entry
+from .management.commands.chat_loadtest import Command as LoadTestCommand, percentile
+from .models import ChatGroup, Message
+from .presence import MemoryPresence, RedisPresence
+from .typing import MemoryTypingStore, RedisTypingStore, TypingCoalescer
+from .writer import SEQUENCE_BITS, WORKER_BITS, MessageIdGenerator, MessageWriter, get_message_writer
+
+
+class ChatSocketMixin:
+    """Chat sockets of a group over the in-memory channel layer."""
+
+    def setUp(self):
+        cache.clear()
+        self.group = ChatGroup.objects.create(name='general', description='')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(GroupChatConsumer.as_asgi(), f'/ws/chat/{self.group.name}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'groupName': self.group.name}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await self.settle(communicator)
+        return communicator
+
+    async def settle(self, *communicators):
+        # Frames sent on connect, such as join notices
+        for communicator in communicators:
+            while not await communicator.receive_nothing(0.1):
+                await communicator.receive_from()
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ChatContextTests(ChatSocketMixin, TransactionTestCase):
+
+    async def talk(self, user, queries):
+        communicator = await self.connect(user)
+        queries.clear()
+        await communicator.send_json_to({'message': 'hello'})
+        frame = await self.receive(communicator)
+        reads = [sql for sql in queries if sql.startswith('SELECT')]
+        await communicator.disconnect()
+        return frame, reads
+
+    def test_messages_make_no_database_reads(self):
+        user = create_user('talker')
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            frame, reads = async_to_sync(self.talk)(user, queries)
+        self.assertEqual((frame['message'], frame['user']), ('hello', 'talker'))
+        self.assertEqual(reads, [])
+        get_message_writer().drain()
+
+    async def test_profile_changes_reach_open_sockets(self):
+        user = await database_sync_to_async(create_user)('talker')
+        communicator = await self.connect(user)
+
+        user.username = 'renamed'
+        await database_sync_to_async(user.save)()
+        await communicator.receive_nothing(0.1)
+        await communicator.send_json_to({'message': 'hello'})
+        self.assertEqual((await self.receive(communicator))['user'], 'renamed')
+
+        await communicator.disconnect()
+        await database_sync_to_async(get_message_writer().drain)()
+
+
+class MessageIdTests(TestCase):
+
+    def test_ids_are_unique_and_increasing(self):
+        next_id = MessageIdGenerator(worker_id=3)
+        # More than one millisecond's worth of sequence numbers
+        ids = [next_id() for _ in range(5 * (1 << SEQUENCE_BITS))]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertLess(max(ids), 1 << 53)
+
+    def test_workers_never_share_ids(self):
+        first, second = MessageIdGenerator(worker_id=0), MessageIdGenerator(worker_id=1)
+        with mock.patch('chat.writer.time.time', return_value=1760000000.0):
+            ids = [first() for _ in range(100)] + [second() for _ in range(100)]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_dyno_numbers_past_sixteen_are_valid(self):
+        next_id = MessageIdGenerator(worker_id=200)
+        self.assertEqual(next_id() >> SEQUENCE_BITS & ((1 << WORKER_BITS) - 1), 200)
+
+    def test_worker_id_is_required(self):
+        for worker_id in (None, -1, 1 << WORKER_BITS):
+            with self.assertRaises(ImproperlyConfigured):
+                MessageIdGenerator(worker_id)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class MessageWriterTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('writer')
+        self.group = ChatGroup.objects.create(name='general', description='')
+        self.writer = MessageWriter(batch_size=100, flush_interval=60, worker_id=1)
+
+    def message(self, content):
+        return Message(
+            id=self.writer.next_id(), user_id=self.user.id, group_id=self.group.id, content=content
+        )
+
+    def test_failed_batch_is_requeued_and_written_later(self):
+        batch = [self.message('first'), self.message('second')]
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError("database is locked")):
+            with self.assertLogs('chat.writer', 'ERROR'):
+                self.assertFalse(self.writer.write(batch))
+        self.assertEqual(self.writer.buffer, batch)
+
+        self.writer.drain()
+        self.assertEqual(self.writer.buffer, [])
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('id', 'content')),
+            [(message.id, message.content) for message in batch],
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class PresenceTests(TestCase):
+
+    def check_tabs_keep_a_user_online(self, presence):
+        self.assertEqual(presence.connect('general', 1), 1)
+        self.assertEqual(presence.connect('general', 1), 1)
+        self.assertEqual(presence.connect('general', 2), 2)
+        self.assertEqual(presence.disconnect('general', 1), 2)
+        self.assertEqual(presence.disconnect('general', 1), 1)
+
+    def check_silent_users_drop_out(self, presence):
+        with mock.patch('chat.presence.time.time', return_value=1760000000.0):
+            presence.connect('general', 1)
+            presence.connect('general', 2)
+        with mock.patch('chat.presence.time.time', return_value=1760000030.0):
+            presence.heartbeat('general', 2)
+        with mock.patch('chat.presence.time.time', return_value=1760000070.0):
+            self.assertEqual(presence.online_count('general'), 1)
+
+    def test_memory_presence(self):
+        self.check_tabs_keep_a_user_online(MemoryPresence(60))
+        self.check_silent_users_drop_out(MemoryPresence(60))
+
+    def test_redis_presence(self):
+        self.check_tabs_keep_a_user_online(RedisPresence(fakeredis.FakeRedis(), 60))
+        self.check_silent_users_drop_out(RedisPresence(fakeredis.FakeRedis(), 60))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class MembershipTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('member')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.group = ChatGroup.objects.create(name='general', description='')
+        self.url = f'/chat/api/chat/members/{self.group.name}/'
+
+    def test_join_and_leave_keep_the_count(self):
+        joined = self.client.post(self.url)
+        self.assertEqual((joined.status_code, joined.json()['total_members']), (201, 1))
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+
+        left = self.client.delete(self.url)
+        self.assertEqual((left.status_code, left.json()['total_members']), (200, 0))
+        self.assertEqual(self.client.delete(self.url).status_code, 400)
+        self.assertEqual(self.client.post('/chat/api/chat/members/missing/').status_code, 404)
+
+    def test_rebuild_repairs_drifted_counts(self):
+        self.client.post(self.url)
+        ChatGroup.objects.filter(pk=self.group.pk).update(members_count=5)
+
+        out = io.StringIO()
+        call_command('rebuild_members_count', stdout=out)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.members_count, 1)
+        self.assertIn('1 groups', out.getvalue())
+
+
+class TypingTests(TestCase):
+
+    async def listen(self, layer):
+        channel = await layer.new_channel()
+        await layer.group_add('general', channel)
+        return channel
+
+    async def test_one_frame_per_interval(self):
+        layer = InMemoryChannelLayer()
+        channel = await self.listen(layer)
+        coalescer = TypingCoalescer(MemoryTypingStore(), 0.05, 4)
+
+        for user in ('ada', 'bob', 'ada', 'cy'):
+            await coalescer.typing(layer, 'general', user)
+        await coalescer.stopped('general', 'cy')
+
+        event = await asyncio.wait_for(layer.receive(channel), 1)
+        self.assertEqual((event['type'], event['users']), ('user_typing', ['ada', 'bob']))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+
+    def test_workers_share_the_flush_slot(self):
+        client = fakeredis.FakeRedis()
+        first, second = RedisTypingStore(client), RedisTypingStore(client)
+        expires_at = time.time() + 4
+        self.assertTrue(first.mark('general', 'ada', expires_at, 1.0))
+        self.assertFalse(second.mark('general', 'bob', expires_at, 1.0))
+        self.assertEqual(second.take('general', time.time()), ['ada', 'bob'])
+
+    async def test_stale_frames_are_dropped(self):
+        consumer = GroupChatConsumer()
+        consumer.username = 'ada'
+        consumer.send_payload = mock.AsyncMock()
+
+        await consumer.user_typing({'users': ['ada', 'bob'], 'sent_at': time.time() - 10})
+        consumer.send_payload.assert_not_called()
+
+        await consumer.user_typing({'users': ['ada', 'bob'], 'sent_at': time.time()})
+        consumer.send_payload.assert_awaited_once_with({'users': ['bob'], 'user': 'bob', 'is_typing': True})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class HistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('author')
+        self.group = ChatGroup.objects.create(name='general', description='')
+        self.messages = [Message.objects.create(user=self.user, group=self.group, content=str(i)) for i in range(3)]
+
+    def fill(self, backend):
+        patcher = mock.patch.object(history, '_history', backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for message in self.messages:
+            backend.push(self.group.name, history_entry(message, self.user.username, None))
+        return backend
+
+    def check_entries_follow_changes(self, backend):
+        self.fill(backend)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages[1].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+
+        entries = backend.latest(self.group.name, 10)
+        self.assertEqual([entry['content'] for entry in entries], ['2', '0'])
+        self.assertEqual({entry['user'] for entry in entries}, {'renamed'})
+
+    def test_memory_entries_follow_changes(self):
+        self.check_entries_follow_changes(MemoryHistory(50))
+
+    def test_redis_entries_follow_changes(self):
+        self.check_entries_follow_changes(RedisHistory(fakeredis.FakeRedis(), 50))
+
+    @override_settings(CHAT_HISTORY={'BACKEND': 'memory', 'SIZE': 50})
+    def test_per_process_history_is_not_served_as_a_page(self):
+        # This worker's buffer alone, full of messages the database does not know about
+        backend = self.fill(MemoryHistory(50))
+        for i in range(30):
+            stray = Message(id=10**12 + i, user_id=self.user.id, group_id=self.group.id, content='stray')
+            backend.push(self.group.name, history_entry(stray, self.user.username, None))
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(f'/chat/api/chat/get/messages/{self.group.name}/', {'cursor': ''})
+        self.assertEqual([message['content'] for message in response.json()['results']], ['2', '1', '0'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class BroadcastTests(ChatSocketMixin, TransactionTestCase):
+
+    async def test_recipients_get_the_senders_frame(self):
+        sender = await self.connect(await database_sync_to_async(create_user)('sender'))
+        reader = await self.connect(await database_sync_to_async(create_user)('reader'))
+        await self.settle(sender)
+
+        sent_at = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=sent_at) as now:
+            await sender.send_json_to({'message': 'hello'})
+            first = await self.receive(sender)
+            # Recipients forward the frame, they do not stamp their own time
+            now.return_value = sent_at + timedelta(minutes=5)
+            second = await self.receive(reader)
+        self.assertEqual(first, second)
+        self.assertEqual(parse_datetime(first['timestamp']), sent_at)
+
+        await database_sync_to_async(get_message_writer().drain)()
+        message = await Message.objects.aget(pk=first['id'])
+        self.assertEqual(message.timestamp, sent_at)
+
+        await sender.disconnect()
+        await reader.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class LoadTestCommandTests(TransactionTestCase):
+
+    def test_percentiles(self):
+        self.assertEqual([percentile([1, 2, 3, 4], pct) for pct in (50, 95, 99)], [2, 4, 4])
+        self.assertIsNone(percentile([], 50))
+
+    async def test_run_reports_every_delivery(self):
+        command = LoadTestCommand()
+        users, groups = await database_sync_to_async(command.create_fixtures)(4, 2)
+        options = {
+            'users': 4, 'groups': 2, 'rate': 10, 'duration': 0.3, 'notification_rate': 10,
+            'protocol': 'msgpack', 'drain': 0.3,
+        }
+        result = json.loads(json.dumps(await command.run(users, groups, options)))
+        await database_sync_to_async(get_message_writer().drain)()
+
+        chat = result['chat']
+        self.assertGreater(chat['sent'], 0)
+        self.assertEqual(chat['delivered'], chat['expected_deliveries'])
+        self.assertEqual(set(chat['latency_ms']), {'p50', 'p95', 'p99', 'max'})
+        self.assertEqual(result['notifications']['delivered'], result['notifications']['sent'])
+        self.assertEqual(await Message.objects.acount(), chat['sent'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ChatGroupListTests(TestCase):
+    url = '/chat/api/chat/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_user('reader'))
+        for i in range(25):
+            ChatGroup.objects.create(name=f'group-{i}', description='')
+
+    def names(self, url):
+        return [group['name'] for group in self.client.get(url).json()['results']]
+
+    def test_sample_is_a_page_of_distinct_groups(self):
+        sample = self.client.get(self.url).json()
+        self.assertNotIn('count', sample)
+        self.assertEqual(len({group['name'] for group in sample['results']}), 20)
+        # `next` draws a fresh sample rather than a page
+        self.assertEqual(len(set(self.names(sample['next']))), 20)
+
+    def test_pages_still_walk_all_groups(self):
+        self.assertEqual(len(self.names(self.url + '?page=2')), 5)
+
+    def test_sparse_ids_are_topped_up(self):
+        ChatGroup.objects.create(id=10**9, name='far', description='')
+        with self.assertNumQueries(6):
+            names = self.names(self.url)
+        self.assertEqual(len(set(names)), 20)
@@ -0,0 +1,119 @@
+"""
+Typing indicator coalescing.
+
+Sockets report typing at most once per CHAT_TYPING["DEBOUNCE"] seconds. The
+typing users of a group are kept with an expiry, and the first report in a
+quiet group schedules a flush INTERVAL seconds later that sends a single
+`user_typing` event listing everyone still typing. With the Redis backend
+the state and the flush slot are shared, so a group gets one frame per
+interval no matter how many workers its sockets are spread over.
+"""
+import asyncio
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from kastina_forum.redis_client import get_redis
+
+
+class MemoryTypingStore:
+    """Per-process state, only coalesces sockets of the same worker."""
+
+    def __init__(self):
+        self.groups = {}
+        self.scheduled = set()
+        self.lock = threading.Lock()
+
+    def mark(self, group, user, expires_at, interval):
+        with self.lock:
+            self.groups.setdefault(group, {})[user] = expires_at
+            if group in self.scheduled:
+                return False
+            self.scheduled.add(group)
+            return True
+
+    def clear(self, group, user):
+        with self.lock:
+            self.groups.get(group, {}).pop(user, None)
+
+    def take(self, group, now):
+        with self.lock:
+            self.scheduled.discard(group)
+            users = self.groups.get(group, {})
+            for user in [user for user, expires_at in users.items() if expires_at <= now]:
+                del users[user]
+            if not users:
+                self.groups.pop(group, None)
+            return sorted(users)
+
+
+class RedisTypingStore:
+
+    def __init__(self, client):
+        self.client = client
+
+    def typing_key(self, group):
+        return f'chat:typing:{group}'
+
+    def flush_key(self, group):
+        return f'chat:typing:{group}:flush'
+
+    def mark(self, group, user, expires_at, interval):
+        pipe = self.client.pipeline()
+        pipe.zadd(self.typing_key(group), {user: expires_at})
+        pipe.expire(self.typing_key(group), max(int(expires_at - time.time()) + 1, 1))
+        # Whoever claims the slot of this interval flushes it
+        pipe.set(self.flush_key(group), 1, nx=True, px=max(int(interval * 1000), 1))
+        return bool(pipe.execute()[-1])
+
+    def clear(self, group, user):
+        self.client.zrem(self.typing_key(group), user)
+
+    def take(self, group, now):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.typing_key(group), '-inf', now)
+        pipe.zrange(self.typing_key(group), 0, -1)
+        users = pipe.execute()[-1]
+        return sorted(user.decode() if isinstance(user, bytes) else user for user in users)
+
+
+class TypingCoalescer:
+
+    def __init__(self, store, interval, ttl):
+        self.store = store
+        self.interval = interval
+        self.ttl = ttl
+
+    async def typing(self, channel_layer, group, user):
+        should_flush = await sync_to_async(self.store.mark, thread_sensitive=False)(
+            group, user, time.time() + self.ttl, self.interval
+        )
+        if should_flush:
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.interval, lambda: loop.create_task(self.flush(channel_layer, group)))
+
+    async def stopped(self, group, user):
+        await sync_to_async(self.store.clear, thread_sensitive=False)(group, user)
+
+    async def flush(self, channel_layer, group):
+        users = await sync_to_async(self.store.take, thread_sensitive=False)(group, time.time())
+        if users:
+            await channel_layer.group_send(group, {
+                'type': 'user_typing',
+                'users': users,
+                'sent_at': time.time(),
+            })
+
+
+_coalescer = None
+
+
+def get_typing_coalescer():
+    global _coalescer
+    if _coalescer is None:
+        config = settings.CHAT_TYPING
+        store = RedisTypingStore(get_redis()) if config["BACKEND"] == "redis" else MemoryTypingStore()
+        _coalescer = TypingCoalescer(store, config["INTERVAL"], config["TTL"])
+    return _coalescer
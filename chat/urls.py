@@ -8,6 +8,7 @@ urlpatterns = [
             [
                 path("", ChatGroupListView.as_view()),
                 path("get/messages/<str:groupName>/", MessageReadView.as_view()),
+                path("members/<str:groupName>/", ChatGroupJoinView.as_view()),
                 
             ]
         )
@@ -1,11 +1,22 @@
+import random
+
+from django.conf import settings
+from django.db.models import Max, Min
 from django.shortcuts import render
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status, generics
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.views import APIView
 
+from administrator.avatars import request_base_url
+from kastina_forum.pagination import KeysetPagination
+from .history import get_history, render_entries
+from .membership import join_group, leave_group
 from .models import ChatGroup, Message
+from .presence import get_presence
 from .serializers import ChatGroupListSerializer, MessageReadSerializer
 
 
@@ -13,31 +24,130 @@ from .serializers import ChatGroupListSerializer, MessageReadSerializer
 
 
 class ChatGroupListView(generics.ListAPIView):
+    """
+    Without `?page` returns a random sample of groups, drawn as random ids
+    between the lowest and the highest one, so the table is never sorted
+    randomly or counted. `next` links to a fresh sample, `?page=N` walks
+    all groups by id.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = ChatGroupListSerializer
+    # Rounds of random ids before topping the sample up from a random id onwards
+    sample_rounds = 3
 
     def get_queryset(self):
         return ChatGroup.objects.only(
-            'id', 'name','display_name','description'
-        ).order_by('?')
+            'id', 'name','display_name','description', 'members_count'
+        ).order_by('id')
 
     
     pagination_class = PageNumberPagination
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator.page_query_param in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        groups = self.sample(self.paginator.get_page_size(request))
+        return Response({
+            'next': request.build_absolute_uri(),
+            'previous': None,
+            'results': self.get_serializer(groups, many=True).data,
+        })
+
+    def sample(self, size):
+        bounds = ChatGroup.objects.aggregate(low=Min('id'), high=Max('id'))
+        low, high = bounds['low'], bounds['high']
+        if low is None:
+            return []
+
+        queryset = self.get_queryset()
+        groups = {}
+        # Drawn ids that exist are a uniform sample, twice as many draws as needed absorb gaps in the ids
+        for _ in range(self.sample_rounds):
+            wanted = size - len(groups)
+            ids = random.sample(range(low, high + 1), min(2 * wanted, high - low + 1))
+            found = list(queryset.filter(id__in=ids).exclude(id__in=list(groups)))
+            groups.update((group.id, group) for group in random.sample(found, min(wanted, len(found))))
+            if len(groups) >= size or len(ids) > high - low:
+                break
+        else:
+            # Ids too sparse for the draws: the groups from a random id on, wrapping around
+            pivot = random.randint(low, high)
+            for part in (queryset.filter(id__gte=pivot), queryset.filter(id__lt=pivot)):
+                wanted = size - len(groups)
+                if wanted > 0:
+                    groups.update((group.id, group) for group in part.exclude(id__in=list(groups))[:wanted])
+
+        groups = list(groups.values())
+        random.shuffle(groups)
+        return groups
     
     
     
 class MessageReadView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageReadSerializer
-    pagination_class = PageNumberPagination
+    pagination_class = KeysetPagination
+    # Cursor mode pages from the newest message backwards
+    cursor_ordering = ('-timestamp', '-id')
 
     def get_queryset(self):
         groupName = self.kwargs['groupName']
 
         # Query the posts filtered by the provided username
-        queryset = Message.objects.only(
-            'id', 'content', 'timestamp','user__username'
+        queryset = Message.objects.select_related('user').only(
+            'id', 'content', 'timestamp', 'user__username', 'user__profile_picture', 'user__avatar_thumbnail'
         ).filter(group__name=groupName)
 
         # Order the posts randomly
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # The first cursor page usually sits in the history buffer already, when the buffer is
+        # shared by all workers. A per-process buffer misses what other workers received.
+        if (
+            settings.CHAT_HISTORY["BACKEND"] == "redis"
+            and request.query_params.get(self.paginator.cursor_query_param) == ''
+        ):
+            page_size = self.paginator.get_page_size(request)
+            entries = get_history().latest(self.kwargs['groupName'], page_size + 1)
+            if len(entries) > page_size:
+                entries = entries[:page_size]
+                rows = [Message(id=entry['id'], timestamp=parse_datetime(entry['timestamp'])) for entry in entries]
+                self.paginator.paginate_rows(rows, request, self, has_next=True)
+                return self.paginator.get_paginated_response(render_entries(entries, request_base_url(request)))
+        return super().list(request, *args, **kwargs)
+
+
+class ChatGroupJoinView(APIView):
+    """
+    Durable membership: POST joins the group, DELETE leaves it. Opening a
+    chat socket only marks the user online, see chat.presence.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, groupName, *args, **kwargs):
+        group = ChatGroup.objects.filter(name=groupName).only('id', 'name').first()
+        if group is None:
+            return Response({"error": "Chat group not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not join_group(request.user, group):
+            return Response(self.counts(group, "You are already a member of this group"), status=status.HTTP_200_OK)
+        return Response(self.counts(group, "Joined group successfully"), status=status.HTTP_201_CREATED)
+
+    def delete(self, request, groupName, *args, **kwargs):
+        group = ChatGroup.objects.filter(name=groupName).only('id', 'name').first()
+        if group is None:
+            return Response({"error": "Chat group not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not leave_group(request.user, group):
+            return Response({"error": "You are not a member of this group"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.counts(group, "Left group successfully"), status=status.HTTP_200_OK)
+
+    def counts(self, group, message):
+        group.refresh_from_db(fields=['members_count'])
+        return {
+            "message": message,
+            "total_members": group.members_count,
+            "online_members": get_presence().online_count(group.name),
+        }
@@ -0,0 +1,162 @@
+"""
+Write-behind persistence for chat messages.
+
+Consumers hand messages to the process-wide MessageWriter, which gives each
+one its final id and timestamp straight away (so the broadcast can carry
+them) and writes them with bulk_create once CHAT_MESSAGE_WRITER["BATCH_SIZE"]
+are buffered or FLUSH_INTERVAL seconds have passed. Whatever is still
+buffered when the process exits is written by an atexit hook.
+
+Ids embed CHAT_MESSAGE_WRITER["WORKER_ID"], which must be unique per
+process: ids are broadcast before the row exists, so two processes sharing
+a worker id could hand out the same id and a message is never renumbered.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 2025-01-01T00:00:00Z in milliseconds
+ID_EPOCH_MS = 1735689600000
+WORKER_BITS = 8
+SEQUENCE_BITS = 5
+
+
+class MessageIdGenerator:
+    """
+    Time ordered ids: milliseconds since ID_EPOCH_MS, then a worker id, then a
+    per-millisecond sequence. They sort like the timestamps, sit far above
+    anything the database sequence hands out and stay within 53 bits for
+    about 34 years, so JavaScript clients read them exactly. A worker hands
+    out 32 ids per millisecond before borrowing the next one.
+    """
+
+    def __init__(self, worker_id):
+        if worker_id is None or not 0 <= worker_id < 1 << WORKER_BITS:
+            raise ImproperlyConfigured(
+                f"CHAT_WORKER_ID must be set to a number from 0 to {(1 << WORKER_BITS) - 1}, unique per process"
+            )
+        self.worker_id = worker_id
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            now_ms = max(int(time.time() * 1000), self.last_ms)
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) % (1 << SEQUENCE_BITS)
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond, borrow the next one
+                    now_ms += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+            return (
+                ((now_ms - ID_EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS))
+                | (self.worker_id << SEQUENCE_BITS)
+                | self.sequence
+            )
+
+
+class MessageWriter:
+
+    def __init__(self, batch_size, flush_interval, worker_id):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.next_id = MessageIdGenerator(worker_id)
+        self.buffer = []
+        self.timer = None
+        self.lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def enqueue(self, user_id, group_id, content):
+        """Buffer a message and return it with its id and timestamp already set."""
+        Message = apps.get_model('chat', 'Message')
+        message = Message(
+            id=self.next_id(), user_id=user_id, group_id=group_id, content=content, timestamp=timezone.now()
+        )
+        with self.lock:
+            self.buffer.append(message)
+            full = len(self.buffer) >= self.batch_size
+
+        if full:
+            asyncio.get_running_loop().create_task(self.flush())
+        else:
+            self.schedule()
+        return message
+
+    def schedule(self):
+        if self.timer is None:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(self.flush_interval, lambda: loop.create_task(self.flush()))
+
+    def take_batch(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    async def flush(self):
+        batch = self.take_batch()
+        if batch and not await database_sync_to_async(self.write)(batch):
+            # Requeued, try again after the interval even if no new message arrives
+            self.schedule()
+
+    def drain(self):
+        """Synchronously write everything still buffered, used at shutdown."""
+        batch = self.take_batch()
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        """Store a batch, returns False when it was requeued after an error."""
+        Message = apps.get_model('chat', 'Message')
+        try:
+            Message.objects.bulk_create(batch)
+            return True
+        except IntegrityError:
+            logger.warning("Bulk insert of %s chat messages hit a conflict, retrying one by one", len(batch))
+        except Exception:
+            logger.exception("Failed to write %s chat messages, requeueing them", len(batch))
+            with self.lock:
+                self.buffer[:0] = batch
+            return False
+
+        for message in batch:
+            if Message.objects.filter(pk=message.id).exists():
+                # Only possible when two processes share a worker id. The id was
+                # broadcast already, storing the message under another one would
+                # point clients at the wrong row.
+                logger.error("Chat message id %s already exists, check CHAT_WORKER_ID, dropping it", message.id)
+                continue
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except IntegrityError:
+                # The group or user was deleted while the message sat in the buffer
+                logger.warning("Dropping chat message %s for group %s", message.id, message.group_id)
+        return True
+
+
+_writer = None
+
+
+def get_message_writer():
+    global _writer
+    if _writer is None:
+        config = settings.CHAT_MESSAGE_WRITER
+        _writer = MessageWriter(config["BATCH_SIZE"], config["FLUSH_INTERVAL"], config["WORKER_ID"])
+    return _writer
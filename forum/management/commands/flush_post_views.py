@@ -0,0 +1,32 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from forum.view_counter import get_view_counter
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Write buffered post views to Post.views. Pass --loop to keep flushing every N seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS")
+
+    def handle(self, *args, **options):
+        counter = get_view_counter()
+        while True:
+            if not options["loop"]:
+                flushed = counter.flush()
+                self.stdout.write(f"Flushed views for {flushed} posts")
+                break
+            try:
+                flushed = counter.flush()
+                self.stdout.write(f"Flushed views for {flushed} posts")
+            except Exception:
+                # What was not written stays buffered for the next round
+                logger.exception("Flushing post views failed")
+                close_old_connections()
+            time.sleep(options["loop"])
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from forum.models import Comment, Like, Post
+
+
+class Command(BaseCommand):
+    help = "Rebuild Post.likes_count and Post.comments_count from the Like and Comment tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        likes = Like.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(c=Count("id")).values("c")
+        comments = Comment.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(c=Count("id")).values("c")
+
+        ids = list(Post.objects.order_by("id").values_list("id", flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with transaction.atomic():
+                updated += Post.objects.filter(id__in=batch).update(
+                    likes_count=Coalesce(Subquery(likes), Value(0)),
+                    comments_count=Coalesce(Subquery(comments), Value(0)),
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {updated} posts"))
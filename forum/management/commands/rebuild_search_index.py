@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from administrator.models import User
+from forum.models import Post
+from forum.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search index for posts and users from the source tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        get_backend().install()
+        rebuild_index(Post.objects.all(), User.objects.all(), batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Comment, Post, TrendingScore
+from forum.trending import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = "Recompute trending scores for posts inside TRENDING['MAX_WINDOW_DAYS'] and prune older ones."
+
+    def handle(self, *args, **options):
+        rebuild_scores(Post, Comment, TrendingScore)
+        self.stdout.write(self.style.SUCCESS(f"{TrendingScore.objects.count()} trending scores rebuilt"))
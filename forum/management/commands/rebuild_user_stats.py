@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from administrator.models import User
+from forum.models import Comment, Like, Post, UserStats
+from forum.user_stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = "Reconcile UserStats with the Post, Comment and Like tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_user_stats(User, Post, Comment, Like, UserStats, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Reconciled stats for {UserStats.objects.count()} users"))
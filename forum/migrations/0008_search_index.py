@@ -0,0 +1,67 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:20
+
+from django.db import migrations
+
+# Frozen copy of forum.search.backends as of this migration: one table per kind
+# with the searchable fields, filled from the source tables in SQL.
+KINDS = ('post', 'user')
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    post = apps.get_model('forum', 'Post')._meta.db_table
+    category = apps.get_model('forum', 'Category')._meta.db_table
+    user = apps.get_model('administrator', 'User')._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_post USING fts5("
+                "content, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_user USING fts5("
+                "username, email, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                f"INSERT OR REPLACE INTO search_post (rowid, content, category) "
+                f"SELECT p.id, p.content, coalesce(c.name, '') FROM {post} p LEFT JOIN {category} c ON c.id = p.category_id"
+            )
+            cursor.execute(f"INSERT OR REPLACE INTO search_user (rowid, username, email) SELECT id, username, email FROM {user}")
+        elif connection.vendor == 'postgresql':
+            for kind in KINDS:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS search_{kind} (id bigint PRIMARY KEY, document tsvector NOT NULL)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS search_{kind}_document ON search_{kind} USING GIN (document)")
+            cursor.execute(
+                f"INSERT INTO search_post (id, document) "
+                f"SELECT p.id, setweight(to_tsvector('simple', coalesce(p.content, '')), 'A') || "
+                f"setweight(to_tsvector('simple', coalesce(c.name, '')), 'B') "
+                f"FROM {post} p LEFT JOIN {category} c ON c.id = p.category_id "
+                f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document"
+            )
+            cursor.execute(
+                f"INSERT INTO search_user (id, document) "
+                f"SELECT id, setweight(to_tsvector('simple', coalesce(username, '')), 'A') || "
+                f"setweight(to_tsvector('simple', coalesce(email, '')), 'B') FROM {user} "
+                f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for kind in KINDS:
+            cursor.execute(f"DROP TABLE IF EXISTS search_{kind}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administrator', '0007_user_can_chat'),
+        ('forum', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
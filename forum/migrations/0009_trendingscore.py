@@ -0,0 +1,67 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:41
+
+import math
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copy of the TRENDING settings this migration was written against
+HALF_LIFE_HOURS = 24
+MAX_WINDOW_DAYS = 30
+WEIGHTS = {'post': 1.0, 'view': 0.2, 'like': 2.0, 'comment': 3.0}
+
+
+def event_score(weight, when):
+    return when.timestamp() / (HALF_LIFE_HOURS * 3600 / math.log(2)) + math.log(weight)
+
+
+def combine(score, other):
+    high, low = max(score, other), min(score, other)
+    return high + math.log1p(math.exp(low - high))
+
+
+def backfill_scores(apps, schema_editor):
+    """Scores of the posts inside the maximum window, as forum.trending.rebuild_scores computes them."""
+    Post = apps.get_model('forum', 'Post')
+    Comment = apps.get_model('forum', 'Comment')
+    TrendingScore = apps.get_model('forum', 'TrendingScore')
+    cutoff = timezone.now() - timedelta(days=MAX_WINDOW_DAYS)
+
+    comment_times = {}
+    for post_id, created_at in Comment.objects.filter(post__created_at__gte=cutoff).values_list('post_id', 'created_at'):
+        comment_times.setdefault(post_id, []).append(created_at)
+
+    batch = []
+    for post in Post.objects.filter(created_at__gte=cutoff).only('id', 'created_at', 'views', 'likes_count').iterator(chunk_size=500):
+        score = event_score(WEIGHTS['post'] + WEIGHTS['view'] * post.views + WEIGHTS['like'] * post.likes_count, post.created_at)
+        for created_at in comment_times.get(post.id, ()):
+            score = combine(score, event_score(WEIGHTS['comment'], created_at))
+        batch.append(TrendingScore(post_id=post.id, score=score, created_at=post.created_at))
+        if len(batch) >= 500:
+            TrendingScore.objects.bulk_create(batch)
+            batch = []
+    TrendingScore.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='forum.post')),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score'], name='forum_trend_score_66792d_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
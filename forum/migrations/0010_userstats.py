@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def rebuild_user_stats(User, Post, Comment, Like, UserStats, batch_size=1000):
+    """Frozen copy of forum.user_stats.rebuild_user_stats, recomputes every user's stats."""
+    posts = Post.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    comments = Comment.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+    likes = Like.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        with transaction.atomic():
+            UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in batch], ignore_conflicts=True)
+            UserStats.objects.filter(user_id__in=batch).update(
+                total_posts=Coalesce(Subquery(posts.annotate(c=Count('id')).values('c')), Value(0)),
+                total_comments=Coalesce(Subquery(comments.annotate(c=Count('id')).values('c')), Value(0)),
+                total_likes=Coalesce(Subquery(likes.annotate(c=Count('id')).values('c')), Value(0)),
+                total_views=Coalesce(Subquery(posts.annotate(v=Sum('views')).values('v')), Value(0)),
+            )
+
+
+def backfill_user_stats(apps, schema_editor):
+    rebuild_user_stats(
+        apps.get_model('administrator', 'User'),
+        apps.get_model('forum', 'Post'),
+        apps.get_model('forum', 'Comment'),
+        apps.get_model('forum', 'Like'),
+        apps.get_model('forum', 'UserStats'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administrator', '0007_user_can_chat'),
+        ('forum', '0009_trendingscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_posts', models.PositiveIntegerField(default=0)),
+                ('total_comments', models.PositiveIntegerField(default=0)),
+                ('total_likes', models.PositiveIntegerField(default=0)),
+                ('total_views', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
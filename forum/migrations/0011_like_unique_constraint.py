@@ -0,0 +1,64 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:43
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Count, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def rebuild_user_stats(User, Post, Comment, Like, UserStats, batch_size=1000):
+    """Frozen copy of forum.user_stats.rebuild_user_stats, recomputes every user's stats."""
+    posts = Post.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    comments = Comment.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+    likes = Like.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        with transaction.atomic():
+            UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in batch], ignore_conflicts=True)
+            UserStats.objects.filter(user_id__in=batch).update(
+                total_posts=Coalesce(Subquery(posts.annotate(c=Count('id')).values('c')), Value(0)),
+                total_comments=Coalesce(Subquery(comments.annotate(c=Count('id')).values('c')), Value(0)),
+                total_likes=Coalesce(Subquery(likes.annotate(c=Count('id')).values('c')), Value(0)),
+                total_views=Coalesce(Subquery(posts.annotate(v=Sum('views')).values('v')), Value(0)),
+            )
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    Like = apps.get_model('forum', 'Like')
+    Post = apps.get_model('forum', 'Post')
+
+    duplicates = Like.objects.values('post', 'user').annotate(keep=Min('id'), n=Count('id')).filter(n__gt=1)
+    post_ids = set()
+    for row in duplicates:
+        Like.objects.filter(post=row['post'], user=row['user']).exclude(id=row['keep']).delete()
+        post_ids.add(row['post'])
+
+    if post_ids:
+        # Historical models send no signals, fix the counters by hand
+        for post_id in post_ids:
+            Post.objects.filter(pk=post_id).update(likes_count=Like.objects.filter(post_id=post_id).count())
+        rebuild_user_stats(
+            apps.get_model('administrator', 'User'),
+            Post,
+            apps.get_model('forum', 'Comment'),
+            Like,
+            apps.get_model('forum', 'UserStats'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique_like_per_user'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_like_unique_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewFlush',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('last_post_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,5 +1,5 @@
 from administrator.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 # Category model for grouping discussions
 class Category(models.Model):
@@ -20,6 +20,8 @@ class Post(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     content = models.TextField()
     views = models.PositiveIntegerField(default=0)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -27,6 +29,8 @@ class Post(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['created_at', 'category']),  # Index on created_at and category for optimization
+            models.Index(fields=['created_at', 'id']),  # Keyset pagination of the feed
+            models.Index(fields=['user', 'created_at', 'id']),  # Keyset pagination of a user's posts
         ]
 
     def __str__(self):
@@ -34,9 +38,11 @@ class Post(models.Model):
 
 
     def get_comments_count(self):
+        """Counts comments from the source table, use `comments_count` for reads."""
         return self.comment_set.count()
 
     def get_likes_count(self):
+        """Counts likes from the source table, use `likes_count` for reads."""
         return self.like_set.count() 
     
 # Comment model for post comments
@@ -50,12 +56,18 @@ class Comment(models.Model):
         ordering = ['created_at']
         indexes = [
             models.Index(fields=['created_at', 'post']),  # Index on created_at and post for optimization
+            models.Index(fields=['post', 'created_at', 'id']),  # Keyset pagination of a post's comments
         ]
 
     def __str__(self):
         content_preview = self.post.content[:30] + "..." if len(self.post.content) > 30 else self.post.content
         return f"Comment by {self.user.username} on {content_preview}"
 
+    def save(self, *args, **kwargs):
+        # Keep the insert and the Post.comments_count bump (forum.signals) in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     @classmethod
     def prefetch_post_comments(cls, queryset):
         """
@@ -69,9 +81,102 @@ class Comment(models.Model):
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_like_per_user'),
+        ]
     
     def __str__(self):
         return f"liked by {self.user.username} on {self.post}"
+
+    @classmethod
+    def toggle(cls, post_id, user):
+        """
+        Like or unlike a post in one transaction and return `(liked, likes_count)`,
+        or None when the post does not exist. The post row is locked first so
+        concurrent toggles queue up, the unique constraint makes double taps that
+        still race settle on a single like.
+        """
+        with transaction.atomic():
+            likes_count = (
+                Post.objects.select_for_update().filter(pk=post_id).values_list('likes_count', flat=True).first()
+            )
+            if likes_count is None:
+                return None
+
+            deleted, _ = cls.objects.filter(post_id=post_id, user=user).delete()
+            if deleted:
+                return False, max(likes_count - 1, 0)
+            try:
+                with transaction.atomic():
+                    cls.objects.create(post_id=post_id, user=user)
+            except IntegrityError:
+                # A concurrent request already liked it and bumped the count
+                return True, Post.objects.filter(pk=post_id).values_list('likes_count', flat=True).first()
+            return True, likes_count + 1
+
+    @classmethod
+    def liked_post_ids(cls, user, post_ids):
+        """
+        Return the subset of `post_ids` liked by `user` in a single query.
+        """
+        if not user or not user.is_authenticated or not post_ids:
+            return set()
+        return set(cls.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', flat=True))
+
+    def save(self, *args, **kwargs):
+        # Keep the insert and the Post.likes_count bump (forum.signals) in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     
-    
\ No newline at end of file
+    
+
+class TrendingScore(models.Model):
+    """
+    Decayed activity score of a post, maintained by forum.trending.
+
+    `score` is stored in log space relative to a fixed origin (forward decay),
+    so scores written at different times stay comparable without rescoring.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField()
+    created_at = models.DateTimeField()  # copy of Post.created_at for the window filter
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score']),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id}: {self.score:.3f}"
+
+
+class UserStats(models.Model):
+    """
+    Activity totals shown on a user's profile, kept current by forum.signals
+    and reconciled by the rebuild_user_stats command. Comments, likes and
+    views are the ones received on the user's posts.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_posts = models.PositiveIntegerField(default=0)
+    total_comments = models.PositiveIntegerField(default=0)
+    total_likes = models.PositiveIntegerField(default=0)
+    total_views = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+
+class PostViewFlush(models.Model):
+    """
+    Progress of a flush of the Redis view buffer, see forum.view_counter.
+    Batches are written in post id order and each commits together with
+    `last_post_id`, so a flush resumed after a crash skips what it wrote.
+    """
+    id = models.BigIntegerField(primary_key=True)  # flush id handed out by Redis
+    last_post_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Flush {self.id} up to post {self.last_post_id}"
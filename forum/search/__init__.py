@@ -0,0 +1,83 @@
+"""
+Search subsystem behind forum.views.SearchView.
+
+Posts and users are mirrored into a full-text index (SQLite FTS5 or Postgres
+tsvector, see backends.py) as they are saved, so a search costs the number of
+matches rather than a scan of the source tables.
+"""
+import re
+
+from django.db import connections
+
+from .backends import KINDS, backend_for
+
+MAX_TERMS = 8
+
+
+def get_backend(using='default'):
+    return backend_for(connections[using])
+
+
+def parse_terms(query):
+    """Split a raw query into lower-cased word terms, punctuation is dropped."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def post_document(post):
+    return post.id, (post.content, post.category.name if post.category_id else '')
+
+
+def user_document(user):
+    return user.id, (user.username, user.email)
+
+
+def index_post(post):
+    get_backend().index_many('post', [post_document(post)])
+
+
+def index_posts(posts):
+    get_backend().index_many('post', [post_document(post) for post in posts])
+
+
+def remove_post(post_id):
+    get_backend().remove('post', post_id)
+
+
+def index_user(user):
+    get_backend().index_many('user', [user_document(user)])
+
+
+def remove_user(user_id):
+    get_backend().remove('user', user_id)
+
+
+def search(kind, query, limit, offset=0):
+    """
+    Return `(ids, total)` for the `kind` objects matching every term of
+    `query`, best match first.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown search kind: {kind}")
+
+    terms = parse_terms(query)
+    if not terms:
+        return [], 0
+    return get_backend().search(kind, terms, limit, offset)
+
+
+def rebuild_index(post_queryset, user_queryset, batch_size=1000, using='default'):
+    """Repopulate the index from scratch, also used by the migration that creates it."""
+    backend = get_backend(using)
+    for kind, queryset, document in (
+        ('post', post_queryset.select_related('category').order_by('id'), post_document),
+        ('user', user_queryset.order_by('id'), user_document),
+    ):
+        backend.clear(kind)
+        batch = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            batch.append(document(obj))
+            if len(batch) >= batch_size:
+                backend.index_many(kind, batch)
+                batch = []
+        if batch:
+            backend.index_many(kind, batch)
@@ -0,0 +1,171 @@
+"""
+Full-text index backends.
+
+Every indexed kind gets its own table keyed by the object's primary key and
+holding the searchable fields listed in KINDS, so updates and deletes are
+primary-key operations and a query only touches matching rows.
+"""
+from django.db.models import Q
+
+# kind -> searchable fields, in weight order
+KINDS = {
+    'post': ('content', 'category'),
+    'user': ('username', 'email'),
+}
+
+
+def table_name(kind):
+    return f'search_{kind}'
+
+
+class SQLiteFTSBackend:
+    """SQLite FTS5 tables ranked with bm25, the object id is the FTS rowid."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for kind, fields in KINDS.items():
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table_name(kind)} USING fts5("
+                    f"{', '.join(fields)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for kind in KINDS:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name(kind)}")
+
+    def index_many(self, kind, rows):
+        fields = KINDS[kind]
+        placeholders = ', '.join(['%s'] * (len(fields) + 1))
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {table_name(kind)} (rowid, {', '.join(fields)}) VALUES ({placeholders})",
+                [(object_id, *values) for object_id, values in rows],
+            )
+
+    def remove(self, kind, object_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table_name(kind)} WHERE rowid = %s", [object_id])
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table_name(kind)}")
+
+    def search(self, kind, terms, limit, offset):
+        table = table_name(kind)
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table} WHERE {table} MATCH %s", [match])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank, rowid DESC LIMIT %s OFFSET %s",
+                [match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+
+class PostgresBackend:
+    """Weighted tsvector columns behind a GIN index, ranked with ts_rank."""
+    weights = 'ABCD'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for kind in KINDS:
+                table = table_name(kind)
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (id bigint PRIMARY KEY, document tsvector NOT NULL)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_document ON {table} USING GIN (document)")
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for kind in KINDS:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name(kind)}")
+
+    def index_many(self, kind, rows):
+        document = ' || '.join(
+            f"setweight(to_tsvector('simple', coalesce(%s, '')), '{self.weights[i]}')"
+            for i in range(len(KINDS[kind]))
+        )
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table_name(kind)} (id, document) VALUES (%s, {document}) "
+                f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+                [(object_id, *values) for object_id, values in rows],
+            )
+
+    def remove(self, kind, object_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table_name(kind)} WHERE id = %s", [object_id])
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {table_name(kind)}")
+
+    def search(self, kind, terms, limit, offset):
+        table = table_name(kind)
+        query = ' & '.join(f'{term}:*' for term in terms)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table} WHERE document @@ to_tsquery('simple', %s)", [query])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT id FROM {table}, to_tsquery('simple', %s) query WHERE document @@ query "
+                f"ORDER BY ts_rank(document, query) DESC, id DESC LIMIT %s OFFSET %s",
+                [query, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+
+class DatabaseBackend:
+    """
+    Fallback for databases without a native full-text engine: no index to
+    maintain, matches are found with icontains but still paginated.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+    def index_many(self, kind, rows):
+        pass
+
+    def remove(self, kind, object_id):
+        pass
+
+    def clear(self, kind):
+        pass
+
+    def search(self, kind, terms, limit, offset):
+        from administrator.models import User
+        from forum.models import Post
+
+        if kind == 'post':
+            queryset, lookups = Post.objects.all(), ('content', 'category__name')
+        else:
+            queryset, lookups = User.objects.all(), ('username', 'email')
+
+        for term in terms:
+            condition = Q()
+            for lookup in lookups:
+                condition |= Q(**{f'{lookup}__icontains': term})
+            queryset = queryset.filter(condition)
+
+        queryset = queryset.order_by('-id').values_list('id', flat=True)
+        return list(queryset[offset:offset + limit]), queryset.count()
+
+
+def backend_for(connection):
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend(connection)
+    if connection.vendor == 'postgresql':
+        return PostgresBackend(connection)
+    return DatabaseBackend(connection)
@@ -2,11 +2,40 @@ from django.conf import settings
 from rest_framework import serializers
 from rest_framework.exceptions import ParseError
 
+from administrator.avatars import avatar_url
 from administrator.models import User
 
 from .models import Category, Like, Post, Comment
 
 
+class LikedPostListSerializer(serializers.ListSerializer):
+    """
+    Resolves the posts of a page liked by the requesting user with one query
+    and shares the result with the child serializers via `liked_post_ids`.
+    """
+
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        if 'liked_post_ids' not in self.context:
+            request = self.context.get('request')
+            user = request.user if request else None
+            self.context['liked_post_ids'] = Like.liked_post_ids(user, [post.id for post in posts])
+        return super().to_representation(posts)
+
+
+class HasLikedMixin:
+
+    def get_has_liked(self, obj):
+        """Checks if the current user has liked this post"""
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return obj.id in liked_post_ids
+
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return obj.id in Like.liked_post_ids(request.user, [obj.id])
+
  
 class CategoryWriteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -49,7 +78,7 @@ class PostWriteSerializer(serializers.ModelSerializer):
         return instance
     
     
-class PostReadSerializer(serializers.ModelSerializer):
+class PostReadSerializer(HasLikedMixin, serializers.ModelSerializer):
     user = serializers.CharField(source="user.username", read_only=True)
     category = serializers.CharField(source="category.name", read_only=True)
     total_comment = serializers.SerializerMethodField()
@@ -64,29 +93,19 @@ class PostReadSerializer(serializers.ModelSerializer):
 
     def get_total_comment(self, obj):
         """Returns the total number of comments for this post"""
-        return obj.get_comments_count()
+        return obj.comments_count
     
     def get_likes(self, obj):
         """Returns the total number of likes for this post"""
-        return obj.get_likes_count()
+        return obj.likes_count
     
     def get_user_profile_picture(self, obj):
         """Returns the profile picture URL for the user"""
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.user.profile_picture.url)
-    
-    def get_has_liked(self, obj):
-        """Checks if the current user has liked this post"""
-        request = self.context.get('request')
-        user = request.user
-        
-        has_liked = Like.objects.filter(post=obj, user=user).exists()
-        
-        return has_liked
+        return avatar_url(self.context.get('request'), obj.user)
     
     
     
-class HomePostSerializer(serializers.ModelSerializer):
+class HomePostSerializer(HasLikedMixin, serializers.ModelSerializer):
     user = serializers.CharField(source="user.username", read_only=True)
     category = serializers.CharField(source="category.name", read_only=True)
     short_content = serializers.SerializerMethodField()
@@ -99,6 +118,7 @@ class HomePostSerializer(serializers.ModelSerializer):
         model = Post
         fields = ['id', 'short_content', 'likes', 'views', 'created_at', 'user', 'category','total_comment',
                   'user_profile_picture', 'has_liked']
+        list_serializer_class = LikedPostListSerializer
 
     def get_short_content(self, obj):
         """Returns the first 50 characters of content"""
@@ -106,25 +126,15 @@ class HomePostSerializer(serializers.ModelSerializer):
     
     def get_total_comment(self, obj):
         """Returns the total number of comments for this post"""
-        return obj.get_comments_count()
+        return obj.comments_count
     
     def get_likes(self, obj):
         """Returns the total number of likes for this post"""
-        return obj.get_likes_count()
+        return obj.likes_count
     
     def get_user_profile_picture(self, obj):
         """Returns the profile picture URL for the user"""
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.user.profile_picture.url)
-    
-    def get_has_liked(self, obj):
-        """Checks if the current user has liked this post"""
-        request = self.context.get('request')
-        user = request.user
-        
-        has_liked = Like.objects.filter(post=obj, user=user).exists()
-        
-        return has_liked
+        return avatar_url(self.context.get('request'), obj.user)
     
     
 class HomeTrendingPostSerializer(serializers.ModelSerializer):
@@ -143,7 +153,7 @@ class HomeTrendingPostSerializer(serializers.ModelSerializer):
     
     def get_total_comment(self, obj):
         """Returns the total number of comments for this post"""
-        return obj.get_comments_count()
+        return obj.comments_count
     
     
     
@@ -157,10 +167,7 @@ class HomeCommentSerializer(serializers.ModelSerializer):
 
     def get_user_profile_picture(self, obj):
         """Return absolute URL of the user's profile picture."""
-        request = self.context.get("request")
-        if obj.user.profile_picture:
-            return request.build_absolute_uri(obj.user.profile_picture.url)
-        return None
+        return avatar_url(self.context.get("request"), obj.user)
     
     
     
@@ -192,17 +199,18 @@ class SearchUserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "profile_picture"]
 
     def get_profile_picture(self, obj):
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.profile_picture.url)
+        return avatar_url(self.context.get('request'), obj)
     
     
     
-class SearchPostSerializer(serializers.ModelSerializer):
+class SearchPostSerializer(HasLikedMixin, serializers.ModelSerializer):
     category = serializers.CharField(source="category.name", read_only=True)
     short_content = serializers.SerializerMethodField()
+    has_liked = serializers.SerializerMethodField()
     class Meta:
         model = Post
-        fields = ["id", "short_content","category", "created_at"]
+        fields = ["id", "short_content","category", "created_at", "has_liked"]
+        list_serializer_class = LikedPostListSerializer
         
     def get_short_content(self, obj):
         """Returns the first 50 characters of content"""
@@ -0,0 +1,120 @@
+from django.db.models import F, Subquery
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from administrator.models import User
+from administrator.notifications import notify
+from kastina_forum.response_cache import invalidate_tags_on_commit
+
+from . import search, trending
+from .models import Category, Comment, Like, Post, UserStats
+from .user_stats import add_views, adjust_post_owner_stats, adjust_user_stats
+
+# Sent by forum.view_counter after buffered views are written, with counts={post_id: views}
+post_views_flushed = Signal()
+
+
+def adjust_post_counter(post_id, field, delta):
+    """Atomically shift a denormalized counter on a single post row, never below zero."""
+    queryset = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def notify_post_owner(post_id, actor, kind, message, once=False):
+    owner_id = Post.objects.filter(pk=post_id).values_list('user_id', flat=True).first()
+    notify(owner_id, kind, message, actor=actor, post_id=post_id, once=once)
+
+
+@receiver(post_save, sender=Like)
+def like_created(sender, instance, created, **kwargs):
+    if created:
+        adjust_post_counter(instance.post_id, "likes_count", 1)
+        adjust_post_owner_stats(instance.post_id, total_likes=1)
+        # Liking again after an unlike neither notifies nor trends twice
+        trending.record_once(instance.post_id, "like", instance.user_id)
+        notify_post_owner(
+            instance.post_id, instance.user, "like", f"{instance.user.username} liked your post", once=True
+        )
+
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, **kwargs):
+    adjust_post_counter(instance.post_id, "likes_count", -1)
+    adjust_post_owner_stats(instance.post_id, total_likes=-1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        adjust_post_counter(instance.post_id, "comments_count", 1)
+        adjust_post_owner_stats(instance.post_id, total_comments=1)
+        trending.record(instance.post_id, "comment")
+        notify_post_owner(instance.post_id, instance.user, "comment", f"{instance.user.username} commented on your post")
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    adjust_post_counter(instance.post_id, "comments_count", -1)
+    adjust_post_owner_stats(instance.post_id, total_comments=-1)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        trending.create_score(instance)
+        adjust_user_stats(instance.user_id, total_posts=1)
+    search.index_post(instance)
+
+
+@receiver(post_views_flushed)
+def post_views_recorded(sender, counts, **kwargs):
+    trending.record_many(counts, "view")
+    add_views(counts)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    # Read the stored views in SQL, the instance may predate the last flush.
+    # Comments and likes count themselves down as they are deleted.
+    views = Post.objects.filter(pk=instance.pk).values('views')[:1]
+    adjust_user_stats(instance.user_id, total_posts=-1, total_views=-Subquery(views))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    search.remove_post(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    # Posts are indexed with their category name, pick up renames
+    if not created:
+        search.index_posts(Post.objects.filter(category=instance).select_related('category').only(
+            'id', 'content', 'category__name'
+        ))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    invalidate_tags_on_commit('category', f'category:{instance.id}')
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'username', 'email'} & set(update_fields):
+        return
+    search.index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    search.remove_user(instance.id)
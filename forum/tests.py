@@ -1,3 +1,508 @@
-from django.test import TestCase
+import io
+import math
+from datetime import timedelta
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from kastina_forum.testing import IN_MEMORY_LAYERS, create_user
+
+from . import search, trending, view_counter
+from .models import Category, Comment, Like, Post, PostViewFlush, TrendingScore, UserStats
+from .serializers import HomePostSerializer
+from .signals import post_views_flushed
+from .view_counter import MemoryViewCounter, RedisViewCounter
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class CounterTests(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.fan = create_user('fan')
+        self.post = Post.objects.create(user=self.owner, content='hello')
+
+    def test_counters_follow_likes_and_comments(self):
+        like = Like.objects.create(post=self.post, user=self.fan)
+        comment = Comment.objects.create(post=self.post, user=self.fan, content='nice')
+
+        self.post.refresh_from_db()
+        stats = UserStats.objects.get(pk=self.owner.pk)
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (1, 1))
+        self.assertEqual((stats.total_likes, stats.total_comments), (1, 1))
+
+        like.delete()
+        comment.delete()
+        self.post.refresh_from_db()
+        stats.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (0, 0))
+        self.assertEqual((stats.total_likes, stats.total_comments), (0, 0))
+
+    def test_decrements_stop_at_zero(self):
+        like = Like.objects.create(post=self.post, user=self.fan)
+        # Counters that drifted to zero must not make the delete fail
+        Post.objects.filter(pk=self.post.pk).update(likes_count=0)
+        UserStats.objects.filter(pk=self.owner.pk).update(total_likes=0)
+
+        like.delete()
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(UserStats.objects.get(pk=self.owner.pk).total_likes, 0)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class HasLikedTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(user=self.user, content=f'post {i}') for i in range(6)]
+        for post in self.posts[::2]:
+            Like.objects.create(post=post, user=self.user)
+
+    def test_page_resolves_likes_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get('/forum/api/home/get/posts/', {'cursor': ''}).json()['results']
+
+        liked = {post.id for post in self.posts[::2]}
+        self.assertEqual({post['id']: post['has_liked'] for post in results}, {
+            post.id: post.id in liked for post in self.posts
+        })
+        like_queries = [query for query in queries.captured_queries if 'FROM "forum_like"' in query['sql']]
+        self.assertEqual(len(like_queries), 1)
+
+    def test_nothing_is_liked_without_a_request(self):
+        self.assertFalse(HomePostSerializer().get_has_liked(self.posts[0]))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class KeysetPaginationTests(TestCase):
+    url = '/forum/api/home/get/posts/'
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ids = [Post.objects.create(user=self.user, content=f'post {i}').id for i in range(25)]
+
+    def test_cursor_round_trip(self):
+        first = self.client.get(self.url, {'cursor': ''}).json()
+        self.assertEqual(len(first['results']), 20)
+        self.assertIsNone(first['previous'])
+
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next'])
+
+        # Newest first, every post exactly once
+        seen = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(seen, sorted(self.ids, reverse=True))
+
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([post['id'] for post in back['results']], [post['id'] for post in first['results']])
+        self.assertIsNone(back['previous'])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get(self.url, {'page': 2}).json()
+        self.assertEqual(response['count'], 25)
+        self.assertEqual(len(response['results']), 5)
+
+
+class FailOnce:
+    """post_views_flushed.send stand-in that fails the `nth` batch once."""
+
+    def __init__(self, nth):
+        self.nth = nth
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.calls == self.nth:
+            raise RuntimeError("database went away")
+        return []
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ViewCounterTests(TestCase):
+
+    def setUp(self):
+        user = create_user('author')
+        self.posts = [Post.objects.create(user=user, content=f'post {i}') for i in range(3)]
+
+    def record_views(self, counter):
+        for views, post in enumerate(self.posts, start=1):
+            for _ in range(views):
+                counter.incr(post.id)
+
+    def assert_views(self, expected):
+        self.assertEqual([Post.objects.get(pk=post.pk).views for post in self.posts], expected)
+
+    def flush_with_failure(self, counter, failure=None):
+        # One post per batch, the second batch fails
+        with mock.patch.object(view_counter, 'apply_view_counts', partial(view_counter.apply_view_counts, batch_size=1)):
+            with mock.patch.object(post_views_flushed, 'send', FailOnce(2)):
+                if failure is None:
+                    with self.assertLogs('forum.view_counter', 'ERROR'):
+                        counter.flush()
+                else:
+                    with self.assertRaises(failure):
+                        counter.flush()
+            self.assert_views([1, 0, 0])
+            with mock.patch.object(post_views_flushed, 'send', return_value=[]):
+                counter.flush()
+
+    def test_memory_flush_requeues_only_failed_batches(self):
+        counter = MemoryViewCounter(flush_interval=3600, flush_threshold=1000)
+        self.record_views(counter)
+        self.flush_with_failure(counter)
+        self.assert_views([1, 2, 3])
+        self.assertEqual(counter.pending, {})
+
+    def test_redis_flush_resumes_without_double_counting(self):
+        client = fakeredis.FakeRedis()
+        counter = RedisViewCounter(client, flush_interval=60)
+        self.record_views(counter)
+        # The flush_post_views loop logs the error and flushes again later
+        self.flush_with_failure(counter, failure=RuntimeError)
+        self.assert_views([1, 2, 3])
+        self.assertFalse(client.exists(counter.pending_key) or client.exists(counter.flushing_key))
+
+    def test_redis_views_recorded_during_a_flush_are_kept(self):
+        client = fakeredis.FakeRedis()
+        counter = RedisViewCounter(client, flush_interval=60)
+        counter.incr(self.posts[0].id)
+        client.rename(counter.pending_key, counter.flushing_key)
+        self.assertEqual(counter.incr(self.posts[0].id), 2)
+
+        counter.flush()
+        counter.flush()
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).views, 2)
+
+
+    def test_redis_crash_before_dropping_a_batch_does_not_reapply_it(self):
+        client = fakeredis.FakeRedis()
+        counter = RedisViewCounter(client, flush_interval=60)
+        self.record_views(counter)
+        real_hdel = client.hdel
+
+        def crash_on_second_batch(key, *fields):
+            if len(fields) == 1 and int(fields[0]) == self.posts[1].id:
+                raise ConnectionError("worker killed")
+            return real_hdel(key, *fields)
+
+        # The second batch commits, then the worker dies before removing it from the hash
+        with mock.patch.object(view_counter, 'apply_view_counts', partial(view_counter.apply_view_counts, batch_size=1)):
+            with mock.patch.object(client, 'hdel', side_effect=crash_on_second_batch):
+                with self.assertRaises(ConnectionError):
+                    counter.flush()
+            self.assert_views([1, 2, 0])
+            counter.flush()
+        self.assert_views([1, 2, 3])
+        self.assertFalse(PostViewFlush.objects.exists())
+
+    def test_redis_lock_is_renewed_and_kept_by_its_owner(self):
+        client = fakeredis.FakeRedis()
+        counter = RedisViewCounter(client, flush_interval=60)
+        token = counter.acquire_lock()
+        self.assertIsNone(counter.acquire_lock())
+
+        client.expire(counter.lock_key, 1)
+        counter.renew_lock(token)
+        self.assertGreater(client.ttl(counter.lock_key), 1)
+
+        # Someone else's lock is neither renewed nor released
+        client.set(counter.lock_key, 'other')
+        with self.assertLogs('forum.view_counter', 'WARNING'):
+            counter.renew_lock(token)
+        self.assertEqual(counter.flush(), 0)
+        self.assertEqual(client.get(counter.lock_key), b'other')
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('searcher')
+        self.category = Category.objects.create(name='sports')
+
+    def post_ids(self, query):
+        return search.search('post', query, 20)[0]
+
+    def test_prefix_matches(self):
+        post = Post.objects.create(user=self.user, content='Kubernetes deployment notes')
+        self.assertEqual(self.post_ids('kube'), [post.id])
+        self.assertEqual(self.post_ids('kube deploy'), [post.id])
+        self.assertEqual(self.post_ids('kube cooking'), [])
+
+    def test_category_name_matches(self):
+        post = Post.objects.create(user=self.user, category=self.category, content='match report')
+        self.assertEqual(self.post_ids('sports'), [post.id])
+
+        self.category.name = 'athletics'
+        self.category.save()
+        self.assertEqual(self.post_ids('athletics'), [post.id])
+        self.assertEqual(self.post_ids('sports'), [])
+
+    def test_edits_and_deletes_update_the_index(self):
+        post = Post.objects.create(user=self.user, content='first draft')
+        post.content = 'final version'
+        post.save()
+        self.assertEqual(self.post_ids('draft'), [])
+        self.assertEqual(self.post_ids('final'), [post.id])
+
+        post_id = post.id
+        post.delete()
+        self.assertEqual(self.post_ids('final'), [])
+        self.assertNotIn(post_id, self.post_ids('version'))
+
+    def test_profile_changes_update_the_user_index(self):
+        self.assertEqual(search.search('user', 'searcher', 20), ([self.user.id], 1))
+        self.user.username = 'finder'
+        self.user.email = 'finder@example.com'
+        self.user.save()
+        self.assertEqual(search.search('user', 'searcher', 20), ([], 0))
+        self.assertEqual(search.search('user', 'finder', 20), ([self.user.id], 1))
+
+    def test_view_pages_through_matches(self):
+        ids = [Post.objects.create(user=self.user, content=f'weekly digest {i}').id for i in range(25)]
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get('/forum/api/user/search/', {'query': 'digest', 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['page'], data['total_posts'], data['total_users']), (2, 25, 0))
+        # Equal ranks come newest first
+        self.assertEqual([post['id'] for post in data['posts']], sorted(ids, reverse=True)[20:])
+
+        self.assertEqual(client.get('/forum/api/user/search/', {'query': 'digest', 'page': 'x'}).status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class TrendingTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('author')
+        self.first, self.second = [Post.objects.create(user=self.user, content=f'post {i}') for i in range(2)]
+
+    def score(self, post):
+        return TrendingScore.objects.get(post=post).score
+
+    def test_record_adds_the_event_weight(self):
+        now = timezone.now()
+        with mock.patch.object(trending.timezone, 'now', return_value=now):
+            before = self.score(self.first)
+            trending.record(self.first.id, 'comment', count=2)
+        # log(e^before + 2w * e^(now / tau)), shifted by `before` to stay in float range
+        added = math.log(2 * settings.TRENDING['WEIGHTS']['comment']) + now.timestamp() / trending.tau()
+        self.assertAlmostEqual(self.score(self.first), before + math.log1p(math.exp(added - before)))
+
+    def test_combine_does_not_overflow(self):
+        self.assertAlmostEqual(trending.combine(math.log(2), math.log(3)), math.log(5))
+        # e^50000 is out of float range, the sum in log space is not
+        self.assertAlmostEqual(trending.combine(50000.0, 50000.0), 50000.0 + math.log(2))
+
+    def test_older_events_weigh_less(self):
+        half_life = timedelta(hours=settings.TRENDING['HALF_LIFE_HOURS'])
+        # Three likes three half-lives ago are worth less than one like now
+        with mock.patch.object(trending.timezone, 'now', return_value=timezone.now() - 3 * half_life):
+            trending.record(self.first.id, 'like', count=3)
+        trending.record(self.second.id, 'like')
+        self.assertEqual(trending.top_post_ids(2), [self.second.id, self.first.id])
+
+        trending.record(self.first.id, 'like')
+        self.assertEqual(trending.top_post_ids(2), [self.first.id, self.second.id])
+
+    def test_window_limits_post_age(self):
+        TrendingScore.objects.filter(post=self.first).update(created_at=timezone.now() - timedelta(days=10))
+        trending.record(self.first.id, 'like', count=10)
+
+        self.assertEqual(trending.top_post_ids(5), [self.second.id])
+        self.assertEqual(trending.top_post_ids(5, window_days=14), [self.first.id, self.second.id])
+        # Windows are clamped to [1, MAX_WINDOW_DAYS]
+        self.assertEqual(trending.top_post_ids(5, window_days=0), [self.second.id])
+        TrendingScore.objects.filter(post=self.first).update(created_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(trending.top_post_ids(5, window_days=365), [self.second.id])
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.json()['results']]
+
+    def test_view_validates_limit_and_window(self):
+        url = '/forum/api/home/get/trending/posts/'
+        client = APIClient()
+        client.force_authenticate(self.user)
+        trending.record(self.first.id, 'like')
+
+        self.assertEqual(self.ids(client.get(url)), [self.first.id, self.second.id])
+        self.assertEqual(self.ids(client.get(url, {'limit': 1})), [self.first.id])
+        self.assertEqual(len(self.ids(client.get(url, {'limit': -5}))), 1)
+        self.assertEqual(client.get(url, {'limit': 'many'}).status_code, 400)
+        self.assertEqual(client.get(url, {'window': 'week'}).status_code, 400)
+
+        TrendingScore.objects.filter(post=self.first).update(created_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(self.ids(client.get(url, {'window': 14})), [self.first.id, self.second.id])
+        self.assertEqual(self.ids(client.get(url)), [self.second.id])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.fan = create_user('fan')
+        self.post = Post.objects.create(user=self.owner, content='hello', views=7)
+        Like.objects.create(post=self.post, user=self.fan)
+        Comment.objects.create(post=self.post, user=self.fan, content='nice')
+
+    def test_profile_reads_one_row(self):
+        client = APIClient()
+        client.force_authenticate(self.fan)
+        UserStats.objects.filter(pk=self.owner.pk).update(total_views=7)
+
+        with self.assertNumQueries(1):
+            response = client.get('/forum/api/user/get/user/profile/owner/activities/')
+        self.assertEqual(response.json(), {
+            'total_posts': 1, 'total_comments': 1, 'total_likes': 1, 'total_views': 7,
+        })
+
+    def test_rebuild_repairs_drifted_and_missing_rows(self):
+        UserStats.objects.filter(pk=self.owner.pk).update(total_posts=5, total_likes=0)
+        UserStats.objects.filter(pk=self.fan.pk).delete()
+
+        call_command('rebuild_user_stats', stdout=io.StringIO())
+
+        self.assertEqual(
+            UserStats.objects.filter(pk=self.owner.pk).values_list(
+                'total_posts', 'total_comments', 'total_likes', 'total_views'
+            ).get(),
+            (1, 1, 1, 7),
+        )
+        self.assertTrue(UserStats.objects.filter(pk=self.fan.pk, total_posts=0).exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class CategoryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user('reader'))
+        self.category = Category.objects.create(name='news')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_writes_invalidate_cached_reads_after_commit(self):
+        url = f'/forum/api/category/details/{self.category.id}/'
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.category.name = 'old news'
+            self.category.save()
+            # Not committed yet, the entry still holds
+            self.assertEqual(self.get(url).data['name'], 'news')
+        for callback in callbacks:
+            callback()
+
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'old news')
+
+    def test_entries_are_kept_per_origin(self):
+        url = f'/forum/api/category/details/{self.category.id}/'
+        self.get(url)
+        self.assertEqual(self.client.get(url, HTTP_HOST='mirror.example.com')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, secure=True)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+    def test_new_category_invalidates_the_list(self):
+        url = '/forum/api/category/'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='sports')
+        self.assertIn('sports', str(self.get(url).data))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class LikeToggleTests(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.fan = create_user('fan')
+        self.post = Post.objects.create(user=self.owner, content='hello')
+
+    def test_toggle_alternates(self):
+        self.assertEqual(Like.toggle(self.post.id, self.fan), (True, 1))
+        self.assertEqual(Like.toggle(self.post.id, self.fan), (False, 0))
+        self.assertEqual(Like.toggle(self.post.id, self.fan), (True, 1))
+        self.assertEqual(Like.objects.filter(post=self.post, user=self.fan).count(), 1)
+
+    def test_one_like_per_user(self):
+        Like.objects.create(post=self.post, user=self.fan)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(post=self.post, user=self.fan)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    def test_concurrent_like_settles_on_one(self):
+        # The other request's like lands between our delete and insert
+        real_delete = Like.objects.filter(post=self.post, user=self.fan).delete
+
+        def delete_then_race(queryset):
+            result = real_delete()
+            Like.objects.create(post=self.post, user=self.fan)
+            return result
+
+        with mock.patch('django.db.models.query.QuerySet.delete', autospec=True, side_effect=delete_then_race):
+            liked, likes_count = Like.toggle(self.post.id, self.fan)
+
+        self.assertEqual((liked, likes_count), (True, 1))
+        self.assertEqual(Like.objects.filter(post=self.post, user=self.fan).count(), 1)
+
+    def test_missing_post_is_rejected_without_a_like(self):
+        client = APIClient()
+        client.force_authenticate(self.fan)
+        response = client.post(f'/forum/api/home/post/{self.post.id + 1}/like/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+    def test_like_endpoint_reports_the_new_count(self):
+        client = APIClient()
+        client.force_authenticate(self.fan)
+        url = f'/forum/api/home/post/{self.post.id}/like/'
+        with self.captureOnCommitCallbacks(execute=True):
+            liked = client.post(url)
+            unliked = client.post(url)
+        self.assertEqual((liked.status_code, liked.json()['likes']), (201, 1))
+        self.assertEqual((unliked.status_code, unliked.json()['likes']), (200, 0))
+
+    def test_like_state_endpoint(self):
+        other = Post.objects.create(user=self.owner, content='other')
+        Like.toggle(self.post.id, self.fan)
+        client = APIClient()
+        client.force_authenticate(self.fan)
+
+        results = client.get('/forum/api/home/get/posts/likes/', {'ids': f'{self.post.id},{other.id}'}).json()['results']
+        self.assertEqual(results, [
+            {'id': self.post.id, 'has_liked': True, 'likes': 1},
+            {'id': other.id, 'has_liked': False, 'likes': 0},
+        ])
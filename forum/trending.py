@@ -0,0 +1,140 @@
+"""
+Trending engine.
+
+Each event on a post (creation, view, like, comment) adds its weight to the
+post's score, decayed with a half-life of TRENDING["HALF_LIFE_HOURS"]. Using
+forward decay, an event at time t is worth `weight * e^(t / tau)`, so older
+scores never need rescoring: ordering by the stored sum is the same as
+ordering by the decayed sum at any instant. Sums are kept as natural logs to
+stay within float range and updated in SQL with a log-sum-exp, which keeps
+each event a single atomic UPDATE. Reading the top N is an index scan on
+TrendingScore.score.
+"""
+import math
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+
+def tau():
+    return settings.TRENDING["HALF_LIFE_HOURS"] * 3600 / math.log(2)
+
+
+def event_score(weight, when=None):
+    """Log-space score of one event of `weight` happening at `when`."""
+    when = when or timezone.now()
+    return when.timestamp() / tau() + math.log(weight)
+
+
+def combine(score, other):
+    """log(e^score + e^other) without overflowing."""
+    high, low = max(score, other), min(score, other)
+    return high + math.log1p(math.exp(low - high))
+
+
+def add_score_expression(value):
+    value = Value(value, output_field=FloatField())
+    return Greatest(F('score'), value) + Ln(Value(1.0) + Exp(-Abs(F('score') - value)))
+
+
+def record(post_id, event, count=1):
+    """Add `count` events of kind `event` (a TRENDING["WEIGHTS"] key) to a post."""
+    record_many({post_id: count}, event)
+
+
+def record_once(post_id, event, actor_id):
+    """
+    Record `event` the first time `actor_id` causes it on a post, so undoing
+    and redoing it, e.g. unliking and liking again, adds nothing. The marks
+    live in the cache for TRENDING["MAX_WINDOW_DAYS"] and are only set once
+    the transaction commits, an event that rolled back counts when retried.
+    """
+    key = f'trending:once:{event}:{post_id}:{actor_id}'
+    if cache.get(key) is None:
+        record(post_id, event)
+        transaction.on_commit(lambda: cache.set(key, 1, settings.TRENDING["MAX_WINDOW_DAYS"] * 86400))
+
+
+def record_many(counts, event):
+    from .models import TrendingScore
+
+    weight = settings.TRENDING["WEIGHTS"][event]
+    now = timezone.now()
+    for post_id, count in counts.items():
+        if count > 0:
+            TrendingScore.objects.filter(post_id=post_id).update(
+                score=add_score_expression(event_score(weight * count, now))
+            )
+
+
+def create_score(post):
+    from .models import TrendingScore
+
+    TrendingScore.objects.create(
+        post=post,
+        score=event_score(settings.TRENDING["WEIGHTS"]["post"], post.created_at),
+        created_at=post.created_at,
+    )
+
+
+def window_from(days=None):
+    if days is None:
+        days = settings.TRENDING["WINDOW_DAYS"]
+    days = min(max(days, 1), settings.TRENDING["MAX_WINDOW_DAYS"])
+    return timezone.now() - timedelta(days=days)
+
+
+def top_post_ids(limit, window_days=None):
+    from .models import TrendingScore
+
+    return list(
+        TrendingScore.objects.filter(created_at__gte=window_from(window_days))
+        .order_by('-score')
+        .values_list('post_id', flat=True)[:limit]
+    )
+
+
+def rebuild_scores(Post, Comment, TrendingScore, batch_size=500):
+    """
+    Recompute scores of posts inside the maximum window from the source
+    tables and drop rows that fell out of it. Likes and views carry no
+    timestamp, so they are counted at the post's creation time.
+    """
+    weights = settings.TRENDING["WEIGHTS"]
+    cutoff = timezone.now() - timedelta(days=settings.TRENDING["MAX_WINDOW_DAYS"])
+
+    TrendingScore.objects.filter(created_at__lt=cutoff).delete()
+
+    posts = Post.objects.filter(created_at__gte=cutoff).only('id', 'created_at', 'views', 'likes_count').order_by('id')
+    # Comment timestamps in one query, in post order, walked alongside the posts
+    comments = groupby(
+        Comment.objects.filter(post__created_at__gte=cutoff).order_by('post_id')
+        .values_list('post_id', 'created_at').iterator(chunk_size=batch_size),
+        key=itemgetter(0),
+    )
+    post_comments = next(comments, None)
+
+    batch = []
+    for post in posts.iterator(chunk_size=batch_size):
+        weight = weights["post"] + weights["view"] * post.views + weights["like"] * post.likes_count
+        score = event_score(weight, post.created_at)
+        while post_comments is not None and post_comments[0] < post.id:
+            post_comments = next(comments, None)
+        if post_comments is not None and post_comments[0] == post.id:
+            for _, created_at in post_comments[1]:
+                score = combine(score, event_score(weights["comment"], created_at))
+            post_comments = next(comments, None)
+        batch.append(TrendingScore(post_id=post.id, score=score, created_at=post.created_at))
+
+        if len(batch) >= batch_size:
+            TrendingScore.objects.bulk_create(batch, update_conflicts=True, unique_fields=['post'], update_fields=['score', 'created_at'])
+            batch = []
+    if batch:
+        TrendingScore.objects.bulk_create(batch, update_conflicts=True, unique_fields=['post'], update_fields=['score', 'created_at'])
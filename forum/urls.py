@@ -33,6 +33,7 @@ urlpatterns = [
                 path("get/trending/posts/", TopCommentedPostsView.as_view()),
                 path("get/post/<int:post_id>/comments/", HomePostCommentsView.as_view()),
                 path("post/<int:post_id>/like/", HomeLikePostView.as_view()),
+                path("get/posts/likes/", HomeLikeStateView.as_view()),
                 path("create/post/comment/", HomeCommentCreateView.as_view()),
             ]
         )
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+
+def shifted(deltas):
+    # Counters are unsigned, a decrement that would go below zero stops at zero
+    return {field: Greatest(F(field) + delta, Value(0)) for field, delta in deltas.items()}
+
+
+def adjust_user_stats(user_id, **deltas):
+    """Atomically shift UserStats counters of one user, e.g. total_posts=1."""
+    from .models import UserStats
+
+    if user_id is not None:
+        UserStats.objects.filter(pk=user_id).update(**shifted(deltas))
+
+
+def adjust_post_owner_stats(post_id, **deltas):
+    """Same as adjust_user_stats for the author of `post_id`, in one UPDATE."""
+    from .models import Post, UserStats
+
+    owner = Post.objects.filter(pk=post_id).values('user_id')[:1]
+    UserStats.objects.filter(pk=Subquery(owner)).update(**shifted(deltas))
+
+
+def add_views(counts):
+    """Add flushed view counts ({post_id: views}) to the authors' totals."""
+    from .models import Post, UserStats
+
+    per_user = {}
+    for post_id, user_id in Post.objects.filter(id__in=counts).values_list('id', 'user_id'):
+        if user_id is not None:
+            per_user[user_id] = per_user.get(user_id, 0) + counts[post_id]
+    if per_user:
+        UserStats.objects.filter(pk__in=per_user).update(
+            total_views=F('total_views') + Case(
+                *[When(pk=user_id, then=Value(views)) for user_id, views in per_user.items()],
+                default=Value(0),
+            )
+        )
+
+
+def rebuild_user_stats(User, Post, Comment, Like, UserStats, batch_size=1000):
+    """
+    Recompute every user's stats from the source tables, creating missing
+    rows.
+    """
+    posts = Post.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    comments = Comment.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+    likes = Like.objects.filter(post__user=OuterRef('pk')).order_by().values('post__user')
+
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        with transaction.atomic():
+            UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in batch], ignore_conflicts=True)
+            UserStats.objects.filter(user_id__in=batch).update(
+                total_posts=Coalesce(Subquery(posts.annotate(c=Count('id')).values('c')), Value(0)),
+                total_comments=Coalesce(Subquery(comments.annotate(c=Count('id')).values('c')), Value(0)),
+                total_likes=Coalesce(Subquery(likes.annotate(c=Count('id')).values('c')), Value(0)),
+                total_views=Coalesce(Subquery(posts.annotate(v=Sum('views')).values('v')), Value(0)),
+            )
@@ -0,0 +1,222 @@
+import atexit
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Value, When
+from redis.exceptions import WatchError
+
+from kastina_forum.redis_client import get_redis
+
+from .models import Post, PostViewFlush
+from .signals import post_views_flushed
+
+logger = logging.getLogger(__name__)
+
+
+def apply_view_counts(counts, batch_size=500, on_applied=None, flush_id=None):
+    """
+    Add buffered view counts ({post_id: views}) to Post.views with one
+    UPDATE per batch, then announce them through `post_views_flushed`.
+    Each batch commits on its own, `on_applied(batch)` is called after each
+    commit so callers can drop exactly what was written.
+
+    With a `flush_id`, batches go in post id order and each commits along
+    with its PostViewFlush progress: counts the flush already wrote, e.g.
+    before a crash kept them from being dropped, are only passed to
+    `on_applied` again.
+    """
+    items = sorted((post_id, views) for post_id, views in counts.items() if views)
+    if flush_id is not None:
+        done, _ = PostViewFlush.objects.get_or_create(pk=flush_id)
+        written = dict(item for item in items if item[0] <= done.last_post_id)
+        items = [item for item in items if item[0] > done.last_post_id]
+        if written and on_applied is not None:
+            on_applied(written)
+
+    applied = 0
+    for start in range(0, len(items), batch_size):
+        batch = dict(items[start:start + batch_size])
+        with transaction.atomic():
+            if flush_id is not None:
+                # Locked, so a second flusher that lost the race sees the batch as written
+                done = PostViewFlush.objects.select_for_update().get(pk=flush_id)
+                if done.last_post_id >= max(batch):
+                    batch = {}
+                else:
+                    done.last_post_id = max(batch)
+                    done.save(update_fields=['last_post_id'])
+            if batch:
+                Post.objects.filter(id__in=batch).update(
+                    views=F('views') + Case(
+                        *[When(id=post_id, then=Value(views)) for post_id, views in batch.items()],
+                        default=Value(0),
+                    )
+                )
+                post_views_flushed.send(sender=Post, counts=batch)
+        applied += len(batch)
+        if on_applied is not None:
+            on_applied(dict(items[start:start + batch_size]))
+    return applied
+
+
+class MemoryViewCounter:
+    """
+    Per-process buffer, flushed by a background thread every FLUSH_INTERVAL
+    seconds or as soon as FLUSH_THRESHOLD posts are pending, never by the
+    request that records the view. Pending counts are drained at interpreter
+    exit, so a clean restart loses nothing; use the Redis backend to survive
+    crashes.
+    """
+
+    def __init__(self, flush_interval, flush_threshold):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        atexit.register(self.flush)
+
+    def incr(self, post_id):
+        with self.lock:
+            self.pending[post_id] = self.pending.get(post_id, 0) + 1
+            count = self.pending[post_id]
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='post-view-flusher', daemon=True)
+                self.thread.start()
+            if len(self.pending) >= self.flush_threshold:
+                self.wake.set()
+        return count
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            finally:
+                # The thread keeps its own connection, drop it if it went bad
+                close_old_connections()
+
+    def flush(self):
+        with self.lock:
+            counts, self.pending = self.pending, {}
+        if not counts:
+            return 0
+        applied = set()
+        try:
+            return apply_view_counts(counts, on_applied=applied.update)
+        except Exception:
+            logger.exception("Failed to flush %s buffered post views", len(counts) - len(applied))
+            # Batches that committed are written already, only requeue the rest
+            with self.lock:
+                for post_id, views in counts.items():
+                    if post_id not in applied:
+                        self.pending[post_id] = self.pending.get(post_id, 0) + views
+            return len(applied)
+
+
+class RedisViewCounter:
+    """
+    Shared buffer in a Redis hash, flushed by the flush_post_views command.
+    A flush renames the hash to a processing key first, so increments keep
+    landing in a fresh hash, gives it a flush id and removes each batch's
+    fields once the batch commits. A flush that dies halfway is picked up
+    again by the next one, which skips the batches recorded as written under
+    the same flush id (see apply_view_counts), so nothing is counted twice.
+    Only one process flushes at a time; its lock is renewed after every
+    batch, however long the flush takes.
+    """
+    pending_key = 'forum:post_views:pending'
+    flushing_key = 'forum:post_views:flushing'
+    flush_id_key = 'forum:post_views:flush_id'
+    sequence_key = 'forum:post_views:flush_sequence'
+    lock_key = 'forum:post_views:lock'
+
+    def __init__(self, client, flush_interval):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.lock_timeout = max(int(flush_interval), 60)
+
+    def incr(self, post_id):
+        try:
+            pipe = self.client.pipeline()
+            pipe.hincrby(self.pending_key, post_id, 1)
+            pipe.hget(self.flushing_key, post_id)
+            pending, flushing = pipe.execute()
+        except Exception:
+            # A lost view is better than a failed page
+            logger.exception("Could not record a view of post %s", post_id)
+            return 0
+        return pending + int(flushing or 0)
+
+    def acquire_lock(self):
+        token = uuid.uuid4().hex
+        return token if self.client.set(self.lock_key, token, nx=True, ex=self.lock_timeout) else None
+
+    def if_locked_by(self, token, action):
+        """Run `action(pipe)` atomically if the lock still holds `token`, returns whether it did."""
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.lock_key)
+                if pipe.get(self.lock_key) != token.encode():
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def renew_lock(self, token):
+        if not self.if_locked_by(token, lambda pipe: pipe.expire(self.lock_key, self.lock_timeout)):
+            # Written batches are recorded, another flusher taking over skips them
+            logger.warning("Lost the post view flush lock, flushing on")
+
+    def flush(self):
+        token = self.acquire_lock()
+        if token is None:
+            return 0  # another process is flushing
+
+        try:
+            if not self.client.exists(self.flushing_key):
+                if not self.client.exists(self.pending_key):
+                    return 0
+                self.client.rename(self.pending_key, self.flushing_key)
+                self.client.delete(self.flush_id_key)
+            # Nothing was written under a flush id yet if it is missing
+            flush_id = self.client.get(self.flush_id_key)
+            if flush_id is None:
+                flush_id = self.client.incr(self.sequence_key)
+                self.client.set(self.flush_id_key, flush_id)
+            flush_id = int(flush_id)
+
+            def applied(batch):
+                # The hash is gone once its last field is removed
+                self.client.hdel(self.flushing_key, *batch)
+                self.renew_lock(token)
+
+            counts = {int(k): int(v) for k, v in self.client.hgetall(self.flushing_key).items()}
+            flushed = apply_view_counts(counts, on_applied=applied, flush_id=flush_id)
+            self.client.delete(self.flush_id_key)
+            PostViewFlush.objects.filter(pk__lte=flush_id).delete()
+            return flushed
+        finally:
+            self.if_locked_by(token, lambda pipe: pipe.delete(self.lock_key))
+
+
+_counter = None
+
+
+def get_view_counter():
+    global _counter
+    if _counter is None:
+        config = settings.POST_VIEW_COUNTER
+        if config["BACKEND"] == "redis":
+            _counter = RedisViewCounter(get_redis(), config["FLUSH_INTERVAL"])
+        else:
+            _counter = MemoryViewCounter(config["FLUSH_INTERVAL"], config["FLUSH_THRESHOLD"])
+    return _counter
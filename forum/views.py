@@ -1,4 +1,4 @@
-from django.db.models import Count, Sum, Q, F
+from django.conf import settings
 
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
@@ -6,22 +6,27 @@ from asgiref.sync import async_to_sync
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status, generics
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 
 
 from administrator.models import User
 from administrator.permissions import CanCommentPermission, CanPostPermission, IsSuperAdminPermission
+from kastina_forum.pagination import KeysetPagination
+from kastina_forum.response_cache import CachedResponseMixin
 from .serializers import CategoryWriteSerializer, CommentWriteSerializer, HomeCommentSerializer, HomePostSerializer, HomeTrendingPostSerializer, PostReadSerializer, PostWriteSerializer, SearchPostSerializer, SearchUserSerializer
-from .models import Category, Like, Post, Comment
+from . import search, trending
+from .models import Category, Like, Post, Comment, UserStats
+from .view_counter import get_view_counter
 # Create your views here.
 
 
 
 
-class CategoryListCreateView(generics.ListCreateAPIView):
+class CategoryListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
+    cache_tags = ('category',)
     queryset = Category.objects.all()
     serializer_class = CategoryWriteSerializer
 
@@ -43,8 +48,9 @@ class CategoryUpdateView(generics.UpdateAPIView):
     
     
     
-class CategoryDetailView(generics.RetrieveAPIView):
+class CategoryDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
+    cache_tags = ('category:{id}',)
     serializer_class = CategoryWriteSerializer
     queryset = Category.objects.all()
     lookup_field = "id"
@@ -81,17 +87,17 @@ class PostUpdateView(generics.UpdateAPIView):
 class PostDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = PostReadSerializer
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('user', 'category')
     lookup_field = "id"
     lookup_url_kwarg = "id"
     
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.views = F("views") + 1  # Increment views using F() for atomic update
-        instance.save(update_fields=["views"])  # Save only the views field
-        instance.refresh_from_db()  # Refresh the instance to get updated views count
-        return super().retrieve(request, *args, **kwargs)
+        # Views are buffered and flushed in batches, show the stored total plus what is pending
+        instance.views += get_view_counter().incr(instance.id)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
     
     
     
@@ -102,27 +108,29 @@ class RandomPostsView(generics.ListAPIView):
 
     def get_queryset(self):
         return Post.objects.select_related('user', 'category').only(
-            'id', 'content', 'views', 'created_at',
-            'user__username', 'category__name'
+            'id', 'content', 'views', 'likes_count', 'comments_count', 'created_at',
+            'user__username', 'user__profile_picture', 'user__avatar_thumbnail', 'category__name'
         )
 
     
-    pagination_class = PageNumberPagination
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
     
     
 
 class UserRandomPostsView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = HomePostSerializer
-    pagination_class = PageNumberPagination
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         username = self.kwargs['username']
 
         # Query the posts filtered by the provided username
         queryset = Post.objects.select_related('user', 'category').only(
-            'id', 'content', 'views', 'created_at',
-            'user__username', 'category__name'
+            'id', 'content', 'views', 'likes_count', 'comments_count', 'created_at',
+            'user__username', 'user__profile_picture', 'user__avatar_thumbnail', 'category__name'
         ).filter(user__username=username)
 
         # Order the posts randomly
@@ -135,40 +143,42 @@ class UserProfileActivitiesView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, username):
-        # Get user object
-        user = User.objects.filter(username=username).first()
-
-        if not user:
-            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        posts_count = Post.objects.filter(user=user).count()
-
-        comments_count = Comment.objects.filter(post__user=user).count()
+        # Totals are kept current in UserStats, see forum.signals
+        stats = UserStats.objects.filter(user__username=username).values(
+            'total_posts', 'total_comments', 'total_likes', 'total_views'
+        ).first()
 
-        likes_count = Like.objects.filter(post__user=user).count()
+        if stats is None:
+            if not User.objects.filter(username=username).exists():
+                return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+            stats = {"total_posts": 0, "total_comments": 0, "total_likes": 0, "total_views": 0}
 
-        total_views = Post.objects.filter(user=user).aggregate(Sum('views'))['views__sum'] or 0
-
-        # Prepare data to return
-        data = {
-            "total_posts": posts_count,
-            "total_comments": comments_count,
-            "total_likes": likes_count,
-            "total_views": total_views
-        }
-
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(stats, status=status.HTTP_200_OK)
 
     
     
 class TopCommentedPostsView(generics.ListAPIView):
+    """
+    Top trending posts from the decayed scores kept by forum.trending.
+    Accepts ?limit= (default 4) and ?window= in days.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = HomeTrendingPostSerializer  
+    default_limit = 4
+    max_limit = 20
 
     def get_queryset(self):
-        return Post.objects.annotate(comment_count=Count('comment')).select_related('user', 'category').only(
-            'id', 'user__username', 'category__name'
-        ).order_by('-comment_count')[:4]
+        try:
+            limit = min(int(self.request.query_params.get('limit', self.default_limit)), self.max_limit)
+            window = int(self.request.query_params['window']) if 'window' in self.request.query_params else None
+        except ValueError:
+            raise ValidationError("'limit' and 'window' must be numbers")
+
+        post_ids = trending.top_post_ids(max(limit, 1), window)
+        posts = Post.objects.select_related('user', 'category').only(
+            'id', 'content', 'comments_count', 'created_at', 'user__username', 'category__name'
+        ).in_bulk(post_ids)
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
         
         
 class HomePostCommentsView(generics.ListAPIView):
@@ -177,6 +187,8 @@ class HomePostCommentsView(generics.ListAPIView):
     Fetch paginated comments for a given post.
     """
     serializer_class = HomeCommentSerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('created_at', 'id')
 
     def get_queryset(self):
         post_id = self.kwargs.get("post_id")
@@ -198,29 +210,48 @@ class HomePostCommentsView(generics.ListAPIView):
 class HomeLikePostView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request, post_id, *args, **kwargs):
-        user = request.user
-        
-        # Check if the post exists
-        try:
-            post = Post.objects.get(id=post_id)
-        except Post.DoesNotExist:
+        toggled = Like.toggle(post_id, request.user)
+        if toggled is None:
             return Response({"error": "Post not found"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Check if the user has already liked the post
-        existing_like = Like.objects.filter(post=post, user=user).first()
-        
-        if existing_like:
-            existing_like.delete()
-            return Response({"message": "Post unliked successfully"}, status=status.HTTP_200_OK)
-        else:
-            try:
-                Like.objects.create(post=post, user=user)
-                return Response({"message": "Post liked successfully"}, status=status.HTTP_201_CREATED)
-            except:
-                return Response({"error": "Failed to like/unlike the post"}, status=status.HTTP_400_BAD_REQUEST)
+
+        liked, likes_count = toggled
+
+        if liked:
+            return Response({"message": "Post liked successfully", "has_liked": True, "likes": likes_count},
+                            status=status.HTTP_201_CREATED)
+        return Response({"message": "Post unliked successfully", "has_liked": False, "likes": likes_count},
+                        status=status.HTTP_200_OK)
             
             
             
+class HomeLikeStateView(APIView):
+    """
+    Like state and counts for several posts at once: ?ids=1,2,3
+    """
+    permission_classes = [IsAuthenticated]
+    max_ids = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            post_ids = [int(value) for value in request.query_params.get("ids", "").split(",") if value.strip()]
+        except ValueError:
+            return Response({"error": "'ids' must be a comma separated list of post ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not post_ids:
+            return Response({"error": "Query parameter 'ids' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(post_ids) > self.max_ids:
+            return Response({"error": f"At most {self.max_ids} ids are allowed"}, status=status.HTTP_400_BAD_REQUEST)
+
+        counts = dict(Post.objects.filter(id__in=post_ids).values_list('id', 'likes_count'))
+        liked = Like.liked_post_ids(request.user, list(counts))
+
+        results = [
+            {"id": post_id, "has_liked": post_id in liked, "likes": counts[post_id]}
+            for post_id in dict.fromkeys(post_ids) if post_id in counts
+        ]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 
 class HomeCommentCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated, CanCommentPermission]
@@ -233,16 +264,8 @@ class HomeCommentCreateView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        # The post owner is notified by forum.signals
         self.perform_create(serializer)
-        
-        # channel_layer = get_channel_layer()
-        # async_to_sync(channel_layer.group_send)(
-        #     "notifications_group",
-        #     {
-        #         "type": "notification_message",
-        #         "message": "A new post has been made!"
-        #     }
-        # )
         return Response({"detail": "commented"}, status=status.HTTP_201_CREATED)
 
         
@@ -257,12 +280,31 @@ class SearchView(APIView):
         if not query:
             return Response({"error": "Query parameter 'query' is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Search for users matching the query
-        users = User.objects.filter(Q(username__icontains=query) | Q(email__icontains=query))
-        user_data = SearchUserSerializer(users, many=True, context={"request": request}).data
+        try:
+            page = max(int(request.query_params.get("page", 1)), 1)
+        except ValueError:
+            return Response({"error": "Query parameter 'page' must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        offset = (page - 1) * page_size
+
+        # Search for users matching the query, ranked by the search index
+        user_ids, total_users = search.search("user", query, page_size, offset)
+        users = User.objects.in_bulk(user_ids)
+        user_data = SearchUserSerializer(
+            [users[user_id] for user_id in user_ids if user_id in users], many=True, context={"request": request}
+        ).data
 
         # Search for posts matching the query
-        posts = Post.objects.filter(Q(content__icontains=query) | Q(category__name__icontains=query))
-        post_data = SearchPostSerializer(posts, many=True).data
-
-        return Response({"users": user_data, "posts": post_data}, status=status.HTTP_200_OK)
\ No newline at end of file
+        post_ids, total_posts = search.search("post", query, page_size, offset)
+        posts = Post.objects.select_related('category').in_bulk(post_ids)
+        post_data = SearchPostSerializer(
+            [posts[post_id] for post_id in post_ids if post_id in posts], many=True, context={"request": request}
+        ).data
+
+        return Response({
+            "users": user_data,
+            "posts": post_data,
+            "page": page,
+            "total_users": total_users,
+            "total_posts": total_posts,
+        }, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -1,15 +1,19 @@
 import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kastina_forum.settings')
+
+# Set up Django before importing consumers and middlewares, they import models and auth at module level
+django_asgi_app = get_asgi_application()
+
 from administrator import consumers, middlewares
 from chat import consumers as chatConsumer
-from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.urls import path
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kastina_forum.settings')
-
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": middlewares.JWTAuthMiddleware( 
             AuthMiddlewareStack(
             URLRouter([
@@ -18,4 +22,4 @@ application = ProtocolTypeRouter({
             ])
         )
     ),
-})
\ No newline at end of file
+})
@@ -0,0 +1,115 @@
+"""
+WebSocket wire formats.
+
+Sockets speak JSON unless the client offers the COMPACT_SUBPROTOCOL in
+Sec-WebSocket-Protocol, in which case frames are msgpack maps whose keys are
+shortened through FIELD_CODES, nested maps included. Clients may send either
+kind of frame.
+"""
+import json
+import uuid
+from collections import OrderedDict
+from functools import cached_property
+
+import msgpack
+
+COMPACT_SUBPROTOCOL = 'kastina.msgpack.v1'
+
+# Append only, codes are part of the protocol
+FIELD_CODES = {
+    'id': 'i',
+    'message': 'm',
+    'content': 'c',
+    'user': 'u',
+    'users': 'us',
+    'profile_picture': 'p',
+    'user_profile_picture': 'up',
+    'is_typing': 't',
+    'timestamp': 'ts',
+    'total_members': 'n',
+    'online_members': 'o',
+    'history': 'h',
+    'notifications': 'ns',
+    'kind': 'k',
+    'post': 'po',
+    'actor': 'a',
+    'created_at': 'ca',
+    'error': 'e',
+    'retry_after': 'r',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+# Encoded broadcast frames kept per process, see encode_frames
+FRAME_CACHE_SIZE = 256
+_frames = OrderedDict()
+
+
+def rename_keys(value, names):
+    if isinstance(value, dict):
+        return {names.get(key, key): rename_keys(item, names) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rename_keys(item, names) for item in value]
+    return value
+
+
+def encode_json(payload):
+    return json.dumps(payload)
+
+
+def encode_compact(payload):
+    return msgpack.packb(rename_keys(payload, FIELD_CODES))
+
+
+def encode_frames(payload):
+    """
+    A broadcast payload for a channel layer event, forwarded by send_frames.
+    Nothing is encoded here: each wire form is encoded the first time a
+    socket of a receiving process needs it and reused for that process's
+    other sockets, so a form none of the recipients speaks is never built.
+    """
+    return {'frame': uuid.uuid4().hex, 'payload': payload}
+
+
+def frame_data(event, compact):
+    """The `compact` or JSON form of an encode_frames() event, encoded once per process."""
+    key = (event['frame'], compact)
+    data = _frames.get(key)
+    if data is None:
+        data = _frames[key] = encode_compact(event['payload']) if compact else encode_json(event['payload'])
+        if len(_frames) > FRAME_CACHE_SIZE:
+            _frames.popitem(last=False)
+    return data
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    """Payload of a received frame with full field names."""
+    if bytes_data is not None:
+        return rename_keys(msgpack.unpackb(bytes_data), FIELD_NAMES)
+    return json.loads(text_data)
+
+
+class CompactProtocolMixin:
+    """
+    For AsyncWebsocketConsumer: accept() picks the compact subprotocol when
+    the client offers it and send_payload() encodes for the socket's format.
+    """
+
+    @cached_property
+    def compact(self):
+        return COMPACT_SUBPROTOCOL in self.scope.get('subprotocols', ())
+
+    async def accept(self, subprotocol=None, headers=None):
+        await super().accept(COMPACT_SUBPROTOCOL if self.compact else subprotocol, headers)
+
+    async def send_payload(self, payload):
+        if self.compact:
+            await self.send(bytes_data=encode_compact(payload))
+        else:
+            await self.send(text_data=encode_json(payload))
+
+    async def send_frames(self, event):
+        """Forward a payload broadcast with encode_frames()."""
+        if self.compact:
+            await self.send(bytes_data=frame_data(event, compact=True))
+        else:
+            await self.send(text_data=frame_data(event, compact=False))
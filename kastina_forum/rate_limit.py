@@ -0,0 +1,181 @@
+"""
+Sliding window rate limits.
+
+Each key counts hits in fixed windows of `period` seconds and estimates
+the rolling count as the current window plus the previous one weighted by
+how much of it still overlaps the rolling window. That keeps two counters
+per key instead of a timestamp per hit, and there is no burst at window
+edges as with plain fixed windows. Rejected hits are not counted, as with
+DRF's own throttles.
+
+The backend is RATE_LIMIT["BACKEND"], "redis" to share limits between
+workers or "memory" for a single process. Views use the DRF throttles
+below, rates are set in REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"].
+"""
+import re
+import threading
+import time
+from collections.abc import Mapping
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from kastina_forum.redis_client import get_redis
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Parse "<limit>/<period>" such as "5/min", "100/hour" or "20/10s" into (limit, seconds)."""
+    limit, period = rate.split('/')
+    multiplier, unit = re.fullmatch(r'(\d*)([a-z]+)', period).groups()
+    return int(limit), int(multiplier or 1) * PERIODS[unit[0]]
+
+
+def estimate(previous, current, elapsed, period):
+    return previous * (1 - elapsed / period) + current
+
+
+def retry_after(previous, current, elapsed, period, limit):
+    """Seconds until one more hit fits under `limit`."""
+    if current >= limit or not previous:
+        # The current window alone is full, it becomes the previous one at the boundary
+        return period - elapsed
+    return max(period * (1 - (limit - current - 1) / previous) - elapsed, 0)
+
+
+class MemoryRateLimiter:
+    """Per-process counters, each worker enforces its own limits."""
+
+    # Hits between sweeps of keys that have been idle for two windows
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def hit(self, key, limit, period):
+        """Record a hit on `key` if it fits under `limit` per `period`, returns (allowed, retry_after)."""
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        with self.lock:
+            self.hits += 1
+            if self.hits % self.SWEEP_EVERY == 0:
+                self._sweep(now)
+
+            start, previous, current, _ = self.windows.get(key, (window, 0, 0, period))
+            if start != window:
+                # Roll over, anything older than the previous window no longer counts
+                previous = current if start == window - 1 else 0
+                current = 0
+            if estimate(previous, current + 1, elapsed, period) > limit:
+                self.windows[key] = (window, previous, current, period)
+                return False, retry_after(previous, current, elapsed, period, limit)
+            self.windows[key] = (window, previous, current + 1, period)
+            return True, 0
+
+    def _sweep(self, now):
+        for key in [key for key, (start, _, _, period) in self.windows.items() if start < now // period - 1]:
+            del self.windows[key]
+
+
+class RedisRateLimiter:
+
+    def __init__(self, client):
+        self.client = client
+
+    def window_key(self, key, window):
+        return f'ratelimit:{key}:{window}'
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        current_key = self.window_key(key, window)
+
+        pipe = self.client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, period * 2)
+        pipe.get(self.window_key(key, window - 1))
+        current, _, previous = pipe.execute()
+        previous = int(previous or 0)
+
+        if estimate(previous, current, elapsed, period) > limit:
+            # Take the rejected hit back so it does not extend the limit
+            self.client.decr(current_key)
+            return False, retry_after(previous, current - 1, elapsed, period, limit)
+        return True, 0
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        if settings.RATE_LIMIT["BACKEND"] == "redis":
+            _limiter = RedisRateLimiter(get_redis())
+        else:
+            _limiter = MemoryRateLimiter()
+    return _limiter
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Throttles by `view.throttle_scope`. The rate is read from
+    DEFAULT_THROTTLE_RATES["<throttle_scope>_<suffix>"], views without
+    one are not throttled by this class.
+    """
+    suffix = None
+
+    def get_ident_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}_{self.suffix}') if scope else None
+        if rate is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+
+        limit, period = parse_rate(rate)
+        allowed, self.retry_after = get_rate_limiter().hit(f'{scope}:{self.suffix}:{ident}', limit, period)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    """Limits each client address, honouring NUM_PROXIES like DRF's throttles."""
+    suffix = 'ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class AccountRateThrottle(SlidingWindowThrottle):
+    """
+    Limits each targeted account, whichever address the attempts come from.
+    The account is named by `view.throttle_account_field`, a URL argument or
+    a field of the request body, and is keyed as submitted: no lookup runs
+    before the view, so an email and a username have separate budgets.
+    """
+    suffix = 'account'
+
+    def get_ident_key(self, request, view):
+        field = view.throttle_account_field
+        if field in view.kwargs:
+            return view.kwargs[field]
+        # Bodies that are not objects, e.g. a JSON array, name no account
+        if not isinstance(request.data, Mapping):
+            return None
+        value = request.data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None
+        return value.strip().lower()
@@ -0,0 +1,15 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Return a shared client for settings.REDIS_URL, or None when Redis is not
+    configured so callers can fall back to their in-memory implementation.
+    """
+    global _client
+    if _client is None and settings.REDIS_URL:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
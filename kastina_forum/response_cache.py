@@ -0,0 +1,100 @@
+"""
+Response cache for read-heavy endpoints that rarely change.
+
+Entries are tagged by model and id (e.g. "category" and "category:3"). Each
+tag has a version stored in the cache and the versions are part of every
+entry key, so invalidating a tag is a single write that orphans all its
+entries, which then age out with RESPONSE_CACHE["TIMEOUT"].
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+
+def _key(*parts):
+    return ':'.join([settings.RESPONSE_CACHE["KEY_PREFIX"], *map(str, parts)])
+
+
+def tag_versions(tags):
+    keys = {tag: _key('tag', tag) for tag in tags}
+    stored = cache.get_many(list(keys.values()))
+    versions = []
+    for tag, key in keys.items():
+        version = stored.get(key)
+        if version is None:
+            # A fresh, time based version cannot collide with one that was evicted
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        versions.append(f"{tag}={version}")
+    return versions
+
+
+def invalidate_tags(*tags):
+    cache.set_many({_key('tag', tag): time.time_ns() for tag in tags}, None)
+
+
+def invalidate_tags_on_commit(*tags):
+    """
+    Invalidate once the current transaction commits. Bumping earlier would let
+    a concurrent read cache the old rows under the new versions.
+    """
+    transaction.on_commit(lambda: invalidate_tags(*tags))
+
+
+def build_key(request, view, tags):
+    # Responses carry absolute links (pagination, media), so the origin is part of the key
+    raw = '|'.join([
+        type(view).__name__, request.scheme, request.get_host(), request.get_full_path(), *tag_versions(tags)
+    ])
+    return _key('entry', hashlib.md5(raw.encode()).hexdigest())
+
+
+def record(outcome):
+    key = _key('stats', outcome)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def stats():
+    counters = cache.get_many([_key('stats', 'hit'), _key('stats', 'miss')])
+    hits = counters.get(_key('stats', 'hit'), 0)
+    misses = counters.get(_key('stats', 'miss'), 0)
+    return {
+        "backend": settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1],
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+class CachedResponseMixin:
+    """
+    Serve GET responses of a DRF view from the cache. Authentication and
+    permissions still run first, only the handler is skipped on a hit.
+    """
+    cache_tags = ()
+
+    def get_cache_tags(self):
+        return [tag.format(**self.kwargs) for tag in self.cache_tags]
+
+    def get(self, request, *args, **kwargs):
+        key = build_key(request, self, self.get_cache_tags())
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record('miss')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE["TIMEOUT"])
+        response['X-Cache'] = 'MISS'
+        return response
@@ -119,6 +119,8 @@ DATABASES = {
     }
 }
 
+REDIS_URL = os.environ.get("REDIS_URL")
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -130,6 +132,124 @@ CHANNEL_LAYERS = {
 
 
 
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Tag-invalidated API response cache, see kastina_forum.response_cache
+RESPONSE_CACHE = {
+    "TIMEOUT": 300,  # seconds, upper bound on staleness if an invalidation is missed
+    "KEY_PREFIX": "response",
+}
+
+# Post views are buffered ("redis" or "memory") and flushed to Post.views in batches,
+# by the flush_post_views command (Procfile "views") with Redis or a thread of each process in memory
+POST_VIEW_COUNTER = {
+    "BACKEND": "redis" if REDIS_URL else "memory",
+    "FLUSH_INTERVAL": 30,  # seconds
+    "FLUSH_THRESHOLD": 500,  # pending posts, memory backend only
+}
+
+
+# Trending posts: every event adds its weight to an exponentially decaying score
+TRENDING = {
+    "HALF_LIFE_HOURS": 24,
+    "WINDOW_DAYS": 7,  # default age limit of trending posts, ?window= overrides it
+    "MAX_WINDOW_DAYS": 30,
+    "WEIGHTS": {
+        "post": 1.0,
+        "view": 0.2,
+        "like": 2.0,
+        "comment": 3.0,
+    },
+}
+
+
+# Chat messages are buffered per process and written with bulk_create, see chat.writer
+CHAT_MESSAGE_WRITER = {
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 0.5,  # seconds
+    # 0-255, unique per process. Defaults to the Heroku dyno number (web.N) modulo 256 or 0 with
+    # DEBUG, otherwise the first chat message fails without it. Past 256 dynos web.N and
+    # web.N+256 share a worker id and can collide, set CHAT_WORKER_ID explicitly there.
+    "WORKER_ID": (
+        int(os.environ["CHAT_WORKER_ID"]) if os.environ.get("CHAT_WORKER_ID")
+        else int(os.environ["DYNO"].rsplit(".", 1)[1]) % 256 if os.environ.get("DYNO", "").startswith("web.")
+        else 0 if DEBUG else None
+    ),
+}
+
+
+# Online users per chat group ("redis" or "memory"), see chat.presence
+CHAT_PRESENCE = {
+    "BACKEND": "redis" if REDIS_URL else "memory",
+    "TTL": 60,  # seconds without a heartbeat before a user counts as offline
+    "HEARTBEAT_INTERVAL": 20,  # seconds
+}
+
+
+# Typing indicators are coalesced into one frame per group and interval, see chat.typing
+CHAT_TYPING = {
+    "BACKEND": "redis" if REDIS_URL else "memory",
+    "INTERVAL": 1.0,  # seconds between frames of a group
+    "DEBOUNCE": 1.0,  # seconds between typing reports of one socket
+    "TTL": 4,  # seconds a report keeps a user listed as typing
+    "STALE_AFTER": 2,  # seconds, older frames are dropped instead of sent
+}
+
+
+# Last messages of each chat group, sent on connect and used for the first page, see chat.history
+CHAT_HISTORY = {
+    "BACKEND": "redis" if REDIS_URL else "memory",
+    "SIZE": 50,  # keep above REST_FRAMEWORK["PAGE_SIZE"]
+}
+
+
+# Users authenticated on WebSocket handshakes are cached per user id, see administrator.middlewares
+WS_USER_CACHE = {
+    "TIMEOUT": 300,  # seconds, changes to the user drop the entry sooner
+}
+
+
+# Chat group rows are cached by name for socket handshakes, see chat.consumers.get_group
+CHAT_GROUP_CACHE = {
+    "TIMEOUT": 300,  # seconds, changes to the group or its memberships drop the entry sooner
+}
+
+
+# Access tokens carry the user's permission flags, checked against a cached auth version, see administrator.authentication
+JWT_CLAIMS = {
+    "VERSION_TIMEOUT": 300,  # seconds, changes to the user drop the entry sooner
+}
+
+
+# Email verification and password reset codes live in the cache, see administrator.verification
+VERIFICATION = {
+    "TOKEN_TTL": 600,  # seconds
+    "MAX_ATTEMPTS": 5,  # wrong codes for an account before its active code is revoked
+    "STALE_ACCOUNT_DAYS": 7,  # unverified accounts older than this are removed by sweep_verifications
+    "SWEEP_BATCH_SIZE": 500,
+}
+
+
+# Sliding window rate limits ("redis" or "memory"), see kastina_forum.rate_limit.
+# HTTP rates are in REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"].
+RATE_LIMIT = {
+    "BACKEND": "redis" if REDIS_URL else "memory",
+    "CHAT_MESSAGES": "20/10s",  # per user across all chat groups
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -174,9 +294,9 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "Media")
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 if DEBUG:
-    EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+    EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', "django.core.mail.backends.smtp.EmailBackend")
 else:
-    EMAIL_BACKEND ='django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
     
 EMAIL_HOST = os.getenv('EMAIL_HOST')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT'))
@@ -184,6 +304,16 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS') == 'True'
 EMAIL_FROM = os.getenv('EMAIL_FROM')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')  # file backend only
+
+# Views queue mail in OutgoingEmail, the send_queued_emails worker delivers it
+EMAIL_OUTBOX = {
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 6,
+    "RETRY_BASE": 30,  # seconds before the first retry, doubled on each failure
+    "RETRY_MAX": 3600,  # seconds
+    "LEASE": 300,  # seconds a claimed batch may take before another worker picks it up
+}
 
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -237,7 +367,7 @@ SIMPLE_JWT = {
 REST_FRAMEWORK = {
     "NON_FIELD_ERRORS_KEY": "errors",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "administrator.authentication.ClaimsJWTAuthentication",
     ),
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.JSONRenderer",
@@ -250,6 +380,15 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
     ),
     "EXCEPTION_HANDLER": "drf_standardized_errors.handler.exception_handler",
+    # Scopes are set with throttle_scope on the administrator auth views
+    "DEFAULT_THROTTLE_RATES": {
+        "login_ip": "20/min",
+        "login_account": "5/min",
+        "verify_ip": "10/min",
+        "verify_account": "10/hour",
+        "email_ip": "10/hour",
+        "email_account": "3/hour",
+    },
 
 }
 
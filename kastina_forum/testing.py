@@ -0,0 +1,19 @@
+"""
+Helpers shared by the test suites of all apps.
+"""
+import uuid
+
+from django.contrib.auth import get_user_model
+
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def create_user(username, **fields):
+    """An active user with a working password and a unique state code."""
+    return get_user_model().objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password123',
+        state_code=uuid.uuid4().hex[:15],
+        **{'is_active': True, **fields},
+    )